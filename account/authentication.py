@@ -0,0 +1,96 @@
+from urllib.parse import parse_qs
+
+from channels.db import database_sync_to_async
+from channels.middleware import BaseMiddleware
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+from .models import User
+
+
+def user_key(user_id):
+    return f"auth:user:{user_id}"
+
+
+# Everything but the password, which stays out of the cache.
+CACHED_FIELDS = [
+    field.attname for field in User._meta.concrete_fields if field.name != "password"
+]
+
+
+def get_cached_user(user_id):
+    """Return the user with ``user_id`` and the password digest simplejwt puts
+    in revocable tokens, or None, caching hits for ``USER_CACHE_TTL``.
+    """
+    key = user_key(user_id)
+    cached = cache.get(key)
+    if cached is None:
+        row = User.objects.filter(pk=user_id).values_list(*CACHED_FIELDS, "password")
+        row = row.first()
+        if row is None:
+            return None
+        cached = (row[:-1], get_md5_hash_password(row[-1]))
+        cache.set(key, cached, settings.USER_CACHE_TTL.total_seconds())
+    values, password_digest = cached
+    return User.from_db(User.objects.db, CACHED_FIELDS, values), password_digest
+
+
+def invalidate_user(user_id):
+    key = user_key(user_id)
+    cache.delete(key)
+    # Again after commit, for requests that cached the old row meanwhile.
+    transaction.on_commit(lambda: cache.delete(key))
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """simplejwt authentication that resolves users through the user cache."""
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+        cached = get_cached_user(user_id)
+        if cached is None:
+            raise AuthenticationFailed(_("User not found"), code="user_not_found")
+        user, password_digest = cached
+        if not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != password_digest:
+                raise AuthenticationFailed(
+                    _("The user's password has been changed."), code="password_changed"
+                )
+        return user
+
+
+def user_from_token(raw_token):
+    """Return the active user of an access token, or None if it is invalid."""
+    try:
+        return CachedJWTAuthentication().get_user(AccessToken(raw_token))
+    except (TokenError, InvalidToken, AuthenticationFailed):
+        return None
+
+
+class JWTAuthMiddleware(BaseMiddleware):
+    """Sets ``scope["user"]`` from the ``?token=`` access token of a
+    WebSocket connection, using the same checks as the REST API.
+    """
+
+    async def __call__(self, scope, receive, send):
+        token = parse_qs(scope["query_string"].decode()).get("token")
+        user = None
+        if token:
+            user = await database_sync_to_async(user_from_token)(token[0])
+        scope = dict(scope, user=user or AnonymousUser())
+        return await super().__call__(scope, receive, send)
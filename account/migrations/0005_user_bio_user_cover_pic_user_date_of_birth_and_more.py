@@ -0,0 +1,63 @@
+# Generated by Django 5.0.6 on 2026-10-18 19:13
+
+import account.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("account", "0004_user_is_staff"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="user",
+            name="bio",
+            field=models.TextField(max_length=103, null=True),
+        ),
+        migrations.AddField(
+            model_name="user",
+            name="cover_pic",
+            field=models.ImageField(
+                blank=True,
+                default="user_cover_pic/_MG_0525.JPG",
+                null=True,
+                upload_to="user_cover_pic",
+            ),
+        ),
+        migrations.AddField(
+            model_name="user",
+            name="date_of_birth",
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="user",
+            name="gender",
+            field=models.CharField(
+                choices=[("M", "Male"), ("F", "Female"), ("O", "Other")],
+                max_length=6,
+                null=True,
+            ),
+        ),
+        migrations.AddField(
+            model_name="user",
+            name="is_verified",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name="user",
+            name="profile_pic",
+            field=models.ImageField(
+                blank=True,
+                default=account.models.get_random_default_pfp,
+                null=True,
+                upload_to="user_avatar",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="user",
+            name="last_name",
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+    ]
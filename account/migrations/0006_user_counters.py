@@ -0,0 +1,28 @@
+# Generated by Django 5.0.6 on 2026-10-18 19:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("account", "0005_user_bio_user_cover_pic_user_date_of_birth_and_more"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="user",
+            name="num_followers",
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="user",
+            name="num_following",
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="user",
+            name="num_posts",
+            field=models.IntegerField(default=0, editable=False),
+        ),
+    ]
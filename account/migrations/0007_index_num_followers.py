@@ -0,0 +1,18 @@
+# Generated by Django 5.0.6 on 2026-10-18 19:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("account", "0006_user_counters"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="user",
+            name="num_followers",
+            field=models.IntegerField(db_index=True, default=0, editable=False),
+        ),
+    ]
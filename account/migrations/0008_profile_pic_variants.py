@@ -0,0 +1,18 @@
+# Generated by Django 5.0.6 on 2026-10-18 19:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("account", "0007_index_num_followers"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="user",
+            name="profile_pic_variants",
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.0.6 on 2026-10-18 19:15
+
+import account.models
+import api.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("account", "0008_profile_pic_variants"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="user",
+            name="cover_pic",
+            field=models.ImageField(
+                blank=True,
+                default="user_cover_pic/_MG_0525.JPG",
+                null=True,
+                storage=api.storage.blob_storage,
+                upload_to="user_cover_pic",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="user",
+            name="profile_pic",
+            field=models.ImageField(
+                blank=True,
+                default=account.models.get_random_default_pfp,
+                null=True,
+                storage=api.storage.blob_storage,
+                upload_to="user_avatar",
+            ),
+        ),
+    ]
@@ -2,6 +2,8 @@ from django.db import models
 from django.contrib.auth.models import BaseUserManager, AbstractBaseUser
 import random
 
+from api.storage import blob_storage
+
 
 def get_random_default_pfp():
     peep_count = 105
@@ -51,12 +53,16 @@ class User(AbstractBaseUser):
     username = models.CharField(max_length=50, unique=True)
     profile_pic = models.ImageField(
         upload_to="user_avatar",
+        storage=blob_storage,
         null=True,
         blank=True,
         default=get_random_default_pfp,
     )
+    # Resized WebP copies of profile_pic, see social.images
+    profile_pic_variants = models.JSONField(default=dict, blank=True, editable=False)
     cover_pic = models.ImageField(
         upload_to="user_cover_pic",
+        storage=blob_storage,
         null=True,
         blank=True,
         default="user_cover_pic/_MG_0525.JPG",
@@ -76,6 +82,9 @@ class User(AbstractBaseUser):
     is_verified = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    num_followers = models.IntegerField(default=0, editable=False, db_index=True)
+    num_following = models.IntegerField(default=0, editable=False)
+    num_posts = models.IntegerField(default=0, editable=False)
 
     objects = UserManager()
 
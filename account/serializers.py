@@ -1,6 +1,8 @@
 from djoser.serializers import UserCreateSerializer as BaseUserCreateSerializer
 from djoser.serializers import UserSerializer as BaseUserSerializer
 from rest_framework import serializers
+from social.follows import is_following
+from social.images import variant_urls
 from .models import User
 
 
@@ -11,10 +13,12 @@ class UserCreateSerializer(BaseUserCreateSerializer):
 
 
 class UserSerializer(BaseUserSerializer):
-    follower_count = serializers.SerializerMethodField()
-    following_count = serializers.SerializerMethodField()
+    follower_count = serializers.IntegerField(source="num_followers", read_only=True)
+    following_count = serializers.IntegerField(source="num_following", read_only=True)
+    post_count = serializers.IntegerField(source="num_posts", read_only=True)
     full_name = serializers.SerializerMethodField()
     is_following = serializers.SerializerMethodField()
+    profile_pic_variants = serializers.SerializerMethodField()
 
     class Meta(BaseUserSerializer.Meta):
         model = User
@@ -27,6 +31,7 @@ class UserSerializer(BaseUserSerializer):
             "last_name",
             "full_name",
             "profile_pic",
+            "profile_pic_variants",
             "cover_pic",
             "bio",
             "gender",
@@ -53,20 +58,16 @@ class UserSerializer(BaseUserSerializer):
             "updated_at",
         ]
 
-    def get_follower_count(self, obj):
-        return obj.follower_count()
-
-    def get_following_count(self, obj):
-        return obj.following_count()
-
     def get_full_name(self, obj):
         return obj.get_full_name()
 
-    def get_post_count(self, obj):
-        return obj.post_count()
+    def get_profile_pic_variants(self, obj):
+        return variant_urls(
+            obj.profile_pic, obj.profile_pic_variants, self.context.get("request")
+        )
 
     def get_is_following(self, obj):
         request = self.context.get("request")
         if request and request.user.is_authenticated:
-            return obj.followers.filter(user=request.user).exists()
+            return is_following(request.user.id, obj.id)
         return False
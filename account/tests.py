@@ -1,3 +1,99 @@
-from django.test import TestCase
+import pickle
+from unittest import mock
 
-# Create your tests here.
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.core.cache import cache
+from django.db import connection
+from django.test import TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APITestCase
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from notifications.routing import websocket_urlpatterns
+from social.tests import LocalServicesMixin, make_user
+from .authentication import JWTAuthMiddleware, user_from_token, user_key
+
+
+class CachedAuthenticationTests(LocalServicesMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = make_user("alice")
+        self.token = str(AccessToken.for_user(self.user))
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.token}")
+
+    def get_me(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/api/auth/users/me/")
+        user_queries = [
+            query["sql"] for query in queries if 'FROM "account_user"' in query["sql"]
+        ]
+        return response, len(user_queries)
+
+    def test_users_are_cached_between_requests(self):
+        response, first = self.get_me()
+        self.assertEqual(response.data["username"], "alice")
+        self.assertEqual(first, 1)
+        response, second = self.get_me()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(second, 0)
+
+    def test_saving_a_user_invalidates_the_cache(self):
+        self.get_me()
+        self.user.is_active = False
+        self.user.save()
+        response, user_queries = self.get_me()
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(user_queries, 1)
+
+    def test_deleted_users_are_rejected(self):
+        self.get_me()
+        self.user.delete()
+        self.assertEqual(self.get_me()[0].status_code, 401)
+
+    def test_passwords_are_not_cached(self):
+        self.get_me()
+        cached = pickle.dumps(cache.get(user_key(self.user.pk)))
+        self.assertNotIn(self.user.password.encode(), cached)
+
+    def test_tokens_are_revoked_by_password_changes(self):
+        with mock.patch.object(api_settings, "CHECK_REVOKE_TOKEN", True):
+            token = AccessToken.for_user(self.user)
+            self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {token}")
+            self.assertEqual(self.get_me()[0].status_code, 200)
+            self.user.set_password("changed")
+            self.user.save()
+            self.assertEqual(self.get_me()[0].status_code, 401)
+
+    def test_user_from_token(self):
+        self.assertEqual(user_from_token(self.token), self.user)
+        self.assertIsNone(user_from_token("not-a-token"))
+        self.user.is_active = False
+        self.user.save()
+        self.assertIsNone(user_from_token(self.token))
+
+
+class SocketAuthenticationTests(LocalServicesMixin, TransactionTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = make_user("alice")
+
+    def communicator(self, query):
+        return WebsocketCommunicator(
+            JWTAuthMiddleware(URLRouter(websocket_urlpatterns)),
+            f"/ws/notifications/{query}",
+        )
+
+    async def test_sockets_authenticate_with_the_access_token(self):
+        token = AccessToken.for_user(self.user)
+        communicator = self.communicator(f"?token={token}")
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        self.assertIn("unread_counts", await communicator.receive_json_from())
+        await communicator.disconnect()
+
+    async def test_sockets_without_a_valid_token_are_closed(self):
+        for query in ("", "?token=not-a-token"):
+            connected, _ = await self.communicator(query).connect()
+            self.assertFalse(connected)
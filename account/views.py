@@ -3,7 +3,6 @@ from rest_framework.generics import get_object_or_404, RetrieveAPIView
 from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
 from .models import User
-from social.models import Follower
 from .serializers import UserSerializer
 
 
@@ -18,15 +17,6 @@ class UserDetailView(RetrieveAPIView):
 
     def retrieve(self, request, *args, **kwargs):
         instance = self.get_object()
+        # is_following comes from the serializer, via the follow-graph cache.
         serializer = self.get_serializer(instance, context={"request": request})
-        data = serializer.data
-
-        # Determine if the authenticated user is following the profile user
-        if request.user.is_authenticated:
-            data["is_following"] = Follower.objects.filter(
-                user=request.user, followed=instance
-            ).exists()
-        else:
-            data["is_following"] = False
-
-        return Response(data)
+        return Response(serializer.data)
@@ -1,7 +1,8 @@
 import os
 from django.core.asgi import get_asgi_application
 from channels.routing import ProtocolTypeRouter, URLRouter
-from channels.auth import AuthMiddlewareStack
+from account.authentication import JWTAuthMiddleware
+from api.media import ZeroCopyMedia
 import chat.routing
 import notifications.routing  # Add this import
 
@@ -9,8 +10,8 @@ os.environ.setdefault("DJANGO_SETTINGS_MODULE", "api.settings")
 
 application = ProtocolTypeRouter(
     {
-        "http": get_asgi_application(),
-        "websocket": AuthMiddlewareStack(
+        "http": ZeroCopyMedia(get_asgi_application()),
+        "websocket": JWTAuthMiddleware(
             URLRouter(
                 chat.routing.websocket_urlpatterns
                 + notifications.routing.websocket_urlpatterns  # Add this line
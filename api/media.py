@@ -0,0 +1,201 @@
+import mimetypes
+import os
+import re
+import stat
+from io import BytesIO
+from urllib.parse import quote
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.handlers.asgi import ASGIRequest
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+from django.views.decorators.http import require_safe
+
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+DIGEST_RE = re.compile(r"[0-9a-f]{64}")
+
+
+class FileRange:
+    """Reads ``length`` bytes of ``file`` from its current position. Keeps
+    ``fileno`` so WSGI servers can still hand the range to sendfile().
+    """
+
+    def __init__(self, file, length):
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+
+def parse_range(header, size):
+    """Return ``(first, last)`` byte positions for a single-range header,
+    None if it cannot be satisfied, or False to ignore it and send the
+    whole file (malformed or multiple ranges).
+    """
+    match = RANGE_RE.match(header.strip())
+    if match is None:
+        return False
+    if size == 0:
+        # An empty file has no bytes to satisfy any range.
+        return None
+    first, last = match.groups()
+    if not first:
+        if not last:
+            return False
+        suffix = int(last)
+        return (max(size - suffix, 0), size - 1) if suffix else None
+    first = int(first)
+    if last and int(last) < first:
+        return False
+    if first >= size:
+        return None
+    return first, min(int(last), size - 1) if last else size - 1
+
+
+def media_response(request, path):
+    """Build the response for the media file at ``path``.
+
+    Answers conditional requests with 304, serves single byte ranges with
+    206, and in X-Accel-Redirect mode leaves the body to the proxy.
+    """
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+        info = os.stat(full_path)
+    except (SuspiciousFileOperation, FileNotFoundError, NotADirectoryError):
+        raise Http404
+    if not stat.S_ISREG(info.st_mode):
+        raise Http404
+
+    content_type, encoding = mimetypes.guess_type(full_path)
+    response = HttpResponse(content_type=content_type or "application/octet-stream")
+    if encoding:
+        response["Content-Encoding"] = encoding
+    immutable = re.search(settings.MEDIA_IMMUTABLE_PATTERN, path)
+    digest = immutable and DIGEST_RE.search(immutable.group())
+    if digest:
+        # Content named after its hash keeps the tag when the file is
+        # rewritten, restored or served from another replica.
+        response["ETag"] = f'"{digest.group()}"'
+    else:
+        response["ETag"] = f'"{info.st_size:x}-{info.st_mtime_ns:x}"'
+    response["Last-Modified"] = http_date(info.st_mtime)
+    response["Accept-Ranges"] = "bytes"
+    if immutable:
+        patch_cache_control(response, public=True, max_age=31536000, immutable=True)
+    else:
+        max_age = int(settings.MEDIA_CACHE_MAX_AGE.total_seconds())
+        patch_cache_control(response, public=True, max_age=max_age)
+
+    if settings.MEDIA_ACCEL_REDIRECT:
+        response["X-Accel-Redirect"] = settings.MEDIA_ACCEL_REDIRECT + quote(path)
+        return response
+    conditional = get_conditional_response(
+        request,
+        etag=response["ETag"],
+        last_modified=int(info.st_mtime),
+        response=response,
+    )
+    if conditional is not response:
+        return conditional
+
+    first, last = 0, info.st_size - 1
+    byte_range = request.headers.get("Range")
+    if (
+        byte_range
+        and request.headers.get("If-Range", response["ETag"]) == response["ETag"]
+    ):
+        parsed = parse_range(byte_range, info.st_size)
+        if parsed is None:
+            response.status_code = 416
+            response["Content-Range"] = f"bytes */{info.st_size}"
+            return response
+        if parsed:
+            first, last = parsed
+            response.status_code = 206
+            response["Content-Range"] = f"bytes {first}-{last}/{info.st_size}"
+
+    file = open(full_path, "rb")
+    file.seek(first)
+    streaming = FileResponse(
+        FileRange(file, last - first + 1), status=response.status_code
+    )
+    for header, value in response.items():
+        streaming[header] = value
+    streaming["Content-Length"] = last - first + 1
+    return streaming
+
+
+@require_safe
+def serve_media(request, path):
+    return media_response(request, path)
+
+
+class ZeroCopyMedia:
+    """ASGI wrapper that sends media file bodies with the server's zero-copy
+    extension when it offers one. Everything else, including media requests
+    on servers without it, goes to ``app``.
+    """
+
+    extension = "http.response.zerocopysend"
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] != "http"
+            or self.extension not in scope.get("extensions", {})
+            or scope["method"] != "GET"
+            or settings.MEDIA_ACCEL_REDIRECT
+            or not scope["path"].startswith(settings.MEDIA_URL)
+        ):
+            return await self.app(scope, receive, send)
+        request = ASGIRequest(scope, BytesIO())
+        try:
+            # The stat and open would otherwise block the event loop. No
+            # database is involved, so any thread will do.
+            response = await sync_to_async(media_response, thread_sensitive=False)(
+                request, scope["path"][len(settings.MEDIA_URL) :]
+            )
+        except Http404:
+            return await self.app(scope, receive, send)
+        body = getattr(response, "file_to_stream", None)
+        if not isinstance(body, FileRange):
+            response.close()
+            return await self.app(scope, receive, send)
+        try:
+            await send(
+                {
+                    "type": "http.response.start",
+                    "status": response.status_code,
+                    "headers": [
+                        (header.encode("latin-1"), value.encode("latin-1"))
+                        for header, value in response.items()
+                    ],
+                }
+            )
+            await send(
+                {
+                    "type": self.extension,
+                    "file": body.file,
+                    "offset": body.file.tell(),
+                    "count": body.remaining,
+                }
+            )
+        finally:
+            response.close()
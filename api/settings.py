@@ -22,6 +22,7 @@ INSTALLED_APPS = [
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
+    "django.contrib.postgres",
 ]
 
 INSTALLED_APPS += [
@@ -44,6 +45,13 @@ CHANNEL_LAYERS = {
     },
 }
 
+CACHES = {
+    "default": {
+        "BACKEND": "django_redis.cache.RedisCache",
+        "LOCATION": env("REDIS_CACHE_URL", default="redis://127.0.0.1:6379/1"),
+    }
+}
+
 ASGI_APPLICATION = "api.asgi.application"
 
 MIDDLEWARE = [
@@ -115,7 +123,7 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 REST_FRAMEWORK = {
     "DEFAULT_PERMISSION_CLASSES": ("rest_framework.permissions.IsAuthenticated",),
     "DEFAULT_AUTHENTICATION_CLASSES": (
-        "rest_framework_simplejwt.authentication.JWTAuthentication",
+        "account.authentication.CachedJWTAuthentication",
     ),
 }
 
@@ -136,6 +144,8 @@ SIMPLE_JWT = {
     "AUTH_TOKEN_CLASSES": ("rest_framework_simplejwt.tokens.AccessToken",),
     "TOKEN_TYPE_CLAIM": "token_type",
 }
+# How long authenticated users are cached between requests and connections
+USER_CACHE_TTL = timedelta(minutes=1)
 
 # Djoser configuration
 DJOSER = {
@@ -192,6 +202,97 @@ EMAIL_FRONTEND_PROTOCOL = "http"
 # * MEDIA
 MEDIA_URL = "/media/"
 MEDIA_ROOT = BASE_DIR / "media"
+STORAGES = {
+    "default": {"BACKEND": "django.core.files.storage.FileSystemStorage"},
+    "staticfiles": {"BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"},
+    # Uploaded post media and profile pictures, stored once per distinct content
+    "blobs": {"BACKEND": "api.storage.BlobStorage"},
+}
+# Blobs unreferenced, or stored again, for less than this are kept by collect_blobs
+BLOB_COLLECT_GRACE = timedelta(hours=1)
+MEDIA_CACHE_MAX_AGE = timedelta(hours=1)
+# Names containing a SHA-256 never change content, so are cached for a year
+MEDIA_IMMUTABLE_PATTERN = r"(^|/)[0-9a-f]{64}[./]"
+# Internal location of MEDIA_ROOT on a fronting nginx, e.g. "/protected-media/";
+# when set, media responses only carry headers and nginx sends the file
+MEDIA_ACCEL_REDIRECT = env("MEDIA_ACCEL_REDIRECT", default="")
+# Threads per process writing a post's uploads to storage in parallel
+MEDIA_UPLOAD_WORKERS = env.int("MEDIA_UPLOAD_WORKERS", default=4)
+# Longest side in pixels of the WebP variants built for post images and avatars
+IMAGE_VARIANT_SIZES = {"media": (320, 640, 1080), "avatar": (48, 160)}
+IMAGE_VARIANT_QUALITY = 80
+# Worker processes resizing images; 0 resizes inline after commit
+IMAGE_VARIANT_WORKERS = env.int("IMAGE_VARIANT_WORKERS", default=2)
+# Resumable uploads are assembled here before moving into media storage
+UPLOAD_SESSION_DIR = env(
+    "UPLOAD_SESSION_DIR", default=str(BASE_DIR / "var" / "uploads")
+)
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+UPLOAD_MAX_SIZE = 2 * 1024 * 1024 * 1024
+# Sessions without a new chunk for this long are deleted by expire_uploads
+UPLOAD_SESSION_TTL = timedelta(hours=24)
+
+
+# * HOME TIMELINES
+REDIS_URL = env("REDIS_URL", default="redis://127.0.0.1:6379/0")
+TIMELINE_STORE = env("TIMELINE_STORE", default="social.timeline.RedisTimelineStore")
+TIMELINE_STORE_OPTIONS = {"max_length": 800}
+# Authors with more followers than this are merged into timelines at read time
+TIMELINE_FANOUT_LIMIT = 10000
+# How long the list of authors above the limit is cached
+TIMELINE_CELEBRITIES_TTL = timedelta(minutes=5)
+# Background fan-out threads per process, each running one user's jobs in
+# order; 0 runs fan-out inline after commit
+TIMELINE_FANOUT_WORKERS = env.int("TIMELINE_FANOUT_WORKERS", default=4)
+
+
+# * EXPLORE / TRENDING
+TRENDING_POOL = env("TRENDING_POOL", default="social.trending.RedisTrendingPool")
+TRENDING_POOL_OPTIONS = {"size": 500}
+# Only posts from this window are candidates; refresh_trending rebases to it
+TRENDING_WINDOW = timedelta(hours=48)
+TRENDING_HALF_LIFE = timedelta(hours=6)
+TRENDING_WEIGHTS = {"post": 1.0, "like": 1.0, "comment": 3.0}
+
+
+# * SUGGESTED USERS
+SUGGESTIONS_SIZE = 50
+SUGGESTIONS_TTL = timedelta(hours=6)
+
+
+# * FOLLOW GRAPH
+# Sorted follow id lists are cached per user for mutual-connection lookups
+FOLLOW_IDS_TTL = timedelta(hours=1)
+# Follower lists longer than this are probed in the database instead
+FOLLOW_IDS_MAX_CACHED = 100000
+# Per-process LRU of follow id lists, bounded by total ids (8 bytes each)
+FOLLOW_GRAPH_MAX_IDS = 2000000
+# Upper bound on how stale a list can be after a follow made in another process
+FOLLOW_GRAPH_MAX_AGE = timedelta(seconds=30)
+
+
+# * CHAT
+TYPING_STORE = env("TYPING_STORE", default="chat.presence.RedisTypingStore")
+# Seconds a typing flag lives without a refresh from the client
+TYPING_STORE_OPTIONS = {"ttl": 6}
+# WebSocket messages are spooled to local disk and stored in batches
+CHAT_WRITER_OPTIONS = {
+    "spool_dir": env("CHAT_SPOOL_DIR", default=str(BASE_DIR / "var" / "chat-spool")),
+    "flush_interval": 0.005,
+    "max_batch": 200,
+}
+
+
+# * NOTIFICATIONS
+# How long a worker holds a batch of outbox events while pushing them
+NOTIFICATION_PUSH_LEASE = timedelta(minutes=1)
+NOTIFICATION_PUSH_MAX_ATTEMPTS = 5
+# Likes, comments and follows of the same kind and post coalesce into one
+# notification while they keep arriving within this window
+NOTIFICATION_COALESCE_WINDOW = timedelta(hours=6)
+NOTIFICATION_RECENT_ACTORS = 3
+# Minimum time between two pushes of the same coalesced notification
+NOTIFICATION_PUSH_INTERVAL = timedelta(seconds=5)
 
 
 SECRET_KEY = env("DJANGO_SECRET_KEY")
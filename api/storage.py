@@ -0,0 +1,88 @@
+import hashlib
+import os
+import re
+import tempfile
+
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage, storages
+
+BLOCK_SIZE = 64 * 1024
+BLOB_RE = re.compile(r"^blobs/[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}(\.\w+)?$")
+
+
+def blob_name(digest, extension=""):
+    return f"blobs/{digest[:2]}/{digest[2:4]}/{digest}{extension}"
+
+
+def is_blob(name):
+    return bool(name) and BLOB_RE.match(name) is not None
+
+
+def blob_storage():
+    return storages["blobs"]
+
+
+class BlobStorage(FileSystemStorage):
+    """Stores each distinct file once, named after the SHA-256 of its bytes
+    and hashed while it is written. Saving bytes that are already stored
+    returns the existing name.
+
+    Blobs can be shared by any number of rows, so ``delete`` leaves them in
+    place; ``collect_blobs`` removes the ones no row references.
+    """
+
+    def get_available_name(self, name, max_length=None):
+        # The name is chosen in _save, from the content.
+        return name
+
+    def _save(self, name, content):
+        extension = os.path.splitext(name)[1].lower()
+        digest = hashlib.sha256()
+        if hasattr(content, "temporary_file_path"):
+            # Hashed where it is and moved into place, not copied.
+            source, owned = content.temporary_file_path(), False
+            with open(source, "rb") as file:
+                while block := file.read(BLOCK_SIZE):
+                    digest.update(block)
+        else:
+            directory = self.path("blobs/tmp")
+            os.makedirs(directory, exist_ok=True)
+            fd, source = tempfile.mkstemp(dir=directory)
+            owned = True
+            try:
+                with os.fdopen(fd, "wb") as file:
+                    for chunk in content.chunks():
+                        digest.update(chunk)
+                        file.write(chunk)
+            except BaseException:
+                os.remove(source)
+                raise
+
+        name = blob_name(digest.hexdigest(), extension)
+        path = self.path(name)
+        if os.path.exists(path):
+            if owned:
+                os.remove(source)
+            return name
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if owned:
+            os.replace(source, path)
+        else:
+            file_move_safe(source, path, allow_overwrite=True)
+        if self.file_permissions_mode is not None:
+            os.chmod(path, self.file_permissions_mode)
+        return name
+
+    def delete(self, name):
+        pass
+
+    def remove(self, name):
+        super().delete(name)
+
+    def walk(self):
+        """Yield the names of stored blobs and leftover temporary files."""
+        root = self.path("blobs")
+        for directory, _, files in os.walk(root):
+            prefix = os.path.relpath(directory, self.location).replace(os.sep, "/")
+            for file in files:
+                yield f"{prefix}/{file}"
@@ -1,36 +1,47 @@
+import asyncio
 import json
+import time
+from asgiref.sync import sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
-from .models import ChatRoom, TypingStatus
-from django.core.exceptions import ObjectDoesNotExist
-from account.models import User
-import jwt
-from django.conf import settings
+from rest_framework.fields import DateTimeField
+from .inbox import mark_read
+from .models import Participant
+from .presence import get_store, set_typing
+from .writer import get_writer, spawn
 
 
 class ChatConsumer(AsyncWebsocketConsumer):
+    typing_refreshed_at = 0
+    typing_timeout = None
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.tasks = set()
+
     async def connect(self):
-        token = self.scope["query_string"].decode().split("token=")[-1]
-        try:
-            decoded_data = jwt.decode(token, settings.SECRET_KEY, algorithms=["HS256"])
-            self.scope["user"] = await self.get_user(decoded_data["user_id"])
-        except (jwt.ExpiredSignatureError, jwt.InvalidTokenError, KeyError):
+        # Set from the ?token= access token by JWTAuthMiddleware.
+        if not self.scope["user"].is_authenticated:
             await self.close()
             return
 
-        if not self.scope["user"]:
+        self.room_id = self.scope["url_route"]["kwargs"]["room_id"]
+        if not await self.is_participant():
             await self.close()
             return
-
-        self.room_id = self.scope["url_route"]["kwargs"]["room_id"]
         self.room_group_name = f"chat_{self.room_id}"
 
+        # The first socket a worker accepts also replays what dead workers
+        # left in the spool.
+        await get_writer().started()
         await self.channel_layer.group_add(self.room_group_name, self.channel_name)
 
         await self.accept()
 
     async def disconnect(self, close_code):
         if hasattr(self, "room_group_name"):
+            if await self.update_typing_status(False):
+                await self.broadcast("", False)
             await self.channel_layer.group_discard(
                 self.room_group_name, self.channel_name
             )
@@ -38,11 +49,58 @@ class ChatConsumer(AsyncWebsocketConsumer):
     async def receive(self, text_data):
         text_data_json = json.loads(text_data)
         message = text_data_json.get("message", "")
-        is_typing = text_data_json.get("is_typing", False)
 
-        if is_typing is not None:
-            await self.update_typing_status(is_typing)
+        if message:
+            # Sending a message ends the sender's typing state.
+            await self.update_typing_status(False)
+            # Not awaited here, so a client sending in bursts lands in one batch.
+            spawn(
+                self.store_message(message, text_data_json.get("client_id")),
+                self.tasks,
+            )
+        elif "read" in text_data_json:
+            try:
+                message_id = int(text_data_json["read"])
+            except (TypeError, ValueError):
+                await self.send(
+                    text_data=json.dumps({"error": "read must be a message id."})
+                )
+                return
+            read_up_to = await database_sync_to_async(mark_read)(
+                self.room_id, self.scope["user"].id, message_id
+            )
+            if read_up_to is not None:
+                await self.channel_layer.group_send(
+                    self.room_group_name,
+                    {
+                        "type": "chat_message",
+                        "read_up_to": read_up_to,
+                        "reader": self.scope["user"].username,
+                    },
+                )
+        elif "is_typing" in text_data_json:
+            is_typing = text_data_json["is_typing"]
+            if not isinstance(is_typing, bool):
+                await self.send(
+                    text_data=json.dumps({"error": "is_typing must be true or false."})
+                )
+                return
+            if await self.update_typing_status(is_typing):
+                await self.broadcast("", is_typing)
 
+    async def store_message(self, message, client_id):
+        stored = await get_writer().submit(self.room_id, self.scope["user"].id, message)
+        if stored is None:
+            return
+        timestamp = DateTimeField().to_representation(stored.timestamp)
+        await self.send(
+            text_data=json.dumps(
+                {"ack": client_id, "id": stored.id, "timestamp": timestamp}
+            )
+        )
+        await self.broadcast(message, False, id=stored.id, timestamp=timestamp)
+
+    async def broadcast(self, message, is_typing, **stored):
         await self.channel_layer.group_send(
             self.room_group_name,
             {
@@ -50,35 +108,49 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 "message": message,
                 "is_typing": is_typing,
                 "sender": self.scope["user"].username,
+                **stored,
             },
         )
 
     async def chat_message(self, event):
-        message = event["message"]
-        is_typing = event["is_typing"]
-        sender = event["sender"]
-
-        await self.send(
-            text_data=json.dumps(
-                {"message": message, "is_typing": is_typing, "sender": sender}
-            )
-        )
+        # Stored messages also carry their id and timestamp.
+        event = {key: value for key, value in event.items() if key != "type"}
+        await self.send(text_data=json.dumps(event))
 
     @database_sync_to_async
-    def get_user(self, user_id):
-        try:
-            return User.objects.get(id=user_id)
-        except User.DoesNotExist:
-            return None
+    def is_participant(self):
+        return Participant.objects.filter(
+            chatroom_id=self.room_id, user=self.scope["user"]
+        ).exists()
 
-    @database_sync_to_async
-    def update_typing_status(self, is_typing):
-        try:
-            chatroom = ChatRoom.objects.get(id=self.room_id)
-            TypingStatus.objects.update_or_create(
-                chatroom=chatroom,
-                user=self.scope["user"],
-                defaults={"is_typing": is_typing},
-            )
-        except ObjectDoesNotExist:
-            pass
+    async def update_typing_status(self, is_typing):
+        """Record the typing state and return whether it changed.
+
+        Clients send "typing" on every keystroke; the TTL is only refreshed
+        once per half period, and a timer announces the stop if the refreshes
+        end without an explicit one.
+        """
+        ttl = get_store().ttl
+        now = time.monotonic()
+        if is_typing and now - self.typing_refreshed_at < ttl / 2:
+            return False
+        if self.typing_timeout is not None:
+            self.typing_timeout.cancel()
+            self.typing_timeout = None
+        if not is_typing and not self.typing_refreshed_at:
+            return False
+        changed = await sync_to_async(set_typing)(
+            self.room_id, self.scope["user"].id, is_typing
+        )
+        if is_typing:
+            self.typing_refreshed_at = now
+            self.typing_timeout = asyncio.create_task(self.expire_typing(ttl))
+        else:
+            self.typing_refreshed_at = 0
+        return changed
+
+    async def expire_typing(self, ttl):
+        await asyncio.sleep(ttl)
+        self.typing_timeout = None
+        self.typing_refreshed_at = 0
+        await self.broadcast("", False)
@@ -0,0 +1,122 @@
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Case, Count, F, OuterRef, Subquery, When
+from django.db.models.functions import Coalesce
+
+from notifications.counters import adjust_unread, recount_unread
+from .models import ChatRoom, Message, Participant
+
+
+def record_messages(chatroom_id, messages):
+    """Fold newly stored ``messages`` (oldest first) into the room's inbox
+    summary: the last message, every participant's last activity, and the
+    unread count of everyone but each message's sender.
+    """
+    if not messages:
+        return
+    last = messages[-1]
+    unread = F("unread_count") + len(messages)
+    sent = Counter(message.sender_id for message in messages)
+    with transaction.atomic():
+        ChatRoom.objects.filter(pk=chatroom_id).update(last_message=last)
+        members = Participant.objects.select_for_update().filter(
+            chatroom_id=chatroom_id
+        )
+        # Members with nothing unread so far get one more unread chat.
+        newly_unread = [
+            user_id
+            for user_id, unread_count in members.values_list("user_id", "unread_count")
+            if unread_count == 0 and sent[user_id] < len(messages)
+        ]
+        members.update(
+            last_activity_at=last.timestamp,
+            unread_count=Case(
+                *[
+                    When(user_id=sender_id, then=unread - count)
+                    for sender_id, count in sent.items()
+                ],
+                default=unread,
+            ),
+        )
+        adjust_unread({user_id: (0, 1) for user_id in newly_unread})
+
+
+def is_seen(message, memberships):
+    return any(
+        membership.user_id != message.sender_id
+        and membership.last_read_message_id >= message.id
+        for membership in memberships
+    )
+
+
+def unread_after(chatroom_id, message_id, user_id):
+    return (
+        Message.objects.filter(chatroom_id=chatroom_id, id__gt=message_id)
+        .exclude(sender_id=user_id)
+        .order_by()
+        .values("chatroom_id")
+        .annotate(total=Count("pk"))
+        .values("total")
+    )
+
+
+def mark_read(chatroom_id, user_id, message_id):
+    """Move the user's read cursor forward to ``message_id`` (capped at the
+    room's last message) and recount what is still unread after it.
+
+    Returns the new cursor, or None if it was already there or further on.
+    """
+    last_message_id = (
+        ChatRoom.objects.filter(pk=chatroom_id)
+        .values_list("last_message_id", flat=True)
+        .first()
+    )
+    message_id = min(message_id, last_message_id or 0)
+    with transaction.atomic():
+        membership = (
+            Participant.objects.select_for_update()
+            .filter(chatroom_id=chatroom_id, user_id=user_id)
+            .only("last_read_message_id", "unread_count")
+            .first()
+        )
+        if membership is None or membership.last_read_message_id >= message_id:
+            return None
+        unread_count = (
+            Message.objects.filter(chatroom_id=chatroom_id, id__gt=message_id)
+            .exclude(sender_id=user_id)
+            .count()
+        )
+        Participant.objects.filter(pk=membership.pk).update(
+            last_read_message_id=message_id, unread_count=unread_count
+        )
+        adjust_unread(
+            {user_id: (0, bool(unread_count) - bool(membership.unread_count))}
+        )
+    return message_id
+
+
+def rebuild_summaries(chatroom_ids):
+    """Recompute the inbox summary of the given rooms from their messages."""
+    latest = Message.objects.filter(chatroom_id=OuterRef("chatroom_id")).order_by("-id")
+    ChatRoom.objects.filter(pk__in=chatroom_ids).update(
+        last_message=Subquery(
+            Message.objects.filter(chatroom_id=OuterRef("pk"))
+            .order_by("-id")
+            .values("id")[:1]
+        )
+    )
+    unseen = unread_after(
+        OuterRef("chatroom_id"), OuterRef("last_read_message_id"), OuterRef("user_id")
+    )
+    Participant.objects.filter(chatroom_id__in=chatroom_ids).update(
+        last_activity_at=Coalesce(
+            Subquery(latest.values("timestamp")[:1]),
+            Subquery(
+                ChatRoom.objects.filter(pk=OuterRef("chatroom_id")).values("created_at")
+            ),
+        ),
+        unread_count=Coalesce(Subquery(unseen), 0),
+    )
+    members = Participant.objects.filter(chatroom_id__in=chatroom_ids)
+    recount_unread(set(members.values_list("user_id", flat=True)))
@@ -0,0 +1,63 @@
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from chat.inbox import rebuild_summaries
+from chat.models import ChatRoom, Message
+
+
+class Command(BaseCommand):
+    help = (
+        "Set the canonical user pair on direct chat rooms, merging duplicate "
+        "rooms for the same pair into the oldest one."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dry-run", action="store_true")
+
+    def handle(self, *args, **options):
+        participants = ChatRoom.participants.through.objects.values_list(
+            "chatroom_id", "user_id"
+        )
+        rooms = defaultdict(list)
+        for room_id, user_id in participants.iterator(chunk_size=5000):
+            rooms[room_id].append(user_id)
+
+        pairs = defaultdict(list)
+        for room_id, user_ids in rooms.items():
+            if len(user_ids) == 2:
+                pairs[tuple(sorted(user_ids))].append(room_id)
+
+        keyed = set(
+            ChatRoom.objects.filter(min_user__isnull=False).values_list(
+                "pk", "min_user_id", "max_user_id"
+            )
+        )
+        merged = updated = 0
+        for (min_user_id, max_user_id), room_ids in pairs.items():
+            keeper, *duplicates = sorted(room_ids)
+            if not duplicates and (keeper, min_user_id, max_user_id) in keyed:
+                continue
+            merged += len(duplicates)
+            updated += 1
+            if options["dry_run"]:
+                continue
+            with transaction.atomic():
+                if duplicates:
+                    Message.objects.filter(chatroom_id__in=duplicates).update(
+                        chatroom_id=keeper
+                    )
+                    # Drops the duplicates' memberships with them, and
+                    # frees the pair key if a duplicate already held it.
+                    ChatRoom.objects.filter(pk__in=duplicates).delete()
+                ChatRoom.objects.filter(pk=keeper).update(
+                    min_user_id=min_user_id, max_user_id=max_user_id
+                )
+                if duplicates:
+                    rebuild_summaries([keeper])
+
+        prefix = "Would merge" if options["dry_run"] else "Merged"
+        self.stdout.write(
+            f"{prefix} {merged} duplicate rooms; keyed {updated} direct rooms"
+        )
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from chat.inbox import rebuild_summaries
+from chat.models import ChatRoom
+
+
+class Command(BaseCommand):
+    help = "Recompute last messages, activity times and unread counts of chats."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        rebuilt = 0
+        last_pk = 0
+        while True:
+            ids = list(
+                ChatRoom.objects.filter(pk__gt=last_pk)
+                .order_by("pk")
+                .values_list("pk", flat=True)[: options["batch_size"]]
+            )
+            if not ids:
+                break
+            last_pk = ids[-1]
+            rebuild_summaries(ids)
+            rebuilt += len(ids)
+        self.stdout.write(f"Rebuilt inbox summaries for {rebuilt} chat rooms")
@@ -0,0 +1,57 @@
+from collections import defaultdict
+
+from django.db import migrations
+from django.db.models import Count, Max, Min, OuterRef, Subquery
+
+
+def key_rooms(apps, schema_editor):
+    """Merge duplicate direct rooms into the oldest one, like the
+    dedupe_chatrooms command, then set the pair of every two-member room.
+    """
+    ChatRoom = apps.get_model("chat", "ChatRoom")
+    Message = apps.get_model("chat", "Message")
+    Membership = ChatRoom.participants.through
+
+    rooms = defaultdict(list)
+    memberships = Membership.objects.values_list("chatroom_id", "user_id")
+    for room_id, user_id in memberships.iterator(chunk_size=5000):
+        rooms[room_id].append(user_id)
+    pairs = defaultdict(list)
+    for room_id, user_ids in rooms.items():
+        if len(user_ids) == 2:
+            pairs[tuple(sorted(user_ids))].append(room_id)
+    for room_ids in pairs.values():
+        keeper, *duplicates = sorted(room_ids)
+        if duplicates:
+            Message.objects.filter(chatroom_id__in=duplicates).update(
+                chatroom_id=keeper
+            )
+            ChatRoom.objects.filter(pk__in=duplicates).delete()
+
+    members = Membership.objects.filter(chatroom_id=OuterRef("pk")).order_by()
+    direct = (
+        Membership.objects.order_by()
+        .values("chatroom_id")
+        .annotate(total=Count("pk"))
+        .filter(total=2)
+        .values("chatroom_id")
+    )
+    ChatRoom.objects.filter(pk__in=direct).update(
+        min_user=Subquery(
+            members.values("chatroom_id").annotate(user=Min("user_id")).values("user")
+        ),
+        max_user=Subquery(
+            members.values("chatroom_id").annotate(user=Max("user_id")).values("user")
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat", "0002_chatroom_pair"),
+    ]
+
+    operations = [
+        migrations.RunPython(key_rooms, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.0.6 on 2026-10-18 19:15
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat", "0003_key_chatrooms"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="message",
+            index=models.Index(
+                fields=["chatroom", "-id"], name="chat_messag_chatroo_ec75d9_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,48 @@
+from django.db import migrations
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def summarize_rooms(apps, schema_editor):
+    """Set each room's last message, and each member's last activity and
+    count of unseen messages from others.
+    """
+    ChatRoom = apps.get_model("chat", "ChatRoom")
+    Message = apps.get_model("chat", "Message")
+    Participant = apps.get_model("chat", "Participant")
+    latest = Message.objects.filter(chatroom_id=OuterRef("chatroom_id")).order_by("-id")
+    unseen = (
+        Message.objects.filter(chatroom_id=OuterRef("chatroom_id"), is_seen=False)
+        .exclude(sender_id=OuterRef("user_id"))
+        .order_by()
+        .values("chatroom_id")
+        .annotate(total=Count("pk"))
+        .values("total")
+    )
+    ChatRoom.objects.update(
+        last_message=Subquery(
+            Message.objects.filter(chatroom_id=OuterRef("pk"))
+            .order_by("-id")
+            .values("id")[:1]
+        )
+    )
+    Participant.objects.update(
+        last_activity_at=Coalesce(
+            Subquery(latest.values("timestamp")[:1]),
+            Subquery(
+                ChatRoom.objects.filter(pk=OuterRef("chatroom_id")).values("created_at")
+            ),
+        ),
+        unread_count=Coalesce(Subquery(unseen), 0),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat", "0005_participant_summaries"),
+    ]
+
+    operations = [
+        migrations.RunPython(summarize_rooms, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,16 @@
+# Generated by Django 5.0.6 on 2026-10-18 19:15
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat", "0006_backfill_summaries"),
+    ]
+
+    operations = [
+        migrations.DeleteModel(
+            name="TypingStatus",
+        ),
+    ]
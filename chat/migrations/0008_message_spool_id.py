@@ -0,0 +1,18 @@
+# Generated by Django 5.0.6 on 2026-10-18 19:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat", "0007_delete_typingstatus"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="message",
+            name="spool_id",
+            field=models.UUIDField(editable=False, null=True, unique=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.6 on 2026-10-18 19:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat", "0008_message_spool_id"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="participant",
+            name="last_read_message_id",
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,49 @@
+from django.db import migrations
+from django.db.models import Count, Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def place_cursors(apps, schema_editor):
+    """Start each member's read cursor at the last message from others they
+    had seen, and count what is unread after it.
+    """
+    Message = apps.get_model("chat", "Message")
+    Participant = apps.get_model("chat", "Participant")
+    from_others = Message.objects.filter(chatroom_id=OuterRef("chatroom_id")).exclude(
+        sender_id=OuterRef("user_id")
+    )
+    Participant.objects.update(
+        last_read_message_id=Coalesce(
+            Subquery(
+                from_others.filter(is_seen=True)
+                .order_by()
+                .values("chatroom_id")
+                .annotate(last=Max("id"))
+                .values("last")
+            ),
+            0,
+        )
+    )
+    Participant.objects.update(
+        unread_count=Coalesce(
+            Subquery(
+                from_others.filter(id__gt=OuterRef("last_read_message_id"))
+                .order_by()
+                .values("chatroom_id")
+                .annotate(total=Count("pk"))
+                .values("total")
+            ),
+            0,
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat", "0009_read_cursors"),
+    ]
+
+    operations = [
+        migrations.RunPython(place_cursors, migrations.RunPython.noop),
+    ]
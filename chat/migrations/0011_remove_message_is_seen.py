@@ -0,0 +1,15 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat", "0010_backfill_read_cursors"),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name="message",
+            name="is_seen",
+        ),
+    ]
@@ -1,23 +1,79 @@
 # chat/models.py
-from django.db import models
+from django.db import models, transaction
+from django.utils import timezone
 from account.models import User
 
 
 class ChatRoom(models.Model):
-    participants = models.ManyToManyField(User, related_name="chatrooms")
+    participants = models.ManyToManyField(
+        User, through="Participant", related_name="chatrooms"
+    )
+    # Canonical (lower id, higher id) pair of a direct room, so the room for
+    # two users is a single unique-index lookup. Set by get_or_create_chatroom
+    # and backfilled for older rooms by the dedupe_chatrooms command.
+    min_user = models.ForeignKey(
+        User, on_delete=models.CASCADE, null=True, editable=False, related_name="+"
+    )
+    max_user = models.ForeignKey(
+        User, on_delete=models.CASCADE, null=True, editable=False, related_name="+"
+    )
+    last_message = models.ForeignKey(
+        "Message",
+        on_delete=models.SET_NULL,
+        null=True,
+        editable=False,
+        related_name="+",
+    )
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["min_user", "max_user"], name="chat_chatroom_unique_pair"
+            )
+        ]
+
     @classmethod
     def get_or_create_chatroom(cls, user1, user2):
-        chatroom = (
-            cls.objects.filter(participants=user1).filter(participants=user2).first()
-        )
-        if not chatroom:
-            chatroom = cls.objects.create()
-            chatroom.participants.add(user1, user2)
+        min_user_id, max_user_id = sorted((user1.id, user2.id))
+        chatroom = cls.objects.filter(
+            min_user_id=min_user_id, max_user_id=max_user_id
+        ).first()
+        if chatroom:
+            return chatroom
+        # A concurrent insert of the same pair fails on the unique constraint
+        # and get_or_create falls back to reading the winner's room.
+        with transaction.atomic():
+            chatroom, created = cls.objects.get_or_create(
+                min_user_id=min_user_id, max_user_id=max_user_id
+            )
+            if created:
+                chatroom.participants.add(user1, user2)
         return chatroom
 
 
+class Participant(models.Model):
+    """A user's membership of a room, carrying their inbox summary.
+
+    Uses the table of the original auto-created participants relation, so
+    existing memberships are kept. ``last_activity_at`` and ``unread_count``
+    are maintained by ``chat.inbox.record_messages`` on every new message, and
+    ``last_read_message_id`` by ``chat.inbox.mark_read``. A message is seen
+    once a participant other than its sender has read past it.
+    """
+
+    chatroom = models.ForeignKey(ChatRoom, on_delete=models.CASCADE)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    last_activity_at = models.DateTimeField(default=timezone.now, editable=False)
+    unread_count = models.PositiveIntegerField(default=0, editable=False)
+    last_read_message_id = models.BigIntegerField(default=0, editable=False)
+
+    class Meta:
+        db_table = "chat_chatroom_participants"
+        unique_together = ("chatroom", "user")
+        indexes = [models.Index(fields=["user", "-last_activity_at", "-id"])]
+
+
 class Message(models.Model):
     chatroom = models.ForeignKey(
         ChatRoom, on_delete=models.CASCADE, related_name="messages"
@@ -28,13 +84,9 @@ class Message(models.Model):
     content = models.TextField()
     timestamp = models.DateTimeField(auto_now_add=True)
     is_delivered = models.BooleanField(default=False)
-    is_seen = models.BooleanField(default=False)
-
+    # Set on messages that came through the WebSocket write-behind spool, so
+    # a replay after a crash cannot store the same message twice.
+    spool_id = models.UUIDField(null=True, unique=True, editable=False)
 
-class TypingStatus(models.Model):
-    chatroom = models.ForeignKey(
-        ChatRoom, on_delete=models.CASCADE, related_name="typing_statuses"
-    )
-    user = models.ForeignKey(User, on_delete=models.CASCADE)
-    is_typing = models.BooleanField(default=False)
-    last_updated = models.DateTimeField(auto_now=True)
+    class Meta:
+        indexes = [models.Index(fields=["chatroom", "-id"])]
@@ -0,0 +1,79 @@
+import threading
+import time
+from functools import lru_cache
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+
+class LocalTypingStore:
+    """Typing flags kept in process memory until they expire."""
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._expires = {}
+        self._lock = threading.Lock()
+
+    def set(self, chatroom_id, user_id, is_typing):
+        key = (chatroom_id, user_id)
+        now = time.monotonic()
+        with self._lock:
+            was_typing = self._expires.get(key, 0) > now
+            if is_typing:
+                self._expires[key] = now + self.ttl
+            else:
+                self._expires.pop(key, None)
+        return was_typing != is_typing
+
+    def typing(self, pairs):
+        now = time.monotonic()
+        with self._lock:
+            return {pair for pair in pairs if self._expires.get(pair, 0) > now}
+
+
+class RedisTypingStore:
+    """Typing flags kept as Redis keys that expire after ``ttl`` seconds, so a
+    client that disconnects mid-word stops showing as typing on its own.
+    """
+
+    def __init__(self, ttl, url=None):
+        import redis
+
+        self.ttl = ttl
+        self.client = redis.Redis.from_url(url or settings.REDIS_URL)
+
+    def key(self, chatroom_id, user_id):
+        return f"typing:{chatroom_id}:{user_id}"
+
+    def set(self, chatroom_id, user_id, is_typing):
+        key = self.key(chatroom_id, user_id)
+        if is_typing:
+            return self.client.set(key, 1, ex=self.ttl, get=True) is None
+        return bool(self.client.delete(key))
+
+    def typing(self, pairs):
+        pairs = list(pairs)
+        if not pairs:
+            return set()
+        values = self.client.mget([self.key(*pair) for pair in pairs])
+        return {pair for pair, value in zip(pairs, values) if value is not None}
+
+
+@lru_cache(maxsize=None)
+def get_store():
+    store_class = import_string(settings.TYPING_STORE)
+    return store_class(**settings.TYPING_STORE_OPTIONS)
+
+
+def set_typing(chatroom_id, user_id, is_typing):
+    """Record the user's typing state and return whether it changed."""
+    return get_store().set(int(chatroom_id), int(user_id), bool(is_typing))
+
+
+def is_typing(chatroom_id, user_id):
+    return bool(get_store().typing([(int(chatroom_id), int(user_id))]))
+
+
+def typing_pairs(pairs):
+    """Return the ``(chatroom_id, user_id)`` pairs that are typing right now."""
+    return get_store().typing(pairs)
@@ -0,0 +1,11 @@
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from .inbox import record_messages
+from .models import Message
+
+
+@receiver(post_save, sender=Message)
+def update_inbox(instance, created, **kwargs):
+    if created:
+        record_messages(instance.chatroom_id, [instance])
@@ -1,3 +1,380 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import os
+from unittest import mock
+from uuid import uuid4
 
-# Create your tests here.
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.core.management import call_command
+from django.db import connection
+from django.test import TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient, APITestCase
+
+from social.models import Follower
+from social.tests import LocalServicesMixin, make_user
+from . import presence, writer
+from .models import ChatRoom, Message, Participant
+from .routing import websocket_urlpatterns
+
+
+class ChatRoomPairTests(LocalServicesMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.alice, self.bob = make_user("alice"), make_user("bob")
+        self.client.force_authenticate(self.alice)
+
+    def test_room_is_keyed_by_the_user_pair(self):
+        room = ChatRoom.get_or_create_chatroom(self.bob, self.alice)
+        self.assertEqual(ChatRoom.get_or_create_chatroom(self.alice, self.bob), room)
+        self.assertEqual(
+            (room.min_user_id, room.max_user_id), (self.alice.pk, self.bob.pk)
+        )
+        self.assertEqual(room.participants.count(), 2)
+
+    def test_only_mutual_followers_can_start_a_chat(self):
+        response = self.client.get("/api/start/bob/")
+        self.assertEqual(response.status_code, 403)
+        Follower.objects.create(user=self.alice, followed=self.bob)
+        Follower.objects.create(user=self.bob, followed=self.alice)
+        response = self.client.get("/api/start/bob/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.data["room_id"], self.client.get("/api/start/bob/").data["room_id"]
+        )
+
+    def test_dedupe_merges_rooms_of_the_same_pair(self):
+        rooms = []
+        for _ in range(2):
+            room = ChatRoom.objects.create()
+            room.participants.add(self.alice, self.bob)
+            Message.objects.create(chatroom=room, sender=self.bob, content="hi")
+            rooms.append(room)
+        call_command("dedupe_chatrooms", stdout=io.StringIO())
+        room = ChatRoom.objects.get()
+        self.assertEqual(room.pk, rooms[0].pk)
+        self.assertEqual(
+            (room.min_user_id, room.max_user_id), (self.alice.pk, self.bob.pk)
+        )
+        self.assertEqual(room.messages.count(), 2)
+        membership = Participant.objects.get(chatroom=room, user=self.alice)
+        self.assertEqual(membership.unread_count, 2)
+
+
+class ChatHistoryTests(LocalServicesMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.alice, self.bob = make_user("alice"), make_user("bob")
+        self.room = ChatRoom.get_or_create_chatroom(self.alice, self.bob)
+        self.ids = [
+            Message.objects.create(
+                chatroom=self.room, sender=self.bob, content=str(index)
+            ).pk
+            for index in range(5)
+        ]
+        self.client.force_authenticate(self.alice)
+        self.url = f"/api/room/{self.room.pk}/"
+
+    def message_ids(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        return [message["id"] for message in response.data["messages"]], response
+
+    def test_pages_back_through_history_oldest_first(self):
+        latest, response = self.message_ids(page_size=2)
+        self.assertEqual(latest, self.ids[3:])
+        self.assertTrue(response.data["has_more"])
+        older, _ = self.message_ids(page_size=2, before_id=latest[0])
+        self.assertEqual(older, self.ids[1:3])
+        oldest, response = self.message_ids(page_size=2, before_id=older[0])
+        self.assertEqual(oldest, self.ids[:1])
+        self.assertFalse(response.data["has_more"])
+
+    def test_after_id_returns_only_newer_messages(self):
+        newer, _ = self.message_ids(after_id=self.ids[2])
+        self.assertEqual(newer, self.ids[3:])
+
+    def test_loading_history_does_not_mark_it_read(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.message_ids()
+        self.assertFalse(any(query["sql"].startswith("UPDATE") for query in queries))
+        membership = Participant.objects.get(user=self.alice)
+        self.assertEqual(membership.unread_count, len(self.ids))
+
+    def test_bad_cursors_and_outsiders_are_rejected(self):
+        self.assertEqual(self.client.get(self.url, {"before_id": "x"}).status_code, 400)
+        self.client.force_authenticate(make_user("carol"))
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+    def test_room_the_other_user_left(self):
+        Participant.objects.filter(user=self.bob).delete()
+        ids, response = self.message_ids()
+        self.assertEqual(ids, self.ids)
+        self.assertIsNone(response.data["other_user"])
+        self.assertFalse(response.data["other_user_typing"])
+
+
+class InboxTests(LocalServicesMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.alice = make_user("alice")
+        self.client.force_authenticate(self.alice)
+        self.rooms = {}
+        for name in ("bob", "carol", "dave"):
+            other = make_user(name)
+            room = ChatRoom.get_or_create_chatroom(self.alice, other)
+            Message.objects.create(chatroom=room, sender=other, content=f"hi {name}")
+            self.rooms[name] = room
+
+    def inbox(self, **params):
+        response = self.client.get("/api/chats/", params)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_rooms_by_latest_activity_with_summaries(self):
+        Message.objects.create(
+            chatroom=self.rooms["bob"], sender=self.alice, content="latest"
+        )
+        chats = self.inbox()["results"]
+        self.assertEqual(
+            [chat["other_user"]["username"] for chat in chats], ["bob", "dave", "carol"]
+        )
+        self.assertEqual(chats[0]["last_message"]["content"], "latest")
+        self.assertEqual([chat["unread_count"] for chat in chats], [1, 1, 1])
+
+    def test_query_count_does_not_grow_with_rooms(self):
+        with CaptureQueriesContext(connection) as before:
+            self.inbox()
+        for name in ("erin", "frank"):
+            ChatRoom.get_or_create_chatroom(self.alice, make_user(name))
+        with CaptureQueriesContext(connection) as after:
+            self.assertEqual(len(self.inbox()["results"]), 5)
+        self.assertEqual(len(before), len(after))
+
+    def test_pages_do_not_overlap(self):
+        first = self.inbox(page_size=2)
+        second = self.client.get(first["next"]).data
+        ids = [chat["id"] for chat in first["results"] + second["results"]]
+        self.assertEqual(sorted(ids), sorted(room.pk for room in self.rooms.values()))
+
+    def test_room_the_other_user_left(self):
+        Participant.objects.filter(chatroom=self.rooms["carol"]).exclude(
+            user=self.alice
+        ).delete()
+        chats = {chat["id"]: chat for chat in self.inbox()["results"]}
+        chat = chats[self.rooms["carol"].pk]
+        self.assertIsNone(chat["other_user"])
+        self.assertFalse(chat["other_user_typing"])
+        self.assertEqual(chat["last_message"]["content"], "hi carol")
+
+
+class TypingTests(LocalServicesMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.alice, self.bob = make_user("alice"), make_user("bob")
+        self.room = ChatRoom.get_or_create_chatroom(self.alice, self.bob)
+        self.client.force_authenticate(self.bob)
+
+    def test_store_reports_changes_and_expires(self):
+        store = presence.LocalTypingStore(ttl=60)
+        self.assertTrue(store.set(1, 2, True))
+        self.assertFalse(store.set(1, 2, True))
+        self.assertEqual(store.typing([(1, 2), (1, 3)]), {(1, 2)})
+        self.assertTrue(store.set(1, 2, False))
+        self.assertFalse(store.set(1, 2, False))
+        store = presence.LocalTypingStore(ttl=0)
+        store.set(1, 2, True)
+        self.assertEqual(store.typing([(1, 2)]), set())
+
+    def test_typing_is_shown_without_touching_the_database(self):
+        url = f"/api/room/{self.room.pk}/typing/"
+        with self.assertNumQueries(2):
+            self.client.post(url, {"is_typing": True})
+        self.client.force_authenticate(self.alice)
+        [chat] = self.client.get("/api/chats/").data["results"]
+        self.assertTrue(chat["other_user_typing"])
+        room = self.client.get(f"/api/room/{self.room.pk}/").data
+        self.assertTrue(room["other_user_typing"])
+
+        self.client.force_authenticate(self.bob)
+        self.client.post(url, {"is_typing": "false"})
+        self.assertFalse(presence.is_typing(self.room.pk, self.bob.pk))
+        self.assertEqual(self.client.post(url, {"is_typing": "x"}).status_code, 400)
+
+
+class ChatSocketMixin(LocalServicesMixin):
+    def setUp(self):
+        super().setUp()
+        self.alice, self.bob = make_user("alice"), make_user("bob")
+        self.room = ChatRoom.get_or_create_chatroom(self.alice, self.bob)
+        self.spool_dir = settings.CHAT_WRITER_OPTIONS["spool_dir"]
+
+    async def connect(self, user):
+        communicator = WebsocketCommunicator(
+            URLRouter(websocket_urlpatterns), f"/ws/chat/{self.room.pk}/"
+        )
+        communicator.scope["user"] = user
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    def spooled_entries(self):
+        entries = []
+        for name in os.listdir(self.spool_dir):
+            with open(os.path.join(self.spool_dir, name)) as file:
+                entries += [json.loads(line) for line in file]
+        return entries
+
+
+class MessageWriterTests(ChatSocketMixin, TransactionTestCase):
+    async def test_messages_are_stored_acked_and_unspooled(self):
+        sender = await self.connect(self.alice)
+        receiver = await self.connect(self.bob)
+        await sender.send_json_to({"message": "hello", "client_id": "c1"})
+        ack = await sender.receive_json_from()
+        self.assertEqual(ack["ack"], "c1")
+        broadcast = await receiver.receive_json_from()
+        self.assertEqual((broadcast["id"], broadcast["message"]), (ack["id"], "hello"))
+        message = await Message.objects.aget(pk=ack["id"])
+        self.assertIsNotNone(message.spool_id)
+        self.assertEqual(self.spooled_entries(), [])
+        await sender.disconnect()
+        await receiver.disconnect()
+
+    async def test_a_batch_is_fsynced_once(self):
+        with mock.patch("chat.writer.os.fsync") as fsync:
+            stored = await asyncio.gather(
+                *(
+                    writer.get_writer().submit(self.room.pk, self.alice.pk, str(index))
+                    for index in range(3)
+                )
+            )
+        self.assertEqual(fsync.call_count, 1)
+        self.assertEqual([message.content for message in stored], ["0", "1", "2"])
+
+    async def test_failed_stores_are_retried_without_spooling_again(self):
+        store = writer.store_messages
+        calls = []
+
+        def flaky(entries, replay=False):
+            calls.append(replay)
+            if len(calls) == 1:
+                raise RuntimeError("database unavailable")
+            return store(entries, replay)
+
+        message_writer = writer.get_writer()
+        await message_writer.started()
+        with mock.patch("chat.writer.store_messages", flaky), mock.patch.object(
+            message_writer.spool, "seal", wraps=message_writer.spool.seal
+        ) as seal, self.assertLogs("chat.writer", "ERROR"):
+            message = await message_writer.submit(self.room.pk, self.alice.pk, "hi")
+        self.assertEqual(calls, [False, True])
+        self.assertEqual(seal.call_count, 1)
+        self.assertEqual(await Message.objects.filter(pk=message.pk).acount(), 1)
+
+    async def test_orphaned_segments_are_replayed_on_startup(self):
+        os.makedirs(self.spool_dir)
+        entry = {
+            "spool_id": uuid4().hex,
+            "chatroom_id": self.room.pk,
+            "sender_id": self.bob.pk,
+            "content": "left behind",
+        }
+        with open(os.path.join(self.spool_dir, "dead.jsonl"), "w") as file:
+            file.write(json.dumps(entry) + "\n" + '{"torn')
+        communicator = await self.connect(self.alice)
+        self.assertTrue(await Message.objects.filter(content="left behind").aexists())
+        self.assertFalse(os.path.exists(os.path.join(self.spool_dir, "dead.jsonl")))
+        membership = await Participant.objects.aget(user=self.alice)
+        self.assertEqual(membership.unread_count, 1)
+        await communicator.disconnect()
+
+    async def test_failed_sends_are_logged(self):
+        communicator = await self.connect(self.alice)
+        with mock.patch.object(
+            writer.MessageWriter, "submit", side_effect=RuntimeError("boom")
+        ), self.assertLogs("chat.writer", "ERROR"):
+            await communicator.send_json_to({"message": "hello"})
+            await asyncio.sleep(0.05)
+        await communicator.disconnect()
+
+
+class TypingSocketTests(ChatSocketMixin, TransactionTestCase):
+    async def test_typing_frames_take_only_booleans(self):
+        communicator = await self.connect(self.alice)
+        for value in ("false", 0, None):
+            await communicator.send_json_to({"is_typing": value})
+            self.assertEqual(
+                await communicator.receive_json_from(),
+                {"error": "is_typing must be true or false."},
+            )
+        self.assertFalse(presence.is_typing(self.room.pk, self.alice.pk))
+        await communicator.send_json_to({"is_typing": True})
+        self.assertTrue((await communicator.receive_json_from())["is_typing"])
+        self.assertTrue(presence.is_typing(self.room.pk, self.alice.pk))
+        await communicator.disconnect()
+
+
+class ReadCursorTests(ChatSocketMixin, TransactionTestCase):
+    def setUp(self):
+        super().setUp()
+        self.ids = [
+            Message.objects.create(
+                chatroom=self.room, sender=self.bob, content=str(index)
+            ).pk
+            for index in range(3)
+        ]
+        self.client = APIClient()
+        self.client.force_authenticate(self.alice)
+        self.url = f"/api/room/{self.room.pk}/read/"
+
+    def test_marking_read_moves_the_cursor(self):
+        response = self.client.post(self.url, {"message_id": self.ids[1]})
+        self.assertEqual(
+            response.data,
+            {"last_read_message_id": self.ids[1], "unread_count": 1},
+        )
+        # Cursors never move back.
+        response = self.client.post(self.url, {"message_id": self.ids[0]})
+        self.assertEqual(response.data["last_read_message_id"], self.ids[1])
+        self.client.force_authenticate(self.bob)
+        messages = self.client.get(f"/api/room/{self.room.pk}/").data["messages"]
+        self.assertEqual(
+            [message["is_seen"] for message in messages], [True, True, False]
+        )
+
+    def test_invalid_message_ids_are_rejected(self):
+        self.assertEqual(
+            self.client.post(self.url, {"message_id": "x"}).status_code, 400
+        )
+        self.client.force_authenticate(make_user("carol"))
+        response = self.client.post(self.url, {"message_id": self.ids[0]})
+        self.assertEqual(response.status_code, 403)
+
+    async def test_read_frames_send_receipts(self):
+        reader = await self.connect(self.alice)
+        sender = await self.connect(self.bob)
+        await reader.send_json_to({"read": self.ids[-1]})
+        receipt = await sender.receive_json_from()
+        self.assertEqual(receipt, {"read_up_to": self.ids[-1], "reader": "alice"})
+        membership = await Participant.objects.aget(user=self.alice)
+        self.assertEqual(membership.unread_count, 0)
+        await reader.disconnect()
+        await sender.disconnect()
+
+    async def test_bad_read_frames_are_answered(self):
+        communicator = await self.connect(self.alice)
+        for value in ("latest", None, [1]):
+            await communicator.send_json_to({"read": value})
+            self.assertEqual(
+                await communicator.receive_json_from(),
+                {"error": "read must be a message id."},
+            )
+        await communicator.send_json_to({"read": self.ids[0]})
+        self.assertEqual(
+            (await communicator.receive_json_from())["read_up_to"], self.ids[0]
+        )
+        await communicator.disconnect()
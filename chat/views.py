@@ -1,27 +1,37 @@
 # chat/views.py
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
 from django.shortcuts import get_object_or_404
+from rest_framework.fields import BooleanField
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from rest_framework import status
-from .models import ChatRoom, Message, TypingStatus
-from social.models import Follower
+from .inbox import is_seen, mark_read
+from .models import ChatRoom, Message, Participant
+from .presence import is_typing, set_typing, typing_pairs
+from social.follows import follows_each_other
+from social.pagination import KeysetPagination
 from account.models import User
 
 
+def send_read_receipt(chatroom_id, user, read_up_to):
+    async_to_sync(get_channel_layer().group_send)(
+        f"chat_{chatroom_id}",
+        {
+            "type": "chat_message",
+            "read_up_to": read_up_to,
+            "reader": user.username,
+        },
+    )
+
+
 class StartChatView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request, username):
         other_user = get_object_or_404(User, username=username)
-        is_following = Follower.objects.filter(
-            user=request.user, followed=other_user
-        ).exists()
-        is_followed = Follower.objects.filter(
-            user=other_user, followed=request.user
-        ).exists()
-
-        if is_following and is_followed:
+        if follows_each_other(request.user.id, other_user.id):
             chatroom = ChatRoom.get_or_create_chatroom(request.user, other_user)
             return Response({"room_id": chatroom.id}, status=status.HTTP_200_OK)
         else:
@@ -33,25 +43,58 @@ class StartChatView(APIView):
 
 class ChatRoomView(APIView):
     permission_classes = [IsAuthenticated]
+    page_size = 50
+    max_page_size = 200
 
     def get(self, request, room_id):
         chatroom = get_object_or_404(ChatRoom, id=room_id)
-        if request.user not in chatroom.participants.all():
+        memberships = list(
+            Participant.objects.filter(chatroom=chatroom).select_related("user")
+        )
+        membership = next(
+            (member for member in memberships if member.user_id == request.user.id),
+            None,
+        )
+        if membership is None:
             return Response(
                 {"message": "You are not a participant in this chat room."},
                 status=status.HTTP_403_FORBIDDEN,
             )
-        messages = chatroom.messages.all().order_by("timestamp")
+        try:
+            before_id = int(request.query_params.get("before_id", 0))
+            after_id = int(request.query_params.get("after_id", 0))
+            page_size = int(request.query_params.get("page_size", self.page_size))
+        except ValueError:
+            return Response(
+                {"message": "before_id, after_id and page_size must be integers."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        page_size = min(max(page_size, 1), self.max_page_size)
 
-        # Mark messages as seen
-        messages.exclude(sender=request.user).update(is_seen=True)
+        # Without a cursor this is the latest page. before_id pages back
+        # through older history; after_id returns only what the client has
+        # not seen yet, oldest first. Messages are always returned oldest first.
+        messages = chatroom.messages.select_related("sender")
+        if after_id:
+            messages = messages.filter(id__gt=after_id).order_by("id")
+        else:
+            if before_id:
+                messages = messages.filter(id__lt=before_id)
+            messages = messages.order_by("-id")
+        messages = list(messages[: page_size + 1])
+        has_more = len(messages) > page_size
+        messages = messages[:page_size]
+        if not after_id:
+            messages.reverse()
 
-        # Get typing status
-        other_user = chatroom.participants.exclude(id=request.user.id).first()
-        typing_status = TypingStatus.objects.filter(
-            chatroom=chatroom, user=other_user
-        ).first()
-        is_typing = typing_status.is_typing if typing_status else False
+        # Get typing status; the other user may have left the room.
+        other_user = next(
+            (member.user for member in memberships if member is not membership),
+            None,
+        )
+        other_user_typing = other_user is not None and is_typing(
+            chatroom.id, other_user.id
+        )
 
         serialized_messages = [
             {
@@ -60,7 +103,7 @@ class ChatRoomView(APIView):
                 "timestamp": msg.timestamp,
                 "sender": msg.sender.username,
                 "is_delivered": msg.is_delivered,
-                "is_seen": msg.is_seen,
+                "is_seen": is_seen(msg, memberships),
             }
             for msg in messages
         ]
@@ -68,12 +111,17 @@ class ChatRoomView(APIView):
             {
                 "chatroom_id": chatroom.id,
                 "messages": serialized_messages,
-                "other_user_typing": is_typing,
-                "other_user": {
-                    "id": other_user.id,
-                    "username": other_user.username,
-                    "profile_pic": other_user.profile_pic.url,
-                },
+                "has_more": has_more,
+                "other_user_typing": other_user_typing,
+                "other_user": (
+                    {
+                        "id": other_user.id,
+                        "username": other_user.username,
+                        "profile_pic": other_user.profile_pic.url,
+                    }
+                    if other_user
+                    else None
+                ),
             }
         )
 
@@ -103,55 +151,114 @@ class ChatRoomView(APIView):
                 "timestamp": message.timestamp,
                 "sender": message.sender.username,
                 "is_delivered": message.is_delivered,
-                "is_seen": message.is_seen,
+                "is_seen": False,
             },
             status=status.HTTP_201_CREATED,
         )
 
 
+class InboxPagination(KeysetPagination):
+    ordering_field = "last_activity_at"
+
+
 class GetUserChatsView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
-        user_chatrooms = ChatRoom.objects.filter(participants=request.user)
-        chats_data = []
-        for chatroom in user_chatrooms:
-            other_user = chatroom.participants.exclude(id=request.user.id).first()
-            last_message = chatroom.messages.order_by("-timestamp").first()
+        # Each membership row carries the inbox summary for its user, so the
+        # page is one range scan on (user, -last_activity_at, -id) joined to
+        # the room's last message. The other participants are one more query
+        # for the whole page, and their typing flags one presence lookup.
+        memberships = Participant.objects.filter(user=request.user).select_related(
+            "chatroom__last_message__sender"
+        )
+        paginator = InboxPagination()
+        page = paginator.paginate_queryset(memberships, request, view=self)
+        room_ids = [membership.chatroom_id for membership in page]
+        others = {
+            participant.chatroom_id: participant
+            for participant in Participant.objects.filter(chatroom_id__in=room_ids)
+            .exclude(user=request.user)
+            .select_related("user")
+        }
+        typing = typing_pairs(
+            (chatroom_id, other.user_id) for chatroom_id, other in others.items()
+        )
 
-            # Get typing status
-            typing_status = TypingStatus.objects.filter(
-                chatroom=chatroom, user=other_user
-            ).first()
-            is_typing = typing_status.is_typing if typing_status else False
+        chats_data = []
+        for membership in page:
+            chatroom = membership.chatroom
+            # Rooms the other user has left are listed without them.
+            other = others.get(chatroom.id)
+            other_user = other.user if other else None
+            members = [membership, other] if other else [membership]
+            last_message = chatroom.last_message
 
             chat_data = {
                 "id": chatroom.id,
-                "other_user": {
-                    "id": other_user.id,
-                    "username": other_user.username,
-                    "profile_pic": other_user.profile_pic.url,
-                },
+                "other_user": (
+                    {
+                        "id": other_user.id,
+                        "username": other_user.username,
+                        "profile_pic": other_user.profile_pic.url,
+                    }
+                    if other_user
+                    else None
+                ),
                 "last_message": {
                     "content": last_message.content if last_message else None,
                     "timestamp": last_message.timestamp if last_message else None,
                     "sender": (
                         {
-                            "id": last_message.sender.id if last_message else None,
-                            "username": (
-                                last_message.sender.username if last_message else None
-                            ),
+                            "id": last_message.sender.id,
+                            "username": last_message.sender.username,
                         }
                         if last_message
                         else None
                     ),
                     "is_delivered": last_message.is_delivered if last_message else None,
-                    "is_seen": last_message.is_seen if last_message else None,
+                    "is_seen": (
+                        is_seen(last_message, members) if last_message else None
+                    ),
                 },
-                "other_user_typing": is_typing,
+                "unread_count": membership.unread_count,
+                "other_user_typing": (
+                    other_user is not None and (chatroom.id, other_user.id) in typing
+                ),
             }
             chats_data.append(chat_data)
-        return Response(chats_data)
+        return paginator.get_paginated_response(chats_data)
+
+
+class MarkReadView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, room_id):
+        membership = Participant.objects.filter(
+            chatroom_id=room_id, user=request.user
+        ).first()
+        if membership is None:
+            return Response(
+                {"message": "You are not a participant in this chat room."},
+                status=status.HTTP_403_FORBIDDEN,
+            )
+        try:
+            message_id = int(request.data.get("message_id"))
+        except (TypeError, ValueError):
+            return Response(
+                {"message": "message_id must be an integer."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        read_up_to = mark_read(room_id, request.user.id, message_id)
+        if read_up_to is not None:
+            send_read_receipt(room_id, request.user, read_up_to)
+            membership.refresh_from_db(fields=["last_read_message_id", "unread_count"])
+        return Response(
+            {
+                "last_read_message_id": membership.last_read_message_id,
+                "unread_count": membership.unread_count,
+            }
+        )
 
 
 class TypingStatusView(APIView):
@@ -164,8 +271,15 @@ class TypingStatusView(APIView):
                 {"message": "You are not a participant in this chat room."},
                 status=status.HTTP_403_FORBIDDEN,
             )
-        is_typing = request.data.get("is_typing", False)
-        TypingStatus.objects.update_or_create(
-            chatroom=chatroom, user=request.user, defaults={"is_typing": is_typing}
-        )
+        typing = BooleanField().to_internal_value(request.data.get("is_typing", False))
+        if set_typing(chatroom.id, request.user.id, typing):
+            async_to_sync(get_channel_layer().group_send)(
+                f"chat_{chatroom.id}",
+                {
+                    "type": "chat_message",
+                    "message": "",
+                    "is_typing": typing,
+                    "sender": request.user.username,
+                },
+            )
         return Response({"status": "updated"}, status=status.HTTP_200_OK)
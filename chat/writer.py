@@ -0,0 +1,262 @@
+import asyncio
+import fcntl
+import json
+import logging
+import os
+import socket
+from collections import defaultdict
+from functools import lru_cache, partial
+from uuid import UUID, uuid4
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import transaction
+
+from account.models import User
+from .inbox import rebuild_summaries, record_messages
+from .models import ChatRoom, Message
+
+logger = logging.getLogger(__name__)
+
+
+def spawn(coroutine, tasks):
+    """Run ``coroutine`` as a task held in ``tasks`` until it finishes, so it
+    is not garbage collected midway, and log it if it fails.
+    """
+    task = asyncio.create_task(coroutine)
+    tasks.add(task)
+    task.add_done_callback(partial(_task_done, tasks))
+    return task
+
+
+def _task_done(tasks, task):
+    tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("Chat task failed", exc_info=task.exception())
+
+
+class Spool:
+    """Append-only segment files holding messages until they are stored.
+
+    Each writer seals every batch it takes to flush into its own segment,
+    written and fsynced while it holds an exclusive lock on it. A segment is
+    deleted once every message in it is in the database; segments whose lock
+    can be taken belong to a dead process and are replayed.
+    """
+
+    def __init__(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.file = self._open()
+
+    def _open(self):
+        name = f"{socket.gethostname()}-{os.getpid()}-{uuid4().hex}.jsonl"
+        file = open(os.path.join(self.directory, name), "a", encoding="utf-8")
+        fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return file
+
+    def seal(self, entries):
+        """Write ``entries`` to disk and return their segment, still locked.
+
+        Blocks on the fsync, so writers call it from an executor.
+        """
+        self.file.write("".join(json.dumps(entry) + "\n" for entry in entries))
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        sealed, self.file = self.file, self._open()
+        return sealed
+
+    @staticmethod
+    def discard(*files):
+        for file in files:
+            os.remove(file.name)
+            file.close()
+
+
+def store_messages(entries, replay=False):
+    """Insert spooled ``entries`` and update the inbox summaries of their rooms.
+
+    Replays skip entries that were stored before the writer died and
+    recompute the summaries outright, since those may already count them.
+    """
+    messages = [
+        Message(
+            chatroom_id=entry["chatroom_id"],
+            sender_id=entry["sender_id"],
+            content=entry["content"],
+            is_delivered=True,
+            spool_id=UUID(entry["spool_id"]),
+        )
+        for entry in entries
+    ]
+    with transaction.atomic():
+        if not replay:
+            Message.objects.bulk_create(messages)
+            by_room = defaultdict(list)
+            for message in messages:
+                by_room[message.chatroom_id].append(message)
+            for chatroom_id, room_messages in by_room.items():
+                record_messages(chatroom_id, room_messages)
+            return messages
+        # Rooms or senders deleted since the message was spooled drop it.
+        rooms = ChatRoom.objects.filter(
+            pk__in={message.chatroom_id for message in messages}
+        ).values_list("pk", flat=True)
+        senders = User.objects.filter(
+            pk__in={message.sender_id for message in messages}
+        ).values_list("pk", flat=True)
+        rooms, senders = set(rooms), set(senders)
+        Message.objects.bulk_create(
+            [
+                message
+                for message in messages
+                if message.chatroom_id in rooms and message.sender_id in senders
+            ],
+            ignore_conflicts=True,
+        )
+        rebuild_summaries(rooms)
+    stored = Message.objects.in_bulk(
+        [message.spool_id for message in messages], field_name="spool_id"
+    )
+    return [stored.get(message.spool_id) for message in messages]
+
+
+def replay_orphans(directory):
+    """Store the messages of segments left behind by dead writers."""
+    if not os.path.isdir(directory):
+        return 0
+    replayed = 0
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith(".jsonl"):
+            continue
+        path = os.path.join(directory, name)
+        try:
+            file = open(path, "r+", encoding="utf-8")
+        except FileNotFoundError:
+            continue
+        try:
+            fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            file.close()
+            continue
+        # A crash can leave a torn last line; everything before it is whole.
+        entries = []
+        for line in file:
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                break
+        if entries:
+            store_messages(entries, replay=True)
+        replayed += len(entries)
+        Spool.discard(file)
+    return replayed
+
+
+class MessageWriter:
+    """Write-behind buffer for chat messages.
+
+    ``submit`` queues a message and waits for it to be stored. Once per
+    ``flush_interval`` seconds, or sooner once ``max_batch`` messages are
+    waiting, the queue is sealed into the spool with one fsync and stored
+    with one ``bulk_create``. A failed store is retried with backoff and the
+    messages stay spooled throughout.
+    """
+
+    def __init__(self, spool_dir, flush_interval, max_batch):
+        self.spool_dir = spool_dir
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.spool = None
+        self.pending = []
+        # Sealed into the spool but not stored yet, with their segments
+        self.spooled = []
+        self.retired = []
+        self.replay = False
+        self.timer = None
+        self.tasks = set()
+        self.lock = None
+        self.starting = None
+
+    async def start(self):
+        await database_sync_to_async(replay_orphans)(self.spool_dir)
+        self.spool = await asyncio.get_running_loop().run_in_executor(
+            None, Spool, self.spool_dir
+        )
+        self.lock = asyncio.Lock()
+
+    def started(self):
+        """Start the writer, replaying segments left by dead writers, unless
+        it is running or starting already. Await the result before submitting.
+        """
+        if self.starting is None or (
+            self.starting.done()
+            and (self.starting.cancelled() or self.starting.exception())
+        ):
+            self.starting = asyncio.ensure_future(self.start())
+        return self.starting
+
+    async def submit(self, chatroom_id, sender_id, content):
+        await self.started()
+        entry = {
+            "spool_id": uuid4().hex,
+            "chatroom_id": int(chatroom_id),
+            "sender_id": sender_id,
+            "content": content,
+        }
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((entry, future))
+        if len(self.pending) >= self.max_batch:
+            spawn(self.flush(), self.tasks)
+        elif self.timer is None:
+            self.timer = spawn(self.flush_later(self.flush_interval), self.tasks)
+        return await future
+
+    async def flush_later(self, delay):
+        await asyncio.sleep(delay)
+        self.timer = None
+        await self.flush()
+
+    def retry_later(self):
+        if self.timer is None:
+            self.timer = spawn(self.flush_later(1), self.tasks)
+
+    async def flush(self):
+        loop = asyncio.get_running_loop()
+        async with self.lock:
+            fresh, self.pending = self.pending, []
+            if fresh:
+                try:
+                    segment = await loop.run_in_executor(
+                        None, self.spool.seal, [entry for entry, _ in fresh]
+                    )
+                except Exception:
+                    logger.exception("Spooling %d chat messages failed", len(fresh))
+                    self.pending[:0] = fresh
+                    self.retry_later()
+                    return
+                self.retired.append(segment)
+                self.spooled += fresh
+            batch = self.spooled
+            if not batch:
+                return
+            try:
+                messages = await database_sync_to_async(store_messages)(
+                    [entry for entry, _ in batch], self.replay
+                )
+            except Exception:
+                logger.exception("Storing %d chat messages failed", len(batch))
+                self.replay = True
+                self.retry_later()
+                return
+            self.spooled, self.replay = [], False
+            retired, self.retired = self.retired, []
+            await loop.run_in_executor(None, Spool.discard, *retired)
+        for (_, future), message in zip(batch, messages):
+            if not future.done():
+                future.set_result(message)
+
+
+@lru_cache(maxsize=None)
+def get_writer():
+    return MessageWriter(**settings.CHAT_WRITER_OPTIONS)
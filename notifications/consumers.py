@@ -1,34 +1,23 @@
 import json
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
-from account.models import User
-from django.contrib.auth import get_user_model
-from rest_framework_simplejwt.tokens import AccessToken
-from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
-
-User = get_user_model()
+from .counters import get_counts
 
 
 class NotificationConsumer(AsyncWebsocketConsumer):
     async def connect(self):
-        try:
-            # Get the token from the query string
-            token = self.scope["query_string"].decode().split("=")[1]
-            # Validate the token and get the user
-            user = await self.get_user_from_token(token)
-
-            if user:
-                self.user = user
-                self.room_group_name = f"user_{self.user.id}_notifications"
-                await self.channel_layer.group_add(
-                    self.room_group_name, self.channel_name
-                )
-                await self.accept()
-            else:
-                await self.close()
-        except (IndexError, InvalidToken, TokenError):
-            # If token is invalid or not provided, close the connection
+        # Set from the ?token= access token by JWTAuthMiddleware.
+        user = self.scope["user"]
+        if not user.is_authenticated:
             await self.close()
+            return
+
+        self.user = user
+        self.room_group_name = f"user_{self.user.id}_notifications"
+        await self.channel_layer.group_add(self.room_group_name, self.channel_name)
+        await self.accept()
+        counts = await database_sync_to_async(get_counts)(user.id)
+        await self.send(text_data=json.dumps({"unread_counts": counts}))
 
     async def disconnect(self, close_code):
         if hasattr(self, "room_group_name"):
@@ -43,14 +32,5 @@ class NotificationConsumer(AsyncWebsocketConsumer):
         message = event["message"]
         await self.send(text_data=json.dumps({"message": message}))
 
-    @database_sync_to_async
-    def get_user_from_token(self, token):
-        try:
-            # Validate the token
-            validated_token = AccessToken(token)
-            user_id = validated_token["user_id"]
-
-            # Get the user
-            return User.objects.get(id=user_id)
-        except (InvalidToken, TokenError, User.DoesNotExist):
-            return None
+    async def send_unread_counts(self, event):
+        await self.send(text_data=json.dumps({"unread_counts": event["counts"]}))
@@ -0,0 +1,114 @@
+import asyncio
+from collections import defaultdict
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import transaction
+from django.db.models import Count, F
+from django.db.models.functions import Greatest
+
+from chat.models import Participant
+from .models import Notification, UnreadCounts
+
+
+def as_dict(counts):
+    return {"notifications": counts.notifications, "chats": counts.chats}
+
+
+def get_counts(user_id):
+    counts = UnreadCounts.objects.filter(pk=user_id).first()
+    return as_dict(counts or UnreadCounts())
+
+
+def adjust_unread(deltas):
+    """Apply ``{user_id: (notifications, chats)}`` deltas to the users'
+    counts and mark them to be pushed by the ``process_notifications`` worker.
+    """
+    deltas = {user_id: delta for user_id, delta in deltas.items() if any(delta)}
+    if not deltas:
+        return
+    # Only increments need a row: a missing one has nothing to decrement, and
+    # decrements also run while users are deleted, rows and all.
+    UnreadCounts.objects.bulk_create(
+        [
+            UnreadCounts(user_id=user_id)
+            for user_id, delta in deltas.items()
+            if max(delta) > 0
+        ],
+        ignore_conflicts=True,
+    )
+    by_delta = defaultdict(list)
+    for user_id, delta in deltas.items():
+        by_delta[delta].append(user_id)
+    for (notifications, chats), user_ids in by_delta.items():
+        UnreadCounts.objects.filter(pk__in=user_ids).update(
+            notifications=Greatest(F("notifications") + notifications, 0),
+            chats=Greatest(F("chats") + chats, 0),
+            dirty=True,
+        )
+
+
+def recount_unread(user_ids):
+    """Recompute the counts of ``user_ids`` from the notification and chat
+    membership rows.
+    """
+    notifications = dict(
+        Notification.objects.filter(recipient_id__in=user_ids, is_read=False)
+        .values("recipient_id")
+        .annotate(total=Count("pk"))
+        .values_list("recipient_id", "total")
+    )
+    chats = dict(
+        Participant.objects.filter(user_id__in=user_ids, unread_count__gt=0)
+        .values("user_id")
+        .annotate(total=Count("pk"))
+        .values_list("user_id", "total")
+    )
+    UnreadCounts.objects.bulk_create(
+        [
+            UnreadCounts(
+                user_id=user_id,
+                notifications=notifications.get(user_id, 0),
+                chats=chats.get(user_id, 0),
+                dirty=True,
+            )
+            for user_id in user_ids
+        ],
+        update_conflicts=True,
+        unique_fields=["user"],
+        update_fields=["notifications", "chats", "dirty"],
+    )
+
+
+def push_counts(batch_size):
+    """Send up to ``batch_size`` counts that changed since they were last sent
+    over their users' notification sockets, and return how many were sent.
+    Best effort: clients can always fetch them instead.
+    """
+    with transaction.atomic():
+        counts = {
+            user_counts.pk: user_counts
+            for user_counts in UnreadCounts.objects.select_for_update(
+                skip_locked=True
+            ).filter(dirty=True)[:batch_size]
+        }
+        if not counts:
+            return 0
+        # Changes committed after this are marked again for the next batch.
+        UnreadCounts.objects.filter(pk__in=counts).update(dirty=False)
+    channel_layer = get_channel_layer()
+
+    async def send():
+        await asyncio.gather(
+            *(
+                channel_layer.group_send(
+                    f"user_{user_id}_notifications",
+                    {"type": "send_unread_counts", "counts": as_dict(user_counts)},
+                )
+                for user_id, user_counts in counts.items()
+            ),
+            return_exceptions=True,
+        )
+
+    async_to_sync(send)()
+    return len(counts)
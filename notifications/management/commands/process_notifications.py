@@ -0,0 +1,37 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from notifications.counters import push_counts
+from notifications.outbox import process_batch
+
+
+class Command(BaseCommand):
+    help = "Store and push queued notifications and changed unread counts."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=0.5,
+            help="Seconds to sleep when the outbox is empty.",
+        )
+        parser.add_argument(
+            "--once", action="store_true", help="Exit once the outbox is empty."
+        )
+
+    def handle(self, *args, **options):
+        processed = 0
+        while True:
+            handled = process_batch(options["batch_size"])
+            handled += push_counts(options["batch_size"])
+            processed += handled
+            if handled:
+                continue
+            if options["once"]:
+                break
+            time.sleep(options["interval"])
+        self.stdout.write(
+            f"Processed {processed} notification events and unread counts"
+        )
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from account.models import User
+from notifications.counters import recount_unread
+
+
+class Command(BaseCommand):
+    help = "Recompute every user's unread notification and chat counts."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        users = User.objects.order_by("pk").values_list("pk", flat=True)
+        last_pk = 0
+        total = 0
+        while True:
+            ids = list(users.filter(pk__gt=last_pk)[: options["batch_size"]])
+            if not ids:
+                break
+            recount_unread(ids)
+            last_pk = ids[-1]
+            total += len(ids)
+        self.stdout.write(f"Recounted unread counts of {total} users")
@@ -0,0 +1,26 @@
+from django.db import migrations
+
+
+def list_senders(apps, schema_editor):
+    Notification = apps.get_model("notifications", "Notification")
+    batch = []
+    for notification in Notification.objects.only("sender_id").iterator(
+        chunk_size=1000
+    ):
+        notification.recent_actors = [notification.sender_id]
+        batch.append(notification)
+        if len(batch) == 1000:
+            Notification.objects.bulk_update(batch, ["recent_actors"])
+            batch = []
+    Notification.objects.bulk_update(batch, ["recent_actors"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("notifications", "0004_coalesced_notifications"),
+    ]
+
+    operations = [
+        migrations.RunPython(list_senders, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.0.6 on 2026-10-18 19:15
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("account", "0007_index_num_followers"),
+        ("notifications", "0006_unread_index"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="UnreadCounts",
+            fields=[
+                (
+                    "user",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="+",
+                        serialize=False,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                ("notifications", models.PositiveIntegerField(default=0)),
+                ("chats", models.PositiveIntegerField(default=0)),
+                ("dirty", models.BooleanField(default=False)),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        condition=models.Q(("dirty", True)),
+                        fields=["user"],
+                        name="unread_counts_dirty_idx",
+                    )
+                ],
+            },
+        ),
+    ]
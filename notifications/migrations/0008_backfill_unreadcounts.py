@@ -0,0 +1,45 @@
+from django.db import migrations
+from django.db.models import Count
+
+
+def count_unread(apps, schema_editor):
+    Notification = apps.get_model("notifications", "Notification")
+    Participant = apps.get_model("chat", "Participant")
+    UnreadCounts = apps.get_model("notifications", "UnreadCounts")
+    notifications = dict(
+        Notification.objects.filter(is_read=False)
+        .order_by()
+        .values("recipient_id")
+        .annotate(total=Count("pk"))
+        .values_list("recipient_id", "total")
+    )
+    chats = dict(
+        Participant.objects.filter(unread_count__gt=0)
+        .order_by()
+        .values("user_id")
+        .annotate(total=Count("pk"))
+        .values_list("user_id", "total")
+    )
+    UnreadCounts.objects.bulk_create(
+        [
+            UnreadCounts(
+                user_id=user_id,
+                notifications=notifications.get(user_id, 0),
+                chats=chats.get(user_id, 0),
+            )
+            for user_id in notifications.keys() | chats.keys()
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat", "0011_remove_message_is_seen"),
+        ("notifications", "0007_unreadcounts"),
+    ]
+
+    operations = [
+        migrations.RunPython(count_unread, migrations.RunPython.noop),
+    ]
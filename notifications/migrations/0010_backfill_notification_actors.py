@@ -0,0 +1,46 @@
+from django.db import migrations
+
+
+def list_actors(apps, schema_editor):
+    Notification = apps.get_model("notifications", "Notification")
+    NotificationActor = apps.get_model("notifications", "NotificationActor")
+    User = apps.get_model("account", "User")
+    notifications = Notification.objects.only("recent_actors").iterator(chunk_size=1000)
+    batch = []
+    for notification in notifications:
+        batch.append(notification)
+        if len(batch) == 1000:
+            add_actors(User, NotificationActor, batch)
+            batch = []
+    add_actors(User, NotificationActor, batch)
+
+
+def add_actors(User, NotificationActor, notifications):
+    users = set(
+        User.objects.filter(
+            pk__in={
+                pk
+                for notification in notifications
+                for pk in notification.recent_actors
+            }
+        ).values_list("pk", flat=True)
+    )
+    NotificationActor.objects.bulk_create(
+        [
+            NotificationActor(notification=notification, user_id=user_id)
+            for notification in notifications
+            for user_id in set(notification.recent_actors) & users
+        ],
+        ignore_conflicts=True,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("notifications", "0009_notificationactor"),
+    ]
+
+    operations = [
+        migrations.RunPython(list_actors, migrations.RunPython.noop),
+    ]
@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 from account.models import User
 
 
@@ -18,7 +19,90 @@ class Notification(models.Model):
         "social.Post", on_delete=models.CASCADE, null=True, blank=True
     )
     is_read = models.BooleanField(default=False)
-    created_at = models.DateTimeField(auto_now_add=True)
+    # Time of the latest action, set from the outbox event rather than on save
+    created_at = models.DateTimeField(default=timezone.now)
+    # Actions of the same type on the same post coalesce into one row:
+    # ``sender`` is the latest actor, ``recent_actors`` the latest few ids and
+    # ``actor_count`` the number of distinct actors, kept in ``actors``.
+    actor_count = models.PositiveIntegerField(default=1)
+    recent_actors = models.JSONField(default=list)
+    pushed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["recipient", "-created_at", "-id"]),
+            models.Index(
+                fields=["recipient", "-created_at", "-id"],
+                condition=models.Q(is_read=False),
+                name="notification_unread_idx",
+            ),
+        ]
 
     def __str__(self):
         return f"{self.sender} {self.notification_type} - {self.recipient}"
+
+
+class NotificationActor(models.Model):
+    """A user who acted on a coalesced notification, counted once."""
+
+    notification = models.ForeignKey(
+        Notification, on_delete=models.CASCADE, related_name="actors"
+    )
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="+")
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["notification", "user"], name="unique_notification_actor"
+            )
+        ]
+
+
+class NotificationEvent(models.Model):
+    """Outbox entry written on the request path by ``send_notification``.
+
+    The ``process_notifications`` worker folds batches of events into
+    notifications and pushes them, retrying failed pushes with backoff.
+    ``notification`` is set once the event is folded, so a retry only
+    re-pushes.
+    """
+
+    recipient = models.ForeignKey(User, on_delete=models.CASCADE, related_name="+")
+    sender = models.ForeignKey(User, on_delete=models.CASCADE, related_name="+")
+    notification_type = models.CharField(
+        max_length=20, choices=Notification.NOTIFICATION_TYPES
+    )
+    post = models.ForeignKey(
+        "social.Post", on_delete=models.CASCADE, null=True, blank=True
+    )
+    created_at = models.DateTimeField(default=timezone.now)
+    notification = models.ForeignKey(
+        Notification, on_delete=models.CASCADE, null=True, related_name="+"
+    )
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+
+class UnreadCounts(models.Model):
+    """Badge counts of a user: unread notifications and chat rooms with unread
+    messages. Kept up to date by ``notifications.counters``, which marks them
+    dirty for the ``process_notifications`` worker to push; the
+    ``reconcile_unread`` command recomputes them.
+    """
+
+    user = models.OneToOneField(
+        User, on_delete=models.CASCADE, primary_key=True, related_name="+"
+    )
+    notifications = models.PositiveIntegerField(default=0)
+    chats = models.PositiveIntegerField(default=0)
+    # Changed since the counts were last pushed by process_notifications
+    dirty = models.BooleanField(default=False)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["user"],
+                condition=models.Q(dirty=True),
+                name="unread_counts_dirty_idx",
+            )
+        ]
@@ -0,0 +1,228 @@
+import asyncio
+import logging
+from collections import defaultdict
+from datetime import timedelta
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from account.models import User
+from .counters import adjust_unread
+from .models import Notification, NotificationActor, NotificationEvent, UnreadCounts
+from .serializers import ActorSerializer, serialize_actors
+
+logger = logging.getLogger(__name__)
+
+
+def notification_payload(notification, actors):
+    return {
+        "id": notification.id,
+        "notification_type": notification.notification_type,
+        "sender": ActorSerializer(notification.sender).data,
+        "post": notification.post_id,
+        "actor_count": notification.actor_count,
+        "recent_actors": serialize_actors(notification.recent_actors, actors),
+        "created_at": notification.created_at.isoformat(),
+    }
+
+
+async def push_all(messages):
+    """Send ``(recipient_id, message)`` pairs concurrently and return which
+    of them reached the channel layer.
+    """
+    channel_layer = get_channel_layer()
+    results = await asyncio.gather(
+        *(
+            channel_layer.group_send(
+                f"user_{recipient_id}_notifications",
+                {"type": "send_notification", "message": message},
+            )
+            for recipient_id, message in messages
+        ),
+        return_exceptions=True,
+    )
+    return [not isinstance(result, BaseException) for result in results]
+
+
+def coalesce(events):
+    """Fold fresh ``events`` (oldest first) into notifications, one per
+    recipient, type and post. Each group joins that key's latest
+    notification if it was active within ``NOTIFICATION_COALESCE_WINDOW``.
+    """
+    groups = defaultdict(list)
+    for event in events:
+        key = (event.recipient_id, event.notification_type, event.post_id)
+        groups[key].append(event)
+    recipient_ids = sorted({recipient_id for recipient_id, _, _ in groups})
+    # Lock the recipients' counts rows, so that concurrent workers coalesce
+    # one recipient's events in turn rather than each creating a new row.
+    UnreadCounts.objects.bulk_create(
+        [UnreadCounts(user_id=user_id) for user_id in recipient_ids],
+        ignore_conflicts=True,
+    )
+    list(
+        UnreadCounts.objects.select_for_update()
+        .filter(pk__in=recipient_ids)
+        .order_by("pk")
+        .values_list("pk", flat=True)
+    )
+    cutoff = timezone.now() - settings.NOTIFICATION_COALESCE_WINDOW
+    active = Notification.objects.select_for_update().filter(
+        recipient_id__in=recipient_ids,
+        notification_type__in={kind for _, kind, _ in groups},
+        created_at__gte=cutoff,
+    )
+    latest = {}
+    for notification in active.order_by("created_at", "id"):
+        key = (
+            notification.recipient_id,
+            notification.notification_type,
+            notification.post_id,
+        )
+        if key in groups:
+            latest[key] = notification
+    seen = defaultdict(set)
+    for notification_id, user_id in NotificationActor.objects.filter(
+        notification__in=latest.values(),
+        user_id__in={event.sender_id for event in events},
+    ).values_list("notification_id", "user_id"):
+        seen[notification_id].add(user_id)
+
+    created, updated, actors = [], [], []
+    unread = defaultdict(int)
+    for key, group in groups.items():
+        notification = latest.get(key)
+        if notification is None:
+            recipient_id, kind, post_id = key
+            notification = Notification(
+                recipient_id=recipient_id,
+                notification_type=kind,
+                post_id=post_id,
+                actor_count=0,
+            )
+            created.append(notification)
+        else:
+            updated.append(notification)
+        if notification.pk is None or notification.is_read:
+            unread[notification.recipient_id] += 1
+        # Repeat actions by the same actors, such as like, unlike and like
+        # again, are not counted twice.
+        senders = {event.sender_id for event in group} - seen[notification.pk]
+        notification.actor_count += len(senders)
+        actors.append((notification, senders))
+        recent = list(notification.recent_actors)
+        for event in group:
+            if event.sender_id in recent:
+                recent.remove(event.sender_id)
+            recent.insert(0, event.sender_id)
+        notification.recent_actors = recent[: settings.NOTIFICATION_RECENT_ACTORS]
+        notification.sender_id = group[-1].sender_id
+        notification.created_at = group[-1].created_at
+        notification.is_read = False
+    Notification.objects.bulk_create(created)
+    Notification.objects.bulk_update(
+        updated,
+        ["recent_actors", "actor_count", "sender", "created_at", "is_read"],
+    )
+    NotificationActor.objects.bulk_create(
+        [
+            NotificationActor(notification=notification, user_id=user_id)
+            for notification, senders in actors
+            for user_id in senders
+        ]
+    )
+    adjust_unread({user_id: (count, 0) for user_id, count in unread.items()})
+    for notification in created + updated:
+        key = (
+            notification.recipient_id,
+            notification.notification_type,
+            notification.post_id,
+        )
+        for event in groups[key]:
+            event.notification = notification
+
+
+def claim_events(batch_size):
+    """Lease a batch of due events and fold the new ones into notifications."""
+    now = timezone.now()
+    with transaction.atomic():
+        events = list(
+            NotificationEvent.objects.select_for_update(skip_locked=True)
+            .filter(next_attempt_at__lte=now)
+            .order_by("id")[:batch_size]
+        )
+        if not events:
+            return []
+        coalesce([event for event in events if event.notification_id is None])
+        for event in events:
+            event.next_attempt_at = now + settings.NOTIFICATION_PUSH_LEASE
+        NotificationEvent.objects.bulk_update(
+            events, ["notification", "next_attempt_at"]
+        )
+    return events
+
+
+def process_batch(batch_size):
+    """Store and push one batch of events; returns how many were handled.
+
+    A notification is pushed at most once per ``NOTIFICATION_PUSH_INTERVAL``,
+    and failed pushes are retried with backoff up to
+    ``NOTIFICATION_PUSH_MAX_ATTEMPTS`` times.
+    """
+    events = claim_events(batch_size)
+    if not events:
+        return 0
+    notifications = Notification.objects.select_related("sender").in_bulk(
+        {event.notification_id for event in events}
+    )
+    groups = defaultdict(list)
+    for event in events:
+        if event.notification_id in notifications:
+            groups[event.notification_id].append(event)
+
+    now = timezone.now()
+    interval = settings.NOTIFICATION_PUSH_INTERVAL
+    due, waiting = [], []
+    for notification_id, group in groups.items():
+        pushed_at = notifications[notification_id].pushed_at
+        if pushed_at is not None and pushed_at > now - interval:
+            for event in group:
+                event.next_attempt_at = pushed_at + interval
+            waiting.extend(group)
+        else:
+            due.append(notifications[notification_id])
+    actors = User.objects.in_bulk(
+        {pk for notification in due for pk in notification.recent_actors}
+    )
+    delivered = async_to_sync(push_all)(
+        [
+            (notification.recipient_id, notification_payload(notification, actors))
+            for notification in due
+        ]
+    )
+
+    pushed, finished, retries = [], [], []
+    for notification, ok in zip(due, delivered):
+        if ok:
+            pushed.append(notification.pk)
+        for event in groups[notification.pk]:
+            event.attempts += 1
+            if ok or event.attempts >= settings.NOTIFICATION_PUSH_MAX_ATTEMPTS:
+                finished.append(event.pk)
+            else:
+                event.next_attempt_at = now + timedelta(seconds=2**event.attempts)
+                retries.append(event)
+    Notification.objects.filter(pk__in=pushed).update(pushed_at=now)
+    NotificationEvent.objects.filter(pk__in=finished).delete()
+    if retries:
+        logger.warning(
+            "Pushing %d notifications failed; retrying", len(due) - len(pushed)
+        )
+    if retries or waiting:
+        NotificationEvent.objects.bulk_update(
+            retries + waiting, ["attempts", "next_attempt_at"]
+        )
+    return len(events)
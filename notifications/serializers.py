@@ -1,11 +1,49 @@
 from rest_framework import serializers
 from .models import Notification
-from account.serializers import UserSerializer
+from account.models import User
+from social.images import variant_urls
+
+
+class ActorSerializer(serializers.ModelSerializer):
+    profile_pic_variants = serializers.SerializerMethodField()
+
+    class Meta:
+        model = User
+        fields = ["id", "username", "profile_pic", "profile_pic_variants"]
+
+    def get_profile_pic_variants(self, obj):
+        return variant_urls(
+            obj.profile_pic, obj.profile_pic_variants, self.context.get("request")
+        )
+
+
+def serialize_actors(ids, actors, context=None):
+    """Serialize the users in ``ids`` that are in the ``actors`` map, in order."""
+    return ActorSerializer(
+        [actors[pk] for pk in ids if pk in actors], many=True, context=context or {}
+    ).data
 
 
 class NotificationSerializer(serializers.ModelSerializer):
-    sender = UserSerializer(read_only=True)
+    sender = ActorSerializer(read_only=True)
+    recent_actors = serializers.SerializerMethodField()
 
     class Meta:
         model = Notification
-        fields = ["id", "sender", "notification_type", "post", "is_read", "created_at"]
+        fields = [
+            "id",
+            "sender",
+            "notification_type",
+            "post",
+            "actor_count",
+            "recent_actors",
+            "is_read",
+            "created_at",
+        ]
+
+    def get_recent_actors(self, obj):
+        # List views pass the actors of the whole page in the context.
+        actors = self.context.get("actors")
+        if actors is None:
+            actors = User.objects.in_bulk(obj.recent_actors)
+        return serialize_actors(obj.recent_actors, actors, self.context)
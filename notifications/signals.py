@@ -0,0 +1,20 @@
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from chat.models import Participant
+from .counters import adjust_unread
+from .models import Notification
+
+
+# Also sent for rows deleted by cascade, such as the notifications of a
+# deleted post or the memberships of a deleted room.
+@receiver(post_delete, sender=Notification)
+def uncount_notification(instance, **kwargs):
+    if not instance.is_read:
+        adjust_unread({instance.recipient_id: (-1, 0)})
+
+
+@receiver(post_delete, sender=Participant)
+def uncount_chat(instance, **kwargs):
+    if instance.unread_count:
+        adjust_unread({instance.user_id: (0, -1)})
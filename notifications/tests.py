@@ -1,3 +1,239 @@
-from django.test import TestCase
+import io
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.management import call_command
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APITestCase
+
+from chat.models import ChatRoom, Message
+from social.models import Post
+from social.tests import LocalServicesMixin, make_user
+from .counters import adjust_unread, push_counts
+from .models import Notification, NotificationEvent, UnreadCounts
+from .outbox import process_batch
+from .utils import send_notification
+
+
+async def fail_pushes(messages):
+    return [False] * len(messages)
+
+
+class NotificationTestMixin(LocalServicesMixin):
+    def setUp(self):
+        super().setUp()
+        self.alice, self.bob = make_user("alice"), make_user("bob")
+        self.post = Post.objects.create(author=self.alice, content="hello")
+
+    def listen(self, user):
+        layer = get_channel_layer()
+        channel = async_to_sync(layer.new_channel)()
+        async_to_sync(layer.group_add)(f"user_{user.pk}_notifications", channel)
+        return lambda: async_to_sync(layer.receive)(channel)
+
+
+class OutboxTests(NotificationTestMixin, APITestCase):
+    def test_requests_only_record_an_event(self):
+        self.client.force_authenticate(self.bob)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(f"/api/posts/{self.post.pk}/like/")
+        touched = [
+            query["sql"] for query in queries if '"notifications_' in query["sql"]
+        ]
+        self.assertEqual(len(touched), 1)
+        self.assertIn("notifications_notificationevent", touched[0])
+        self.assertEqual(NotificationEvent.objects.count(), 1)
+        self.assertFalse(Notification.objects.exists())
+
+    def test_worker_stores_and_pushes_events(self):
+        receive = self.listen(self.alice)
+        send_notification(self.alice, self.bob, "follow")
+        self.assertEqual(process_batch(100), 1)
+        notification = Notification.objects.get()
+        self.assertEqual(
+            (notification.sender, notification.notification_type),
+            (self.bob, "follow"),
+        )
+        self.assertIsNotNone(notification.pushed_at)
+        self.assertEqual(receive()["message"]["id"], notification.pk)
+        self.assertFalse(NotificationEvent.objects.exists())
+        self.assertEqual(process_batch(100), 0)
+
+    def test_failed_pushes_are_retried_with_backoff(self):
+        send_notification(self.alice, self.bob, "follow")
+        with mock.patch("notifications.outbox.push_all", fail_pushes):
+            with self.assertLogs("notifications.outbox", "WARNING"):
+                process_batch(100)
+        event = NotificationEvent.objects.get()
+        self.assertEqual(event.attempts, 1)
+        self.assertGreater(event.next_attempt_at, timezone.now())
+        # The notification is stored once and only pushed on retry.
+        NotificationEvent.objects.update(next_attempt_at=timezone.now())
+        process_batch(100)
+        self.assertEqual(Notification.objects.count(), 1)
+        self.assertFalse(NotificationEvent.objects.exists())
+
+    @override_settings(NOTIFICATION_PUSH_MAX_ATTEMPTS=1)
+    def test_events_are_dropped_after_the_last_attempt(self):
+        send_notification(self.alice, self.bob, "follow")
+        with mock.patch("notifications.outbox.push_all", fail_pushes):
+            process_batch(100)
+        self.assertFalse(NotificationEvent.objects.exists())
+        self.assertTrue(Notification.objects.exists())
+
+
+class CoalescingTests(NotificationTestMixin, APITestCase):
+    def test_actions_on_a_post_coalesce(self):
+        fans = [make_user(f"fan{index}") for index in range(4)]
+        for fan in fans:
+            send_notification(self.alice, fan, "like", self.post)
+        send_notification(self.alice, self.bob, "comment", self.post)
+        process_batch(100)
+        like = Notification.objects.get(notification_type="like")
+        self.assertEqual(like.actor_count, 4)
+        self.assertEqual(like.sender, fans[-1])
+        self.assertEqual(like.recent_actors, [fan.pk for fan in fans[:0:-1]])
+        self.assertEqual(Notification.objects.count(), 2)
+
+    def test_repeat_actors_are_counted_once(self):
+        for _ in range(2):
+            send_notification(self.alice, self.bob, "like", self.post)
+        process_batch(100)
+        send_notification(self.alice, self.bob, "like", self.post)
+        process_batch(100)
+        self.assertEqual(Notification.objects.get().actor_count, 1)
+
+    def test_repeat_actors_beyond_the_recent_ones_are_counted_once(self):
+        fans = [make_user(f"fan{index}") for index in range(4)]
+        for fan in fans:
+            send_notification(self.alice, fan, "like", self.post)
+            process_batch(100)
+        send_notification(self.alice, fans[0], "like", self.post)
+        process_batch(100)
+        like = Notification.objects.get()
+        self.assertEqual(like.actor_count, 4)
+        self.assertEqual(like.recent_actors[0], fans[0].pk)
+        self.assertEqual(like.actors.count(), 4)
+
+    def test_notifications_keep_the_time_of_the_action(self):
+        send_notification(self.alice, self.bob, "follow")
+        acted_at = timezone.now() - timedelta(minutes=5)
+        NotificationEvent.objects.update(created_at=acted_at)
+        process_batch(100)
+        self.assertEqual(Notification.objects.get().created_at, acted_at)
+
+    def test_old_notifications_are_not_joined(self):
+        send_notification(self.alice, self.bob, "like", self.post)
+        process_batch(100)
+        Notification.objects.update(
+            created_at=timezone.now() - settings.NOTIFICATION_COALESCE_WINDOW * 2
+        )
+        send_notification(self.alice, self.bob, "like", self.post)
+        process_batch(100)
+        self.assertEqual(Notification.objects.count(), 2)
+
+
+class NotificationListTests(NotificationTestMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        for index in range(3):
+            self.notify(index)
+        process_batch(100)
+        self.client.force_authenticate(self.alice)
+
+    def notify(self, index):
+        # One notification each, since likes of different posts do not coalesce.
+        post = Post.objects.create(author=self.alice, content=str(index))
+        send_notification(self.alice, make_user(f"fan{index}"), "like", post)
+
+    def test_pages_with_a_compact_sender(self):
+        first = self.client.get("/api/notifications/", {"page_size": 2}).data
+        second = self.client.get(first["next"]).data
+        results = first["results"] + second["results"]
+        self.assertEqual(
+            [notification["sender"]["username"] for notification in results],
+            ["fan2", "fan1", "fan0"],
+        )
+        self.assertEqual(
+            set(results[0]["sender"]),
+            {"id", "username", "profile_pic", "profile_pic_variants"},
+        )
+
+    def test_query_count_does_not_grow_with_the_page(self):
+        with CaptureQueriesContext(connection) as before:
+            self.client.get("/api/notifications/")
+        for index in range(3, 6):
+            self.notify(index)
+        process_batch(100)
+        with CaptureQueriesContext(connection) as after:
+            response = self.client.get("/api/notifications/")
+        self.assertEqual(len(response.data["results"]), 6)
+        self.assertEqual(len(before), len(after))
+
+    def test_unread_filter_and_marking_read(self):
+        notification = Notification.objects.order_by("id").first()
+        response = self.client.patch(f"/api/notifications/{notification.pk}/")
+        self.assertTrue(response.data["is_read"])
+        unread = self.client.get("/api/notifications/", {"unread": "true"}).data
+        self.assertEqual(len(unread["results"]), 2)
+        self.client.post("/api/notifications/mark-all-as-read/")
+        unread = self.client.get("/api/notifications/", {"unread": "true"}).data
+        self.assertEqual(unread["results"], [])
+
+
+class UnreadCountsTests(NotificationTestMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.alice)
+
+    def counts(self):
+        return self.client.get("/api/notifications/unread-counts/").data
+
+    def test_counts_follow_notifications_and_chats(self):
+        send_notification(self.alice, self.bob, "like", self.post)
+        send_notification(self.alice, self.bob, "follow")
+        process_batch(100)
+        room = ChatRoom.get_or_create_chatroom(self.alice, self.bob)
+        message = Message.objects.create(chatroom=room, sender=self.bob, content="hi")
+        self.assertEqual(self.counts(), {"notifications": 2, "chats": 1})
+
+        notification = Notification.objects.filter(post=self.post).get()
+        self.client.patch(f"/api/notifications/{notification.pk}/")
+        self.client.post(f"/api/room/{room.pk}/read/", {"message_id": message.pk})
+        self.assertEqual(self.counts(), {"notifications": 1, "chats": 0})
+
+    def test_cascaded_deletes_uncount(self):
+        send_notification(self.alice, self.bob, "like", self.post)
+        process_batch(100)
+        room = ChatRoom.get_or_create_chatroom(self.alice, self.bob)
+        Message.objects.create(chatroom=room, sender=self.bob, content="hi")
+        self.post.delete()
+        room.delete()
+        self.assertEqual(self.counts(), {"notifications": 0, "chats": 0})
+
+    def test_deleting_a_user_with_unread_items(self):
+        send_notification(self.alice, self.bob, "follow")
+        process_batch(100)
+        self.alice.delete()
+        self.assertFalse(UnreadCounts.objects.filter(pk=self.alice.pk).exists())
+
+    def test_changed_counts_are_pushed_by_the_worker(self):
+        receive = self.listen(self.alice)
+        with self.captureOnCommitCallbacks(execute=True):
+            adjust_unread({self.alice.pk: (2, 1)})
+        self.assertEqual(push_counts(100), 1)
+        self.assertEqual(receive()["counts"], {"notifications": 2, "chats": 1})
+        self.assertEqual(push_counts(100), 0)
+
+    def test_reconcile_repairs_counts(self):
+        send_notification(self.alice, self.bob, "follow")
+        process_batch(100)
+        UnreadCounts.objects.update(notifications=5, chats=3)
+        call_command("reconcile_unread", stdout=io.StringIO())
+        self.assertEqual(self.counts(), {"notifications": 1, "chats": 0})
@@ -10,6 +10,11 @@ urlpatterns = [
         views.NotificationDetailView.as_view(),
         name="notification-detail",
     ),
+    path(
+        "notifications/unread-counts/",
+        views.UnreadCountsView.as_view(),
+        name="unread-counts",
+    ),
     path(
         "notifications/mark-all-as-read/",
         views.MarkAllAsReadView.as_view(),
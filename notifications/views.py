@@ -1,8 +1,11 @@
-from rest_framework import status
+from django.db import transaction
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.generics import get_object_or_404
+from account.models import User
+from social.pagination import KeysetPagination
+from .counters import adjust_unread, get_counts
 from .models import Notification
 from .serializers import NotificationSerializer
 
@@ -11,11 +14,18 @@ class NotificationListView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
-        notifications = Notification.objects.filter(recipient=request.user).order_by(
-            "-created_at"
+        notifications = Notification.objects.filter(
+            recipient=request.user
+        ).select_related("sender")
+        if request.query_params.get("unread") == "true":
+            notifications = notifications.filter(is_read=False)
+        paginator = KeysetPagination()
+        page = paginator.paginate_queryset(notifications, request, view=self)
+        actors = User.objects.in_bulk(
+            {pk for notification in page for pk in notification.recent_actors}
         )
-        serializer = NotificationSerializer(notifications, many=True)
-        return Response(serializer.data)
+        serializer = NotificationSerializer(page, many=True, context={"actors": actors})
+        return paginator.get_paginated_response(serializer.data)
 
 
 class NotificationDetailView(APIView):
@@ -23,12 +33,12 @@ class NotificationDetailView(APIView):
 
     def patch(self, request, pk):
         notification = get_object_or_404(Notification, pk=pk, recipient=request.user)
-        data = {"is_read": True}
-        serializer = NotificationSerializer(notification, data=data, partial=True)
-        if serializer.is_valid():
-            serializer.save()
-            return Response(serializer.data)
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        with transaction.atomic():
+            # Only the request that flips the flag lowers the badge count.
+            if Notification.objects.filter(pk=pk, is_read=False).update(is_read=True):
+                adjust_unread({request.user.id: (-1, 0)})
+        notification.is_read = True
+        return Response(NotificationSerializer(notification).data)
 
 
 class MarkAllAsReadView(APIView):
@@ -38,5 +48,14 @@ class MarkAllAsReadView(APIView):
         notifications = Notification.objects.filter(
             recipient=request.user, is_read=False
         )
-        notifications.update(is_read=True)
+        with transaction.atomic():
+            read = notifications.update(is_read=True)
+            adjust_unread({request.user.id: (-read, 0)})
         return Response({"status": "all notifications marked as read"})
+
+
+class UnreadCountsView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        return Response(get_counts(request.user.id))
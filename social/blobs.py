@@ -0,0 +1,132 @@
+import os
+import shutil
+from collections import Counter, defaultdict
+from itertools import islice
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Count, F
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from account.models import User
+from api.storage import blob_storage, is_blob
+from .images import variant_name
+from .models import Blob, Media
+
+# model: file fields stored in blob storage
+FIELDS = {Media: ("file",), User: ("profile_pic", "cover_pic")}
+
+
+def row_blobs(instance):
+    names = (getattr(instance, field).name for field in FIELDS[type(instance)])
+    return [name for name in names if is_blob(name)]
+
+
+def adjust_refs(deltas):
+    """Apply ``{name: delta}`` to the reference counts of blobs."""
+    by_delta = defaultdict(list)
+    for name, delta in deltas.items():
+        if delta:
+            by_delta[delta].append(name)
+    if not by_delta:
+        return
+    Blob.objects.bulk_create(
+        [Blob(name=name) for names in by_delta.values() for name in names],
+        ignore_conflicts=True,
+    )
+    now = timezone.now()
+    for delta, names in by_delta.items():
+        Blob.objects.filter(name__in=names).update(
+            refs=Greatest(F("refs") + delta, 0), updated_at=now
+        )
+
+
+def touch(names):
+    """Restart the collection grace period of just stored blobs, which may
+    already exist unreferenced while the rows using them are not committed.
+    """
+    names = [name for name in names if is_blob(name)]
+    Blob.objects.bulk_create([Blob(name=name) for name in names], ignore_conflicts=True)
+    Blob.objects.filter(name__in=names).update(updated_at=timezone.now())
+
+
+def retain(names):
+    adjust_refs(Counter(name for name in names if is_blob(name)))
+
+
+def release(names):
+    refs = Counter(name for name in names if is_blob(name))
+    adjust_refs({name: -count for name, count in refs.items()})
+
+
+def recount_refs():
+    """Recompute every reference count from the rows using blobs."""
+    counts = Counter()
+    for model, fields in FIELDS.items():
+        for field in fields:
+            rows = (
+                model.objects.filter(**{f"{field}__startswith": "blobs/"})
+                .values(field)
+                .annotate(total=Count("pk"))
+                .values_list(field, "total")
+            )
+            counts.update(dict(rows))
+    with transaction.atomic():
+        Blob.objects.update(refs=0)
+        Blob.objects.bulk_create(
+            [Blob(name=name, refs=refs) for name, refs in counts.items()],
+            batch_size=1000,
+            update_conflicts=True,
+            unique_fields=["name"],
+            update_fields=["refs"],
+        )
+
+
+def delete_variants(name):
+    directory = os.path.dirname(variant_name(name, 0))
+    shutil.rmtree(default_storage.path(directory), ignore_errors=True)
+
+
+def collect(batch_size, grace=None):
+    """Delete blobs that no row references, with their image variants, and
+    return how many were deleted.
+
+    Blobs stored, reused or released within ``grace`` are kept, since the
+    rows referencing them may not be committed yet. Files without a ``Blob``
+    row, such as leftover temporary files, are judged by their age instead.
+    """
+    storage = blob_storage()
+    grace = settings.BLOB_COLLECT_GRACE if grace is None else grace
+    cutoff = timezone.now() - grace
+    names = storage.walk()
+    removed = 0
+    while batch := list(islice(names, batch_size)):
+        with transaction.atomic():
+            rows = {
+                name: (refs, updated_at)
+                for name, refs, updated_at in Blob.objects.select_for_update()
+                .filter(name__in=batch)
+                .values_list("name", "refs", "updated_at")
+            }
+            garbage = []
+            for name in batch:
+                if name in rows:
+                    refs, updated_at = rows[name]
+                    if refs or updated_at >= cutoff:
+                        continue
+                else:
+                    try:
+                        if os.path.getmtime(storage.path(name)) >= cutoff.timestamp():
+                            continue
+                    except FileNotFoundError:
+                        pass
+                garbage.append(name)
+            for name in garbage:
+                storage.remove(name)
+                if is_blob(name):
+                    delete_variants(name)
+            Blob.objects.filter(name__in=garbage).delete()
+        removed += sum(is_blob(name) for name in garbage)
+    return removed
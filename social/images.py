@@ -0,0 +1,135 @@
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from PIL import Image
+
+from account.authentication import invalidate_user
+from account.models import User
+from .models import Media
+from .rendering import render_variants
+
+logger = logging.getLogger(__name__)
+
+# kind: (model, image field, manifest field)
+SOURCES = {
+    "media": (Media, "file", "variants"),
+    "avatar": (User, "profile_pic", "profile_pic_variants"),
+}
+
+
+def variant_name(source, size):
+    root, _ = os.path.splitext(source)
+    return f"variants/{root}/{size}.webp"
+
+
+@lru_cache(maxsize=None)
+def get_process_pool():
+    # Forking a threaded server can copy locks held by other threads, so
+    # workers start from a fresh interpreter instead.
+    return ProcessPoolExecutor(
+        max_workers=settings.IMAGE_VARIANT_WORKERS,
+        mp_context=multiprocessing.get_context("spawn"),
+    )
+
+
+@lru_cache(maxsize=None)
+def get_thread_pool():
+    return ThreadPoolExecutor(
+        max_workers=settings.IMAGE_VARIANT_WORKERS, thread_name_prefix="image-variants"
+    )
+
+
+def render(path, sizes):
+    args = (path, sizes, settings.IMAGE_VARIANT_QUALITY)
+    if settings.IMAGE_VARIANT_WORKERS == 0:
+        return render_variants(*args)
+    return get_process_pool().submit(render_variants, *args).result()
+
+
+def is_stale(file, manifest):
+    return bool(file) and manifest.get("source") != file.name
+
+
+def build_variants(kind, pk):
+    """Render and store the missing variants of one image, then record them
+    in its manifest unless the image was replaced in the meantime.
+    """
+    model, field, manifest_field = SOURCES[kind]
+    instance = model.objects.filter(pk=pk).only(field, manifest_field).first()
+    if instance is None:
+        return
+    source = getattr(instance, field)
+    if not is_stale(source, getattr(instance, manifest_field)):
+        return
+    # Variants are derived files, kept out of blob storage.
+    storage = default_storage
+    sizes = settings.IMAGE_VARIANT_SIZES[kind]
+    names = {str(size): variant_name(source.name, size) for size in sizes}
+    # Shared sources, such as the default avatars and deduplicated uploads,
+    # are only rendered once.
+    missing = [size for size in sizes if not storage.exists(names[str(size)])]
+    if missing:
+        # Workers read the file themselves rather than receive its bytes.
+        path = source.path
+        if not os.path.exists(path):
+            # Unlike an undecodable image, left stale to be retried.
+            raise FileNotFoundError(path)
+        try:
+            rendered = render(path, missing)
+        except (OSError, Image.DecompressionBombError):
+            # Undecodable images are recorded without variants, not retried.
+            logger.warning("Could not render variants of %s", source.name)
+            rendered, names = {}, {}
+        for size, content in rendered.items():
+            names[str(size)] = storage.save(names[str(size)], ContentFile(content))
+    model.objects.filter(pk=pk, **{field: source.name}).update(
+        **{manifest_field: {"source": source.name, "files": names}}
+    )
+    if model is User:
+        invalidate_user(pk)
+
+
+def _build(kind, pk):
+    try:
+        build_variants(kind, pk)
+    except Exception:
+        logger.exception("Building %s variants of %s failed", kind, pk)
+
+
+def _build_in_thread(kind, pk):
+    close_old_connections()
+    try:
+        _build(kind, pk)
+    finally:
+        close_old_connections()
+
+
+def enqueue(kind, pks):
+    """Build variants for ``pks`` off the request path once the transaction
+    commits.
+    """
+    if not pks:
+        return
+    if settings.IMAGE_VARIANT_WORKERS == 0:
+        transaction.on_commit(lambda: [_build(kind, pk) for pk in pks])
+        return
+    transaction.on_commit(
+        lambda: [get_thread_pool().submit(_build_in_thread, kind, pk) for pk in pks]
+    )
+
+
+def variant_urls(file, manifest, request=None):
+    """``{size: url}`` of an image's variants; empty until they are built."""
+    if not file or is_stale(file, manifest):
+        return {}
+    urls = {size: default_storage.url(name) for size, name in manifest["files"].items()}
+    if request is not None:
+        urls = {size: request.build_absolute_uri(url) for size, url in urls.items()}
+    return urls
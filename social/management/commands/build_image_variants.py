@@ -0,0 +1,39 @@
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from social import images
+
+
+class Command(BaseCommand):
+    help = "Build the resized WebP variants of post images and avatars that lack them."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        workers = max(settings.IMAGE_VARIANT_WORKERS, 1)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for kind, (model, field, manifest_field) in images.SOURCES.items():
+                rows = model.objects.order_by("pk").only(field, manifest_field)
+                if model is images.Media:
+                    rows = rows.filter(type="image")
+                built = 0
+                last_pk = 0
+                while True:
+                    batch = list(rows.filter(pk__gt=last_pk)[: options["batch_size"]])
+                    if not batch:
+                        break
+                    last_pk = batch[-1].pk
+                    stale = [
+                        row.pk
+                        for row in batch
+                        if images.is_stale(
+                            getattr(row, field), getattr(row, manifest_field)
+                        )
+                    ]
+                    list(executor.map(partial(images.build_variants, kind), stale))
+                    built += len(stale)
+                self.stdout.write(f"{kind}: built variants for {built} images")
@@ -0,0 +1,32 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from social import blobs
+
+
+class Command(BaseCommand):
+    help = "Delete stored media files that no post or profile references."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument(
+            "--recount",
+            action="store_true",
+            help="Recompute reference counts from the rows before collecting.",
+        )
+        parser.add_argument(
+            "--grace-minutes",
+            type=int,
+            help="Keep files unreferenced for less than this (BLOB_COLLECT_GRACE).",
+        )
+
+    def handle(self, *args, **options):
+        if options["recount"]:
+            blobs.recount_refs()
+        grace = options["grace_minutes"]
+        removed = blobs.collect(
+            options["batch_size"],
+            None if grace is None else timedelta(minutes=grace),
+        )
+        self.stdout.write(f"Removed {removed} unreferenced files")
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from account.models import User
+from social.suggestions import compute_popular, compute_suggestions
+
+
+class Command(BaseCommand):
+    help = "Precompute friends-of-friends suggestions and the popular fallback."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        compute_popular()
+        computed = 0
+        last_pk = 0
+        while True:
+            ids = list(
+                User.objects.filter(pk__gt=last_pk, is_active=True, num_following__gt=0)
+                .order_by("pk")
+                .values_list("pk", flat=True)[: options["batch_size"]]
+            )
+            if not ids:
+                break
+            last_pk = ids[-1]
+            for user_id in ids:
+                compute_suggestions(user_id)
+            computed += len(ids)
+        self.stdout.write(f"Computed suggestions for {computed} users")
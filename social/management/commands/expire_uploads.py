@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from social.uploads import expire_sessions
+
+
+class Command(BaseCommand):
+    help = "Delete abandoned resumable uploads and their partial files."
+
+    def handle(self, *args, **options):
+        removed = expire_sessions()
+        self.stdout.write(f"Removed {removed} partial uploads")
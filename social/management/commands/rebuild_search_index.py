@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from social.search import get_backend
+
+
+class Command(BaseCommand):
+    help = "Index existing posts and users for search."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        backend = get_backend()
+        backend.reindex(options["batch_size"])
+        self.stdout.write(f"Search index rebuilt with {type(backend).__name__}")
@@ -0,0 +1,79 @@
+from django.core.management.base import BaseCommand
+
+from account.models import User
+from social.models import (
+    Post,
+    Comment,
+    Reply,
+    PostLike,
+    CommentLike,
+    ReplyLike,
+    Follower,
+    count_subquery,
+)
+
+COUNTERS = {
+    Post: {
+        "num_likes": (PostLike, "post"),
+        "num_comments": (Comment, "post"),
+    },
+    Comment: {
+        "num_likes": (CommentLike, "comment"),
+        "num_replies": (Reply, "comment"),
+    },
+    Reply: {
+        "num_likes": (ReplyLike, "reply"),
+    },
+    User: {
+        "num_posts": (Post, "author"),
+        "num_followers": (Follower, "followed"),
+        "num_following": (Follower, "user"),
+    },
+}
+
+
+class Command(BaseCommand):
+    help = "Recompute denormalized engagement counters and repair any drift."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        for model, counters in COUNTERS.items():
+            repaired = self.reconcile(model, counters, batch_size)
+            self.stdout.write(f"{model.__name__}: repaired {repaired} rows")
+
+    def reconcile(self, model, counters, batch_size):
+        annotations = {
+            f"actual_{field}": count_subquery(related.objects.all(), fk)
+            for field, (related, fk) in counters.items()
+        }
+        repaired = 0
+        last_pk = 0
+        while True:
+            rows = list(
+                model.objects.filter(pk__gt=last_pk)
+                .order_by("pk")
+                .annotate(**annotations)
+                .only("pk", *counters)[:batch_size]
+            )
+            if not rows:
+                return repaired
+            last_pk = rows[-1].pk
+
+            drifted = set()
+            for field in counters:
+                pks = [
+                    row.pk
+                    for row in rows
+                    if getattr(row, field) != getattr(row, f"actual_{field}")
+                ]
+                if pks:
+                    # Recount inside the UPDATE so likes that land between the
+                    # read above and this write are not overwritten.
+                    model.objects.filter(pk__in=pks).update(
+                        **{field: annotations[f"actual_{field}"]}
+                    )
+                    drifted.update(pks)
+            repaired += len(drifted)
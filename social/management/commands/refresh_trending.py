@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from social.trending import rebuild_pool
+
+
+class Command(BaseCommand):
+    help = "Rescore recent posts and rebuild the explore trending pool."
+
+    def handle(self, *args, **options):
+        size = rebuild_pool()
+        self.stdout.write(f"Trending pool rebuilt with {size} posts")
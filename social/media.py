@@ -0,0 +1,73 @@
+import mimetypes
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache
+
+from django.conf import settings
+from rest_framework.exceptions import ValidationError
+
+from . import blobs
+from .models import Media
+
+
+def media_type(name):
+    """Return "image" or "video" for a file name, or None if unsupported."""
+    mime_type, _ = mimetypes.guess_type(name)
+    if mime_type is None:
+        return None
+    kind = mime_type.split("/")[0]
+    return kind if kind in ("image", "video") else None
+
+
+def check_uploads(files, existing=0):
+    """Validate a batch of uploads up front and return their media types."""
+    if existing + len(files) > Media.MAX_PER_POST:
+        raise ValidationError(
+            {"media": f"A post cannot have more than {Media.MAX_PER_POST} media files."}
+        )
+    types = [media_type(file.name) for file in files]
+    unsupported = [file.name for file, kind in zip(files, types) if kind is None]
+    if unsupported:
+        raise ValidationError(
+            {"media": [f"Unsupported file type: {name}" for name in unsupported]}
+        )
+    return types
+
+
+@lru_cache(maxsize=None)
+def get_executor():
+    return ThreadPoolExecutor(
+        max_workers=settings.MEDIA_UPLOAD_WORKERS, thread_name_prefix="media-upload"
+    )
+
+
+@contextmanager
+def stored_uploads(files):
+    """Write ``files`` to storage concurrently and yield their stored names.
+
+    If the block raises, for instance because the transaction creating their
+    rows failed, the files are deleted again. Blob storage may share them with
+    other rows, so it leaves them for ``collect_blobs`` instead.
+    """
+    field = Media._meta.get_field("file")
+    futures = [
+        get_executor().submit(
+            field.storage.save, field.generate_filename(None, file.name), file
+        )
+        for file in files
+    ]
+    names, error = [], None
+    for future in futures:
+        try:
+            names.append(future.result())
+        except Exception as exc:
+            error = error or exc
+    try:
+        if error is not None:
+            raise error
+        blobs.touch(names)
+        yield names
+    except BaseException:
+        for name in names:
+            field.storage.delete(name)
+        raise
@@ -0,0 +1,57 @@
+from django.db import migrations
+
+# The search backends' columns, indexes and tables, created here so they exist
+# before the first request rather than being built inside one.
+INSTALL = {
+    "postgresql": [
+        "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+        "ALTER TABLE social_post ADD COLUMN IF NOT EXISTS search_vector tsvector "
+        "GENERATED ALWAYS AS (to_tsvector('simple', coalesce(content, ''))) STORED",
+        "CREATE INDEX IF NOT EXISTS social_post_search_vector_gin "
+        "ON social_post USING gin (search_vector)",
+        "CREATE INDEX IF NOT EXISTS account_user_username_trgm "
+        "ON account_user USING gin (username gin_trgm_ops)",
+        "CREATE INDEX IF NOT EXISTS account_user_first_name_trgm "
+        "ON account_user USING gin (first_name gin_trgm_ops)",
+    ],
+    "sqlite": [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS social_post_fts USING fts5(content, "
+        "tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+        "CREATE VIRTUAL TABLE IF NOT EXISTS account_user_fts "
+        "USING fts5(username, first_name, "
+        "tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+    ],
+}
+
+UNINSTALL = {
+    "postgresql": [
+        "DROP INDEX IF EXISTS account_user_first_name_trgm",
+        "DROP INDEX IF EXISTS account_user_username_trgm",
+        "DROP INDEX IF EXISTS social_post_search_vector_gin",
+        "ALTER TABLE social_post DROP COLUMN IF EXISTS search_vector",
+    ],
+    "sqlite": [
+        "DROP TABLE IF EXISTS account_user_fts",
+        "DROP TABLE IF EXISTS social_post_fts",
+    ],
+}
+
+
+def run(statements):
+    def operation(apps, schema_editor):
+        for statement in statements.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(statement)
+
+    return operation
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("account", "0005_user_bio_user_cover_pic_user_date_of_birth_and_more"),
+        ("social", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.RunPython(run(INSTALL), run(UNINSTALL)),
+    ]
@@ -0,0 +1,53 @@
+from django.db import migrations
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def row_count(model, field):
+    return Coalesce(
+        Subquery(
+            model.objects.filter(**{field: OuterRef("pk")})
+            .order_by()
+            .values(field)
+            .annotate(total=Count("pk"))
+            .values("total")
+        ),
+        0,
+    )
+
+
+def count_rows(apps, schema_editor):
+    User = apps.get_model("account", "User")
+    Post = apps.get_model("social", "Post")
+    Comment = apps.get_model("social", "Comment")
+    Reply = apps.get_model("social", "Reply")
+    Follower = apps.get_model("social", "Follower")
+    # One UPDATE per table, each row counted by a correlated subquery.
+    User.objects.update(
+        num_posts=row_count(Post, "author"),
+        num_followers=row_count(Follower, "followed"),
+        num_following=row_count(Follower, "user"),
+    )
+    Post.objects.update(
+        num_likes=row_count(apps.get_model("social", "PostLike"), "post"),
+        num_comments=row_count(Comment, "post"),
+    )
+    Comment.objects.update(
+        num_likes=row_count(apps.get_model("social", "CommentLike"), "comment"),
+        num_replies=row_count(Reply, "comment"),
+    )
+    Reply.objects.update(
+        num_likes=row_count(apps.get_model("social", "ReplyLike"), "reply")
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("account", "0006_user_counters"),
+        ("social", "0003_counters"),
+    ]
+
+    operations = [
+        migrations.RunPython(count_rows, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 5.0.6 on 2026-10-18 19:15
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("social", "0004_backfill_counters"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="comment",
+            index=models.Index(
+                fields=["post", "-created_at", "-id"],
+                name="social_comm_post_id_497c86_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="follower",
+            index=models.Index(
+                fields=["user", "-created_at", "-id"],
+                name="social_foll_user_id_07ea57_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="follower",
+            index=models.Index(
+                fields=["followed", "-created_at", "-id"],
+                name="social_foll_followe_3bdb8f_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="post",
+            index=models.Index(
+                fields=["-created_at", "-id"], name="social_post_created_e8d331_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="post",
+            index=models.Index(
+                fields=["author", "-created_at", "-id"],
+                name="social_post_author__3d9dc2_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="reply",
+            index=models.Index(
+                fields=["comment", "-created_at", "-id"],
+                name="social_repl_comment_c8a750_idx",
+            ),
+        ),
+    ]
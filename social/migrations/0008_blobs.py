@@ -0,0 +1,36 @@
+# Generated by Django 5.0.6 on 2026-10-18 19:15
+
+import api.storage
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("social", "0007_uploadsession"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Blob",
+            fields=[
+                (
+                    "name",
+                    models.CharField(max_length=100, primary_key=True, serialize=False),
+                ),
+                ("refs", models.PositiveIntegerField(default=0)),
+                (
+                    "updated_at",
+                    models.DateTimeField(default=django.utils.timezone.now),
+                ),
+            ],
+        ),
+        migrations.AlterField(
+            model_name="media",
+            name="file",
+            field=models.FileField(
+                storage=api.storage.blob_storage, upload_to="posts/"
+            ),
+        ),
+    ]
@@ -0,0 +1,39 @@
+from django.db import migrations
+
+# The SQLite post table also holds the author's username. PostgreSQL matches
+# authors through the username trigram index of 0002 instead.
+TOKENIZE = "tokenize='unicode61 remove_diacritics 2', prefix='2 3'"
+
+FORWARDS = [
+    "DROP TABLE IF EXISTS social_post_fts",
+    f"CREATE VIRTUAL TABLE social_post_fts USING fts5(content, author, {TOKENIZE})",
+    "INSERT INTO social_post_fts (rowid, content, author) "
+    "SELECT social_post.id, social_post.content, account_user.username "
+    "FROM social_post JOIN account_user ON account_user.id = social_post.author_id",
+]
+
+BACKWARDS = [
+    "DROP TABLE IF EXISTS social_post_fts",
+    f"CREATE VIRTUAL TABLE social_post_fts USING fts5(content, {TOKENIZE})",
+    "INSERT INTO social_post_fts (rowid, content) SELECT id, content FROM social_post",
+]
+
+
+def run(statements):
+    def operation(apps, schema_editor):
+        if schema_editor.connection.vendor == "sqlite":
+            for statement in statements:
+                schema_editor.execute(statement)
+
+    return operation
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("social", "0008_blobs"),
+    ]
+
+    operations = [
+        migrations.RunPython(run(FORWARDS), run(BACKWARDS)),
+    ]
@@ -1,13 +1,72 @@
 from django.db import models
+from django.db.models import Count, Exists, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
 from account.models import User
+from api.storage import blob_storage
 from django.core.exceptions import ValidationError
+from django.utils import timezone
 import mimetypes
+import uuid
+
+
+def count_subquery(queryset, field):
+    # Correlated COUNT(*) so several counts can be annotated without
+    # multiplying rows through joins.
+    return Coalesce(
+        Subquery(
+            queryset.filter(**{field: OuterRef("pk")})
+            .order_by()
+            .values(field)
+            .annotate(total=Count("pk"))
+            .values("total")
+        ),
+        0,
+    )
+
+
+def liked_by(like_queryset, field, user):
+    if user is None or not user.is_authenticated:
+        return Value(False)
+    return Exists(like_queryset.filter(**{field: OuterRef("pk"), "user": user}))
+
+
+class PostQuerySet(models.QuerySet):
+    def with_engagement(self, user=None):
+        return (
+            self.select_related("author")
+            .prefetch_related("media")
+            .annotate(is_liked=liked_by(PostLike.objects.all(), "post", user))
+        )
+
+
+class CommentQuerySet(models.QuerySet):
+    def with_engagement(self, user=None):
+        return self.select_related("author").annotate(
+            is_liked=liked_by(CommentLike.objects.all(), "comment", user)
+        )
+
+
+class ReplyQuerySet(models.QuerySet):
+    def with_engagement(self, user=None):
+        return self.select_related("author").annotate(
+            is_liked=liked_by(ReplyLike.objects.all(), "reply", user)
+        )
 
 
 class Post(models.Model):
     author = models.ForeignKey(User, on_delete=models.CASCADE)
     content = models.TextField(max_length=512, default="")
     created_at = models.DateTimeField(auto_now_add=True)
+    num_likes = models.IntegerField(default=0, editable=False)
+    num_comments = models.IntegerField(default=0, editable=False)
+
+    objects = PostQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["-created_at", "-id"]),
+            models.Index(fields=["author", "-created_at", "-id"]),
+        ]
 
     def __str__(self):
         return self.content[:20]
@@ -32,14 +91,20 @@ class Post(models.Model):
 
 
 class Media(models.Model):
+    MAX_PER_POST = 10
+
     post = models.ForeignKey(Post, related_name="media", on_delete=models.CASCADE)
-    file = models.FileField(upload_to="posts/")
+    file = models.FileField(upload_to="posts/", storage=blob_storage)
     type = models.CharField(max_length=10, editable=False)
+    # Resized WebP copies of images, see social.images
+    variants = models.JSONField(default=dict, blank=True, editable=False)
 
     def save(self, *args, **kwargs):
         # Check the media count constraint
-        if self.post.pk and self.post.media_count() >= 10:
-            raise ValidationError("A post cannot have more than 10 media files.")
+        if self.post.pk and self.post.media_count() >= self.MAX_PER_POST:
+            raise ValidationError(
+                f"A post cannot have more than {self.MAX_PER_POST} media files."
+            )
 
         # Determine the type based on the MIME type of the file
         mime_type, _ = mimetypes.guess_type(self.file.name)
@@ -65,6 +130,13 @@ class Comment(models.Model):
     author = models.ForeignKey(User, on_delete=models.CASCADE)
     content = models.TextField(max_length=512)
     created_at = models.DateTimeField(auto_now_add=True)
+    num_likes = models.IntegerField(default=0, editable=False)
+    num_replies = models.IntegerField(default=0, editable=False)
+
+    objects = CommentQuerySet.as_manager()
+
+    class Meta:
+        indexes = [models.Index(fields=["post", "-created_at", "-id"])]
 
     def reply_count(self):
         return self.replies.count()
@@ -88,6 +160,12 @@ class Reply(models.Model):
     author = models.ForeignKey(User, on_delete=models.CASCADE)
     content = models.TextField(max_length=512)
     created_at = models.DateTimeField(auto_now_add=True)
+    num_likes = models.IntegerField(default=0, editable=False)
+
+    objects = ReplyQuerySet.as_manager()
+
+    class Meta:
+        indexes = [models.Index(fields=["comment", "-created_at", "-id"])]
 
     def like_count(self):
         return self.likes.count()
@@ -137,3 +215,33 @@ class Follower(models.Model):
 
     class Meta:
         unique_together = ("user", "followed")
+        indexes = [
+            models.Index(fields=["user", "-created_at", "-id"]),
+            models.Index(fields=["followed", "-created_at", "-id"]),
+        ]
+
+
+class UploadSession(models.Model):
+    """A resumable upload: chunks are appended to a file on local disk, see
+    ``social.uploads``, until it is completed into a post's ``Media``.
+    """
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name="+")
+    filename = models.CharField(max_length=255)
+    size = models.PositiveBigIntegerField()
+    chunk_size = models.PositiveIntegerField()
+    # Optional SHA-256 of the whole file, checked on completion
+    checksum = models.CharField(max_length=64, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+
+class Blob(models.Model):
+    """Number of rows referencing a file in blob storage, see ``social.blobs``."""
+
+    name = models.CharField(max_length=100, primary_key=True)
+    refs = models.PositiveIntegerField(default=0)
+    # When refs last changed or the file was stored again; unreferenced blobs
+    # are kept for BLOB_COLLECT_GRACE after it.
+    updated_at = models.DateTimeField(default=timezone.now)
@@ -0,0 +1,212 @@
+import hashlib
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as BinasciiError
+from bisect import bisect_right
+from datetime import datetime
+
+from django.core.cache import cache
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from .timeline import read_timeline
+
+
+class OpaqueCursorMixin:
+    page_size = 10
+    page_size_query_param = "page_size"
+    max_page_size = 100
+    cursor_query_param = "cursor"
+    invalid_cursor_message = "Invalid cursor"
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(size, 1), self.max_page_size)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            return urlsafe_b64decode(encoded.encode()).decode().split("|")
+        except (BinasciiError, UnicodeDecodeError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, *parts):
+        encoded = urlsafe_b64encode("|".join(map(str, parts)).encode()).decode()
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, encoded)
+
+
+class KeysetPagination(OpaqueCursorMixin, BasePagination):
+    """Newest-first pagination keyed on ``(created_at, id)``.
+
+    Each page is a single indexed range scan, so page N costs the same as
+    page 1. The total is only computed when ``?count=true`` is passed, and is
+    then served from the cache for ``count_cache_timeout`` seconds.
+    """
+
+    ordering_field = "created_at"
+    count_query_param = "count"
+    count_cache_timeout = 300
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.count = self.get_count(queryset)
+        page_size = self.get_page_size(request)
+        field = self.ordering_field
+
+        cursor = self.decode_cursor(request)
+        reverse = False
+        if cursor is not None:
+            try:
+                direction, value, pk = cursor
+                value, pk = datetime.fromisoformat(value), int(pk)
+            except ValueError:
+                raise NotFound(self.invalid_cursor_message)
+            reverse = direction == "p"
+            lookup = "gt" if reverse else "lt"
+            queryset = queryset.filter(
+                Q(**{f"{field}__{lookup}": value})
+                | Q(**{field: value, f"pk__{lookup}": pk})
+            )
+
+        if reverse:
+            queryset = queryset.order_by(field, "pk")
+        else:
+            queryset = queryset.order_by(f"-{field}", "-pk")
+
+        page = list(queryset[: page_size + 1])
+        has_more = len(page) > page_size
+        page = page[:page_size]
+        if reverse:
+            page.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, cursor is not None
+        self.page = page
+        return page
+
+    def get_count(self, queryset):
+        if self.request.query_params.get(self.count_query_param) != "true":
+            return None
+        sql, params = queryset.query.sql_with_params()
+        digest = hashlib.md5(f"{sql}{params}".encode()).hexdigest()
+        return cache.get_or_set(
+            f"keyset-count:{digest}", queryset.count, self.count_cache_timeout
+        )
+
+    def position(self, item):
+        return getattr(item, self.ordering_field).isoformat(), item.pk
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor("n", *self.position(self.page[-1]))
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor("p", *self.position(self.page[0]))
+
+    def get_paginated_response(self, data):
+        response = {
+            "next": self.get_next_link(),
+            "previous": self.get_previous_link(),
+            "results": data,
+        }
+        if self.count is not None:
+            response["count"] = self.count
+        return Response(response)
+
+
+class TimelinePagination(OpaqueCursorMixin, BasePagination):
+    def paginate_timeline(self, request, user):
+        self.request = request
+        cursor = self.decode_cursor(request)
+        if cursor is not None:
+            try:
+                score, post_id = cursor
+                cursor = int(score), int(post_id)
+            except ValueError:
+                raise NotFound(self.invalid_cursor_message)
+        posts, self.next_cursor = read_timeline(
+            user, cursor, self.get_page_size(request)
+        )
+        return posts
+
+    def get_next_link(self):
+        if self.next_cursor is None:
+            return None
+        return self.encode_cursor(*self.next_cursor)
+
+    def get_paginated_response(self, data):
+        return Response({"next": self.get_next_link(), "results": data})
+
+
+class RankedPagination(OpaqueCursorMixin, BasePagination):
+    """Pages over ranked ``(score, id)`` hits, such as search results or the
+    trending pool. ``kind`` is carried into the next link as ``?type=``.
+    """
+
+    def paginate_hits(self, request, search, page_size, kind=None):
+        self.request = request
+        self.page_size = page_size
+        self.kind = kind
+        cursor = self.decode_cursor(request)
+        if cursor is not None:
+            try:
+                score, pk = cursor
+                cursor = float(score), int(pk)
+            except ValueError:
+                raise NotFound(self.invalid_cursor_message)
+        page_size = self.get_page_size(request)
+        hits = search(after=cursor, limit=page_size + 1)
+        self.next_position = hits[page_size - 1] if len(hits) > page_size else None
+        return [pk for _, pk in hits[:page_size]]
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        score, pk = self.next_position
+        link = self.encode_cursor(repr(float(score)), pk)
+        if self.kind is None:
+            return link
+        return replace_query_param(link, "type", self.kind)
+
+
+class IdListPagination(OpaqueCursorMixin, BasePagination):
+    """Pages over an ascending list of ids that is already in memory, such
+    as an intersection of follow lists. The cursor is the last id returned.
+    """
+
+    def paginate_ids(self, request, ids):
+        self.request = request
+        self.count = len(ids)
+        cursor = self.decode_cursor(request)
+        start = 0
+        if cursor is not None:
+            try:
+                (after,) = cursor
+                start = bisect_right(ids, int(after))
+            except ValueError:
+                raise NotFound(self.invalid_cursor_message)
+        end = start + self.get_page_size(request)
+        self.page = list(ids[start:end])
+        self.has_next = end < len(ids)
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1])
+
+    def get_paginated_response(self, data):
+        return Response(
+            {"next": self.get_next_link(), "count": self.count, "results": data}
+        )
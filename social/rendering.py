@@ -0,0 +1,27 @@
+from io import BytesIO
+
+from PIL import Image, ImageOps
+
+# Runs in image worker processes started with "spawn", which import this
+# module without setting up Django, so it must not import any.
+
+
+def render_variants(path, sizes, quality):
+    """Return ``{size: webp_bytes}`` for the image at ``path``, each fitting
+    in a ``size`` x ``size`` box.
+    """
+    with Image.open(path) as image:
+        # JPEGs are decoded at the smallest 1/2, 1/4 or 1/8 scale that still
+        # covers the largest variant, which is most of the decoding cost saved.
+        image.draft("RGB", (max(sizes), max(sizes)))
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+        rendered = {}
+        # Largest first, so each thumbnail is scaled down from the previous one.
+        for size in sorted(sizes, reverse=True):
+            image.thumbnail((size, size), Image.LANCZOS)
+            output = BytesIO()
+            image.save(output, "WEBP", quality=quality, method=4)
+            rendered[size] = output.getvalue()
+        return rendered
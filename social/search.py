@@ -0,0 +1,270 @@
+import re
+from functools import lru_cache
+
+from django.contrib.postgres.search import (
+    SearchQuery,
+    SearchRank,
+    SearchVectorField,
+    TrigramWordSimilarity,
+)
+from django.db import connection
+from django.db.models import FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Cast, Greatest
+
+from account.models import User
+from .models import Post
+
+
+# Posts by at most this many authors whose username matches are included.
+AUTHORS = 100
+
+
+def search_terms(query):
+    return re.findall(r"\w+", query.lower())
+
+
+def page_by_score(queryset, after, limit):
+    """Return ``(score, pk)`` pairs of ``queryset`` annotated with ``score``,
+    best first, after the ``after`` pair.
+    """
+    # ts_rank and similarity return real; widen so cursor scores round-trip
+    # exactly through Python floats.
+    queryset = queryset.annotate(exact_score=Cast("score", FloatField()))
+    if after is not None:
+        score, pk = after
+        queryset = queryset.filter(
+            Q(exact_score__lt=score) | Q(exact_score=score, pk__lt=pk)
+        )
+    hits = queryset.order_by("-exact_score", "-pk")
+    return list(hits.values_list("exact_score", "pk")[:limit])
+
+
+class PostgresSearchBackend:
+    """Full-text search over a generated ``tsvector`` column plus trigram
+    matching on usernames and first names.
+
+    The column and indexes are created by a migration. PostgreSQL keeps the
+    generated column up to date on every insert and update, so the index hooks
+    are no-ops.
+    """
+
+    def reindex(self, batch_size):
+        pass
+
+    def index_post(self, post):
+        pass
+
+    def remove_post(self, post_id):
+        pass
+
+    def index_user(self, user):
+        pass
+
+    def remove_user(self, user_id):
+        pass
+
+    def search_posts(self, query, after=None, limit=20):
+        terms = search_terms(query)
+        if not terms:
+            return []
+        tsquery = SearchQuery(
+            " & ".join(f"{term}:*" for term in terms),
+            config="simple",
+            search_type="raw",
+        )
+        vector = RawSQL(
+            f"{connection.ops.quote_name(Post._meta.db_table)}.search_vector",
+            [],
+            output_field=SearchVectorField(),
+        )
+        # A generated column cannot hold the author's username, so posts by
+        # matching authors are added by id instead.
+        authors = User.objects.filter(username__icontains=query.strip())
+        posts = Post.objects.annotate(
+            vector=vector, score=SearchRank(vector, tsquery)
+        ).filter(
+            Q(vector=tsquery)
+            | Q(author_id__in=list(authors.values_list("pk", flat=True)[:AUTHORS]))
+        )
+        return page_by_score(posts, after, limit)
+
+    def search_users(self, query, after=None, limit=10):
+        query = query.strip()
+        if not query:
+            return []
+        users = User.objects.annotate(
+            score=Greatest(
+                TrigramWordSimilarity(query, "username"),
+                TrigramWordSimilarity(query, "first_name"),
+            )
+        ).filter(
+            Q(username__trigram_word_similar=query)
+            | Q(first_name__trigram_word_similar=query)
+        )
+        return page_by_score(users, after, limit)
+
+
+class SQLiteSearchBackend:
+    """FTS5 backend for local runs and tests.
+
+    Posts, with their author's username, and users are mirrored into FTS5
+    tables whose rowid is the primary key, and kept in step by the post and
+    user signal handlers. The tables are created by migrations, like the
+    PostgreSQL indexes.
+    """
+
+    post_table = "social_post_fts"
+    user_table = "account_user_fts"
+
+    def reindex(self, batch_size):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {self.post_table}")
+            cursor.execute(f"DELETE FROM {self.user_table}")
+        for model, table, fields, values in (
+            (
+                Post,
+                self.post_table,
+                ("content", "author"),
+                ("content", "author__username"),
+            ),
+            (
+                User,
+                self.user_table,
+                ("username", "first_name"),
+                ("username", "first_name"),
+            ),
+        ):
+            last_pk = 0
+            while True:
+                rows = list(
+                    model.objects.filter(pk__gt=last_pk)
+                    .order_by("pk")
+                    .values_list("pk", *values)[:batch_size]
+                )
+                if not rows:
+                    break
+                last_pk = rows[-1][0]
+                self._insert(table, fields, rows)
+
+    def index_post(self, post):
+        self.remove_post(post.pk)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {self.post_table} (rowid, content, author) "
+                f"SELECT %s, %s, username FROM {User._meta.db_table} WHERE id = %s",
+                [post.pk, post.content, post.author_id],
+            )
+
+    def remove_post(self, post_id):
+        self._delete(self.post_table, post_id)
+
+    def index_user(self, user):
+        self.remove_user(user.pk)
+        self._insert(
+            self.user_table,
+            ("username", "first_name"),
+            [(user.pk, user.username, user.first_name)],
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"UPDATE {self.post_table} SET author = %s WHERE rowid IN "
+                f"(SELECT id FROM {Post._meta.db_table} WHERE author_id = %s)",
+                [user.username, user.pk],
+            )
+
+    def remove_user(self, user_id):
+        self._delete(self.user_table, user_id)
+
+    def search_posts(self, query, after=None, limit=20):
+        return self._search(self.post_table, query, after, limit)
+
+    def search_users(self, query, after=None, limit=10):
+        return self._search(self.user_table, query, after, limit)
+
+    def _insert(self, table, fields, rows):
+        columns = ", ".join(("rowid",) + fields)
+        placeholders = ", ".join(["%s"] * (len(fields) + 1))
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f"INSERT INTO {table} ({columns}) VALUES ({placeholders})", rows
+            )
+
+    def _delete(self, table, pk):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {table} WHERE rowid = %s", [pk])
+
+    def _search(self, table, query, after, limit):
+        terms = search_terms(query)
+        if not terms:
+            return []
+        match = " ".join(f'"{term}"*' for term in terms)
+        # bm25() is lower-is-better; negate it so every backend ranks
+        # higher scores first.
+        sql = (
+            f"SELECT score, pk FROM (SELECT -bm25({table}) AS score, rowid AS pk "
+            f"FROM {table} WHERE {table} MATCH %s)"
+        )
+        params = [match]
+        if after is not None:
+            sql += " WHERE score < %s OR (score = %s AND pk < %s)"
+            params += [after[0], after[0], after[1]]
+        sql += " ORDER BY score DESC, pk DESC LIMIT %s"
+        params.append(limit)
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.fetchall()
+
+
+class DatabaseSearchBackend:
+    """Substring matching for databases without a search backend, as search
+    ran before the indexes. Every hit scores 0, so results run newest first.
+    """
+
+    def reindex(self, batch_size):
+        pass
+
+    def index_post(self, post):
+        pass
+
+    def remove_post(self, post_id):
+        pass
+
+    def index_user(self, user):
+        pass
+
+    def remove_user(self, user_id):
+        pass
+
+    def search_posts(self, query, after=None, limit=20):
+        query = query.strip()
+        if not query:
+            return []
+        posts = Post.objects.filter(
+            Q(content__icontains=query) | Q(author__username__icontains=query)
+        )
+        return page_by_score(posts.annotate(score=Value(0.0)), after, limit)
+
+    def search_users(self, query, after=None, limit=10):
+        query = query.strip()
+        if not query:
+            return []
+        users = User.objects.filter(
+            Q(username__icontains=query) | Q(first_name__icontains=query)
+        )
+        return page_by_score(users.annotate(score=Value(0.0)), after, limit)
+
+
+BACKENDS = {
+    "postgresql": PostgresSearchBackend,
+    "sqlite": SQLiteSearchBackend,
+}
+
+
+@lru_cache(maxsize=None)
+def _backend_for(vendor):
+    return BACKENDS.get(vendor, DatabaseSearchBackend)()
+
+
+def get_backend():
+    return _backend_for(connection.vendor)
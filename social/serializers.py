@@ -8,13 +8,17 @@ from .models import (
     PostLike,
     CommentLike,
     ReplyLike,
+    UploadSession,
 )
 from account.models import User
+from .images import variant_urls
+from .uploads import received
 
 
 class UserSerializer(serializers.ModelSerializer):
-    follower_count = serializers.SerializerMethodField()
-    following_count = serializers.SerializerMethodField()
+    follower_count = serializers.IntegerField(source="num_followers", read_only=True)
+    following_count = serializers.IntegerField(source="num_following", read_only=True)
+    profile_pic_variants = serializers.SerializerMethodField()
 
     class Meta:
         model = User
@@ -28,26 +32,54 @@ class UserSerializer(serializers.ModelSerializer):
             "following_count",
             "is_verified",
             "profile_pic",
+            "profile_pic_variants",
         ]
 
-    def get_follower_count(self, obj):
-        return obj.follower_count()
-
-    def get_following_count(self, obj):
-        return obj.following_count()
+    def get_profile_pic_variants(self, obj):
+        return variant_urls(
+            obj.profile_pic, obj.profile_pic_variants, self.context.get("request")
+        )
 
 
 class MediaSerializer(serializers.ModelSerializer):
+    variants = serializers.SerializerMethodField()
+
     class Meta:
         model = Media
-        fields = ["id", "post", "file", "type"]
+        fields = ["id", "post", "file", "type", "variants"]
+
+    def get_variants(self, obj):
+        return variant_urls(obj.file, obj.variants, self.context.get("request"))
+
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+    checksum = serializers.RegexField(
+        r"^[0-9a-fA-F]{64}$", required=False, write_only=True
+    )
+    received = serializers.SerializerMethodField()
+
+    class Meta:
+        model = UploadSession
+        fields = [
+            "id",
+            "filename",
+            "size",
+            "chunk_size",
+            "checksum",
+            "received",
+            "expires_at",
+        ]
+        read_only_fields = ["chunk_size", "expires_at"]
+
+    def get_received(self, obj):
+        return received(obj)
 
 
 class PostSerializer(serializers.ModelSerializer):
     author = UserSerializer(read_only=True)
     media = MediaSerializer(many=True, read_only=True)
-    like_count = serializers.SerializerMethodField()
-    comment_count = serializers.SerializerMethodField()
+    like_count = serializers.IntegerField(source="num_likes", read_only=True)
+    comment_count = serializers.IntegerField(source="num_comments", read_only=True)
     is_liked = serializers.SerializerMethodField()
 
     class Meta:
@@ -63,13 +95,9 @@ class PostSerializer(serializers.ModelSerializer):
             "is_liked",
         ]
 
-    def get_like_count(self, obj):
-        return obj.like_count()
-
-    def get_comment_count(self, obj):
-        return obj.comment_count()
-
     def get_is_liked(self, obj):
+        if hasattr(obj, "is_liked"):
+            return obj.is_liked
         request = self.context.get("request")
         if request:
             return obj.is_liked_by(request.user)
@@ -78,8 +106,8 @@ class PostSerializer(serializers.ModelSerializer):
 
 class CommentSerializer(serializers.ModelSerializer):
     author = UserSerializer(read_only=True)
-    like_count = serializers.SerializerMethodField()
-    reply_count = serializers.SerializerMethodField()
+    like_count = serializers.IntegerField(source="num_likes", read_only=True)
+    reply_count = serializers.IntegerField(source="num_replies", read_only=True)
     is_liked = serializers.SerializerMethodField()
 
     class Meta:
@@ -95,13 +123,9 @@ class CommentSerializer(serializers.ModelSerializer):
             "is_liked",
         ]
 
-    def get_like_count(self, obj):
-        return obj.like_count()
-
-    def get_reply_count(self, obj):
-        return obj.reply_count()
-
     def get_is_liked(self, obj):
+        if hasattr(obj, "is_liked"):
+            return obj.is_liked
         request = self.context.get("request")
         if request:
             return obj.is_liked_by(request.user)
@@ -110,7 +134,7 @@ class CommentSerializer(serializers.ModelSerializer):
 
 class ReplySerializer(serializers.ModelSerializer):
     author = UserSerializer(read_only=True)
-    like_count = serializers.SerializerMethodField()
+    like_count = serializers.IntegerField(source="num_likes", read_only=True)
     is_liked = serializers.SerializerMethodField()
 
     class Meta:
@@ -125,10 +149,9 @@ class ReplySerializer(serializers.ModelSerializer):
             "is_liked",
         ]
 
-    def get_like_count(self, obj):
-        return obj.like_count()
-
     def get_is_liked(self, obj):
+        if hasattr(obj, "is_liked"):
+            return obj.is_liked
         request = self.context.get("request")
         if request:
             return obj.is_liked_by(request.user)
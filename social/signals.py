@@ -0,0 +1,203 @@
+from collections import Counter
+
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from account.authentication import invalidate_user
+from account.models import User
+from .models import (
+    Post,
+    Comment,
+    Reply,
+    Media,
+    PostLike,
+    CommentLike,
+    ReplyLike,
+    Follower,
+)
+from . import blobs, follows, images, suggestions, timeline, trending
+from .search import get_backend as get_search_backend
+
+
+def adjust_counter(model, pk, field, delta):
+    model.objects.filter(pk=pk).update(**{field: F(field) + delta})
+    if model is User:
+        invalidate_user(pk)
+
+
+COUNTERS = [
+    # (sender, counted model, foreign key attname, counter column)
+    (PostLike, Post, "post_id", "num_likes"),
+    (CommentLike, Comment, "comment_id", "num_likes"),
+    (ReplyLike, Reply, "reply_id", "num_likes"),
+    (Comment, Post, "post_id", "num_comments"),
+    (Reply, Comment, "comment_id", "num_replies"),
+    (Post, User, "author_id", "num_posts"),
+    (Follower, User, "followed_id", "num_followers"),
+    (Follower, User, "user_id", "num_following"),
+]
+
+
+def remember_deleted(sender, instance, origin=None, **kwargs):
+    # pre_delete is sent for every row of a cascade before any is deleted, so
+    # the counters of rows going with it can be skipped instead of updated.
+    if origin is not None:
+        origin.__dict__.setdefault("_deleted_rows", set()).add((sender, instance.pk))
+
+
+def _make_receivers(sender, model, attname, field):
+    @receiver(post_save, sender=sender, weak=False)
+    def increment(instance, created, **kwargs):
+        if created:
+            adjust_counter(model, getattr(instance, attname), field, 1)
+
+    @receiver(post_delete, sender=sender, weak=False)
+    def decrement(instance, origin=None, **kwargs):
+        pk = getattr(instance, attname)
+        if (model, pk) not in getattr(origin, "_deleted_rows", ()):
+            adjust_counter(model, pk, field, -1)
+
+
+for counter in COUNTERS:
+    _make_receivers(*counter)
+for model in {model for _, model, _, _ in COUNTERS}:
+    pre_delete.connect(remember_deleted, sender=model, weak=False)
+
+
+# Connected ahead of the other follow receivers so their after-commit work
+# reads the updated follow lists.
+@receiver(post_save, sender=Follower)
+def refresh_follow_ids(instance, created, **kwargs):
+    if created:
+        follows.invalidate_follow(instance.user_id, instance.followed_id)
+
+
+@receiver(post_delete, sender=Follower)
+def discard_follow_ids(instance, **kwargs):
+    follows.invalidate_follow(instance.user_id, instance.followed_id)
+
+
+@receiver(post_save, sender=Post)
+def fan_out_post(instance, created, **kwargs):
+    if created:
+        timeline.enqueue(timeline.fan_out_post, instance.id, key=instance.author_id)
+
+
+@receiver(post_delete, sender=Post)
+def retract_post(instance, **kwargs):
+    timeline.enqueue(
+        timeline.retract_post,
+        instance.id,
+        instance.author_id,
+        timeline.fans_out(instance.author_id),
+        key=instance.author_id,
+    )
+
+
+@receiver(post_save, sender=Follower)
+def backfill_timeline(instance, created, **kwargs):
+    if created:
+        timeline.enqueue(
+            timeline.backfill_follow,
+            instance.user_id,
+            instance.followed_id,
+            key=instance.user_id,
+        )
+
+
+@receiver(post_delete, sender=Follower)
+def purge_timeline(instance, **kwargs):
+    timeline.enqueue(
+        timeline.purge_unfollow,
+        instance.user_id,
+        instance.followed_id,
+        key=instance.user_id,
+    )
+
+
+@receiver(post_save, sender=Post)
+def index_post(instance, **kwargs):
+    get_search_backend().index_post(instance)
+
+
+@receiver(post_delete, sender=Post)
+def unindex_post(instance, **kwargs):
+    get_search_backend().remove_post(instance.pk)
+
+
+@receiver(post_save, sender=User)
+def index_user(instance, **kwargs):
+    get_search_backend().index_user(instance)
+
+
+@receiver(post_delete, sender=User)
+def unindex_user(instance, **kwargs):
+    get_search_backend().remove_user(instance.pk)
+
+
+@receiver(post_save, sender=Post)
+def add_to_trending(instance, created, **kwargs):
+    if created:
+        trending.record_post(instance)
+
+
+@receiver(post_delete, sender=Post)
+def remove_from_trending(instance, **kwargs):
+    trending.discard_post(instance.pk)
+
+
+@receiver(post_save, sender=PostLike)
+def trend_like(instance, created, **kwargs):
+    if created:
+        trending.record_engagement(instance.post_id, "like")
+
+
+@receiver(post_save, sender=Comment)
+def trend_comment(instance, created, **kwargs):
+    if created:
+        trending.record_engagement(instance.post_id, "comment")
+
+
+@receiver(post_save, sender=Follower)
+def refresh_suggestions(instance, created, **kwargs):
+    if created:
+        suggestions.record_follow(instance.user_id, instance.followed_id)
+
+
+@receiver(post_save, sender=Media)
+def build_media_variants(instance, **kwargs):
+    if instance.type == "image" and images.is_stale(instance.file, instance.variants):
+        images.enqueue("media", [instance.pk])
+
+
+@receiver(post_save, sender=User)
+def build_avatar_variants(instance, **kwargs):
+    if images.is_stale(instance.profile_pic, instance.profile_pic_variants):
+        images.enqueue("avatar", [instance.pk])
+
+
+@receiver(pre_save, sender=Media)
+@receiver(pre_save, sender=User)
+def remember_blobs(sender, instance, update_fields=None, **kwargs):
+    fields = blobs.FIELDS[sender]
+    if instance._state.adding or not set(fields) & set(update_fields or fields):
+        return
+    stored = sender.objects.filter(pk=instance.pk).values_list(*fields).first()
+    instance._stored_blobs = [name for name in stored or () if blobs.is_blob(name)]
+
+
+@receiver(post_save, sender=Media)
+@receiver(post_save, sender=User)
+def count_blob_refs(instance, created, **kwargs):
+    if not created and not hasattr(instance, "_stored_blobs"):
+        return
+    refs = Counter(blobs.row_blobs(instance))
+    refs.subtract(instance.__dict__.pop("_stored_blobs", []))
+    blobs.adjust_refs(refs)
+
+
+@receiver(post_delete, sender=Media)
+@receiver(post_delete, sender=User)
+def release_blobs(instance, **kwargs):
+    blobs.release(blobs.row_blobs(instance))
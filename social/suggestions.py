@@ -0,0 +1,88 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count
+
+from account.models import User
+from .follows import following_ids, is_following
+from .models import Follower
+
+POPULAR_KEY = "suggestions:popular"
+
+
+def suggestions_key(user_id):
+    return f"suggestions:{user_id}"
+
+
+def store_suggestions(user_id, scores):
+    ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+    ranked = ranked[: settings.SUGGESTIONS_SIZE]
+    cache.set(
+        suggestions_key(user_id), ranked, settings.SUGGESTIONS_TTL.total_seconds()
+    )
+    return ranked
+
+
+def compute_suggestions(user_id):
+    """Rank accounts followed by the people ``user_id`` follows.
+
+    The two-hop walk and the mutual counts are a single grouped query; only
+    the top ``SUGGESTIONS_SIZE`` candidates come back to Python.
+    """
+    followed = Follower.objects.filter(user_id=user_id).values("followed_id")
+    candidates = (
+        Follower.objects.filter(user_id__in=followed)
+        .exclude(followed_id__in=followed)
+        .exclude(followed_id=user_id)
+        .values("followed_id")
+        .annotate(mutuals=Count("id"))
+        .order_by("-mutuals", "followed_id")
+        .values_list("followed_id", "mutuals")[: settings.SUGGESTIONS_SIZE]
+    )
+    return store_suggestions(user_id, dict(candidates))
+
+
+def compute_popular():
+    popular = list(
+        User.objects.filter(is_active=True)
+        .order_by("-num_followers", "id")
+        .values_list("id", flat=True)[: settings.SUGGESTIONS_SIZE]
+    )
+    cache.set(POPULAR_KEY, popular, settings.SUGGESTIONS_TTL.total_seconds())
+    return popular
+
+
+def record_follow(user_id, followed_id):
+    """Fold a new follow into the cached list instead of recomputing it:
+    the followed account drops out and everyone it follows gains a mutual.
+    """
+
+    def update():
+        ranked = cache.get(suggestions_key(user_id))
+        if ranked is None:
+            return
+        scores = dict(ranked)
+        scores.pop(followed_id, None)
+        for candidate in following_ids(followed_id):
+            if candidate != user_id and not is_following(user_id, candidate):
+                scores[candidate] = scores.get(candidate, 0) + 1
+        store_suggestions(user_id, scores)
+
+    transaction.on_commit(update)
+
+
+def suggested_user_ids(user, limit=10):
+    ranked = cache.get(suggestions_key(user.id))
+    if ranked is None:
+        ranked = compute_suggestions(user.id)
+    # The cached list can lag behind follows made since it was built.
+    excluded = set(following_ids(user.id))
+    excluded.add(user.id)
+    ids = [candidate for candidate, _ in ranked if candidate not in excluded]
+    if len(ids) < limit:
+        popular = cache.get(POPULAR_KEY)
+        if popular is None:
+            popular = compute_popular()
+        excluded.update(ids)
+        ids += [candidate for candidate in popular if candidate not in excluded]
+    return ids[:limit]
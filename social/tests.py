@@ -1,3 +1,927 @@
-from django.test import TestCase
+import io
+import os
+import shutil
+import tempfile
+import threading
+import time
+from array import array
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+from rest_framework.test import APITestCase
+
+from account.models import User
+from api.media import ZeroCopyMedia, parse_range
+from api.storage import blob_storage
+from chat import presence, writer
+from . import blobs, follows, images, search, timeline, trending
+from .media import stored_uploads
+from .models import Blob, Comment, Follower, Media, Post, PostLike, Reply, UploadSession
+
+# In-process stand-ins for the Redis-backed services.
+LOCAL_SERVICES = {
+    "CACHES": {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+    "CHANNEL_LAYERS": {"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}},
+    "TIMELINE_STORE": "social.timeline.LocalTimelineStore",
+    "TIMELINE_FANOUT_WORKERS": 0,
+    "TRENDING_POOL": "social.trending.LocalTrendingPool",
+    "TYPING_STORE": "chat.presence.LocalTypingStore",
+    "IMAGE_VARIANT_WORKERS": 0,
+}
+
+
+def reset_services():
+    for accessor in (
+        timeline.get_store,
+        trending.get_pool,
+        follows.get_graph,
+        presence.get_store,
+        search._backend_for,
+        writer.get_writer,
+    ):
+        accessor.cache_clear()
+    cache.clear()
+
+
+class LocalServicesMixin:
+    """Runs each test against fresh in-process services, with a temporary
+    MEDIA_ROOT holding the chat spool.
+    """
+
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        overrides = override_settings(
+            **LOCAL_SERVICES,
+            MEDIA_ROOT=media_root,
+            CHAT_WRITER_OPTIONS={
+                "spool_dir": os.path.join(media_root, "chat-spool"),
+                "flush_interval": 0.005,
+                "max_batch": 200,
+            },
+        )
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.addCleanup(reset_services)
+        reset_services()
+        os.makedirs(os.path.join(media_root, "user_avatar"))
+        Image.new("RGB", (200, 200), "plum").save(
+            os.path.join(media_root, DEFAULT_AVATAR)
+        )
+
+
+def image_file(name="photo.png", size=(800, 600)):
+    output = io.BytesIO()
+    Image.new("RGB", size, "teal").save(output, "PNG")
+    return SimpleUploadedFile(name, output.getvalue(), content_type="image/png")
+
+
+DEFAULT_AVATAR = "user_avatar/peep-1.jpg"
+
+
+def make_user(username, **fields):
+    fields.setdefault("profile_pic", DEFAULT_AVATAR)
+    return User.objects.create_user(
+        f"{username}@example.com", username.title(), username, "password", **fields
+    )
+
+
+class SerializationQueryTests(LocalServicesMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = make_user("alice")
+        self.client.force_authenticate(self.user)
+        self.post = self.add_post()
+
+    def add_post(self):
+        author = make_user(f"author{User.objects.count()}")
+        post = Post.objects.create(author=author, content="hello")
+        PostLike.objects.create(post=post, user=self.user)
+        comment = Comment.objects.create(post=post, author=author, content="hi")
+        Reply.objects.create(comment=comment, author=author, content="hey")
+        return post
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries), response.data["results"]
+
+    def test_post_list_queries_do_not_grow_with_posts(self):
+        before, _ = self.count_queries("/api/posts/")
+        for _ in range(4):
+            self.add_post()
+        after, results = self.count_queries("/api/posts/")
+        self.assertEqual(before, after)
+        self.assertEqual(len(results), 5)
+        self.assertTrue(all(post["is_liked"] for post in results))
+        self.assertEqual({post["like_count"] for post in results}, {1})
+
+    def test_comment_and_reply_lists_do_not_grow(self):
+        comment = self.post.comments.get()
+        before, _ = self.count_queries(f"/api/posts/{self.post.pk}/comments/")
+        replies_before, _ = self.count_queries(f"/api/comments/{comment.pk}/replies/")
+        for index in range(4):
+            extra = Comment.objects.create(
+                post=self.post, author=self.user, content=f"more {index}"
+            )
+            Reply.objects.create(comment=comment, author=self.user, content="more")
+            Reply.objects.create(comment=extra, author=self.user, content="more")
+        after, comments = self.count_queries(f"/api/posts/{self.post.pk}/comments/")
+        replies_after, replies = self.count_queries(
+            f"/api/comments/{comment.pk}/replies/"
+        )
+        self.assertEqual(before, after)
+        self.assertEqual(replies_before, replies_after)
+        self.assertEqual(len(comments), 5)
+        self.assertEqual(len(replies), 5)
+
+
+class CounterTests(LocalServicesMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = make_user("alice")
+        self.author = make_user("bob")
+        self.client.force_authenticate(self.user)
+        self.post = Post.objects.create(author=self.author, content="hello")
+
+    def test_like_and_unlike_move_num_likes(self):
+        url = f"/api/posts/{self.post.pk}/like/"
+        self.assertEqual(self.client.post(url).status_code, 201)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.num_likes, 1)
+        self.assertEqual(self.client.post(url).status_code, 204)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.num_likes, 0)
+
+    def test_comments_replies_and_follows_are_counted(self):
+        comment = Comment.objects.create(post=self.post, author=self.user, content="a")
+        Reply.objects.create(comment=comment, author=self.author, content="b")
+        Follower.objects.create(user=self.user, followed=self.author)
+        self.post.refresh_from_db()
+        comment.refresh_from_db()
+        self.author.refresh_from_db()
+        self.user.refresh_from_db()
+        self.assertEqual(self.post.num_comments, 1)
+        self.assertEqual(comment.num_replies, 1)
+        self.assertEqual(self.author.num_posts, 1)
+        self.assertEqual(self.author.num_followers, 1)
+        self.assertEqual(self.user.num_following, 1)
+
+        comment.delete()
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.num_comments, 0)
+
+    def test_deleting_a_post_does_not_update_it_per_like(self):
+        fans = [make_user(f"fan{index}") for index in range(30)]
+        posts = [
+            Post.objects.create(author=self.author, content=str(likes))
+            for likes in (1, 30)
+        ]
+        for post in posts:
+            for fan in fans[: int(post.content)]:
+                PostLike.objects.create(post=post, user=fan)
+        # Warms the caches the delete receivers read.
+        Post.objects.create(author=self.author, content="0").delete()
+        with CaptureQueriesContext(connection) as one:
+            posts[0].delete()
+        with CaptureQueriesContext(connection) as thirty:
+            posts[1].delete()
+        self.assertEqual(len(one), len(thirty))
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.num_posts, 1)
+
+    def test_deleting_a_user_uncounts_rows_that_remain(self):
+        PostLike.objects.create(post=self.post, user=self.user)
+        Follower.objects.create(user=self.user, followed=self.author)
+        Follower.objects.create(user=self.author, followed=self.user)
+        self.user.delete()
+        self.post.refresh_from_db()
+        self.author.refresh_from_db()
+        self.assertEqual(self.post.num_likes, 0)
+        self.assertEqual((self.author.num_followers, self.author.num_following), (0, 0))
+
+    def test_reconcile_counters_repairs_drift(self):
+        PostLike.objects.create(post=self.post, user=self.user)
+        Post.objects.filter(pk=self.post.pk).update(num_likes=7, num_comments=3)
+        User.objects.filter(pk=self.author.pk).update(num_posts=0)
+        call_command("reconcile_counters", batch_size=1, stdout=io.StringIO())
+        self.post.refresh_from_db()
+        self.author.refresh_from_db()
+        self.assertEqual((self.post.num_likes, self.post.num_comments), (1, 0))
+        self.assertEqual(self.author.num_posts, 1)
+
+
+class HomeTimelineTests(LocalServicesMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = make_user("alice")
+        self.friend = make_user("bob")
+        self.stranger = make_user("carol")
+        self.client.force_authenticate(self.user)
+
+    def feed(self, **params):
+        response = self.client.get("/api/home/posts/", params)
+        self.assertEqual(response.status_code, 200)
+        return [post["id"] for post in response.data["results"]]
+
+    def publish(self, author, content="post"):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Post.objects.create(author=author, content=content)
+
+    def test_posts_are_fanned_out_to_followers(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Follower.objects.create(user=self.user, followed=self.friend)
+        # Builds the timeline, so later posts arrive by fan-out.
+        self.assertEqual(self.feed(), [])
+        own = self.publish(self.user)
+        friends = self.publish(self.friend)
+        self.publish(self.stranger)
+        self.assertEqual(self.feed(), [friends.pk, own.pk])
+
+    def test_deletes_and_unfollows_drop_out(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Follower.objects.create(user=self.user, followed=self.friend)
+        first = self.publish(self.friend)
+        second = self.publish(self.friend)
+        self.assertEqual(self.feed(), [second.pk, first.pk])
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertEqual(self.feed(), [first.pk])
+        with self.captureOnCommitCallbacks(execute=True):
+            Follower.objects.get(user=self.user).delete()
+        self.assertEqual(self.feed(), [])
+
+    @override_settings(TIMELINE_FANOUT_LIMIT=0)
+    def test_popular_authors_are_merged_on_read(self):
+        Follower.objects.create(user=self.stranger, followed=self.friend)
+        with self.captureOnCommitCallbacks(execute=True):
+            Follower.objects.create(user=self.user, followed=self.friend)
+        posts = [self.publish(self.friend, str(index)).pk for index in range(3)]
+        first = self.client.get("/api/home/posts/", {"page_size": 2}).data
+        second = self.client.get(first["next"]).data
+        ids = [post["id"] for post in first["results"] + second["results"]]
+        self.assertEqual(ids, posts[::-1])
+        self.assertEqual(timeline.get_store().read(self.user.id, None, 10), [])
+        # The authors merged in are cached rather than joined on every page.
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(first["next"])
+        self.assertFalse(any('"num_followers" >' in query["sql"] for query in queries))
+
+    def walk(self, page_size):
+        url, ids = f"/api/home/posts/?page_size={page_size}", []
+        while url:
+            data = self.client.get(url).data
+            ids += [post["id"] for post in data["results"]]
+            url = data["next"]
+        return ids
+
+    def test_posts_sharing_a_time_are_all_paged(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Follower.objects.create(user=self.user, followed=self.friend)
+        posts = [self.publish(self.friend, str(index)).pk for index in range(9)]
+        Post.objects.update(created_at=timezone.now())
+        timeline.rebuild_timeline(self.user.id)
+        self.assertEqual(self.walk(2), posts[::-1])
+
+    @override_settings(TIMELINE_STORE_OPTIONS={"max_length": 3})
+    def test_pages_past_the_stored_timeline_come_from_the_database(self):
+        timeline.get_store.cache_clear()
+        with self.captureOnCommitCallbacks(execute=True):
+            Follower.objects.create(user=self.user, followed=self.friend)
+        posts = [self.publish(self.friend, str(index)).pk for index in range(7)]
+        self.assertEqual(self.walk(2), posts[::-1])
+
+    @override_settings(TIMELINE_FANOUT_WORKERS=2)
+    def test_jobs_of_a_user_run_in_order(self):
+        ran, done = [], threading.Event()
+
+        def job(name, delay=0):
+            time.sleep(delay)
+            ran.append(name)
+
+        self.addCleanup(setattr, timeline, "_executors", None)
+        with self.captureOnCommitCallbacks(execute=True):
+            timeline.enqueue(job, "follow", 0.05, key=self.user.id)
+            timeline.enqueue(job, "unfollow", key=self.user.id)
+            timeline.enqueue(done.set, key=self.user.id)
+        self.assertTrue(done.wait(5))
+        self.assertEqual(ran, ["follow", "unfollow"])
+
+
+class KeysetPaginationTests(LocalServicesMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = make_user("alice")
+        self.client.force_authenticate(self.user)
+        posts = [Post(author=self.user, content=str(index)) for index in range(7)]
+        Post.objects.bulk_create(posts)
+        # Several posts share a timestamp, so the id has to break ties.
+        stamp = Post.objects.order_by("pk")[2].created_at
+        Post.objects.filter(pk__in=[post.pk for post in posts[2:5]]).update(
+            created_at=stamp
+        )
+
+    def walk(self, url):
+        ids = []
+        while url:
+            data = self.client.get(url).data
+            ids += [post["id"] for post in data["results"]]
+            url = data["next"]
+        return ids
+
+    def test_pages_have_no_duplicates_or_gaps(self):
+        expected = list(
+            Post.objects.order_by("-created_at", "-pk").values_list("pk", flat=True)
+        )
+        self.assertEqual(self.walk("/api/posts/?page_size=2"), expected)
+
+    def test_new_posts_do_not_shift_later_pages(self):
+        first = self.client.get("/api/posts/", {"page_size": 3}).data
+        Post.objects.create(author=self.user, content="new")
+        rest = self.walk(first["next"])
+        ids = [post["id"] for post in first["results"]] + rest
+        self.assertEqual(len(ids), 7)
+        self.assertEqual(len(set(ids)), 7)
+
+    def test_previous_link_returns_the_page_before(self):
+        first = self.client.get("/api/posts/", {"page_size": 3}).data
+        second = self.client.get(first["next"]).data
+        back = self.client.get(second["previous"]).data
+        self.assertEqual(back["results"], first["results"])
+
+    def test_count_is_opt_in_and_bad_cursors_are_404(self):
+        self.assertNotIn("count", self.client.get("/api/posts/").data)
+        self.assertEqual(self.client.get("/api/posts/?count=true").data["count"], 7)
+        response = self.client.get("/api/posts/", {"cursor": "bm90LWEtY3Vyc29y"})
+        self.assertEqual(response.status_code, 404)
+
+
+class ImageVariantTests(LocalServicesMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.post = Post.objects.create(author=make_user("alice"), content="pics")
+
+    def test_variants_are_built_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            media = Media.objects.create(post=self.post, file=image_file())
+        media.refresh_from_db()
+        self.assertEqual(media.variants["source"], media.file.name)
+        self.assertEqual(set(media.variants["files"]), {"320", "640", "1080"})
+        with Image.open(
+            default_storage.path(media.variants["files"]["320"])
+        ) as variant:
+            self.assertEqual((variant.format, variant.size), ("WEBP", (320, 240)))
+
+    def test_missing_source_is_logged_and_left_stale(self):
+        with self.assertLogs("social.images", "ERROR"):
+            with self.captureOnCommitCallbacks(execute=True):
+                user = make_user("bob", profile_pic="user_avatar/missing.jpg")
+        user.refresh_from_db()
+        self.assertTrue(images.is_stale(user.profile_pic, user.profile_pic_variants))
+
+    def test_undecodable_image_is_recorded_without_variants(self):
+        upload = SimpleUploadedFile("broken.png", b"not an image")
+        with self.assertLogs("social.images", "WARNING"):
+            with self.captureOnCommitCallbacks(execute=True):
+                media = Media.objects.create(post=self.post, file=upload)
+        media.refresh_from_db()
+        self.assertEqual(media.variants, {"source": media.file.name, "files": {}})
+
+    @override_settings(IMAGE_VARIANT_WORKERS=1)
+    def test_worker_processes_read_the_file_by_path(self):
+        media = Media.objects.create(post=self.post, file=image_file())
+        images.get_process_pool.cache_clear()
+        self.addCleanup(images.get_process_pool.cache_clear)
+        pool = images.get_process_pool()
+        self.addCleanup(pool.shutdown)
+        self.assertEqual(pool._mp_context.get_start_method(), "spawn")
+        rendered = images.render(media.file.path, [64])
+        self.assertEqual(list(rendered), [64])
+
+
+class ExploreTests(LocalServicesMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = make_user("alice")
+        self.client.force_authenticate(self.user)
+        author = make_user("bob")
+        self.quiet = Post.objects.create(author=author, content="quiet")
+        self.popular = Post.objects.create(author=author, content="popular")
+        PostLike.objects.create(post=self.popular, user=self.user)
+        Comment.objects.create(post=self.popular, author=self.user, content="!")
+        Post.objects.create(author=self.user, content="own")
+
+    def explore(self):
+        response = self.client.get("/api/explore/")
+        self.assertEqual(response.status_code, 200)
+        return [post["id"] for post in response.data["results"]]
+
+    def test_empty_pool_is_served_from_the_database(self):
+        with mock.patch("social.trending.schedule_rebuild") as schedule_rebuild:
+            self.assertEqual(self.explore(), [self.popular.pk, self.quiet.pk])
+            first = self.client.get("/api/explore/", {"page_size": 1}).data
+            second = self.client.get(first["next"]).data
+        schedule_rebuild.assert_called_with()
+        self.assertEqual(first["results"][0]["id"], self.popular.pk)
+        self.assertEqual(second["results"][0]["id"], self.quiet.pk)
+        self.assertIsNone(trending.get_pool().epoch())
+
+    def test_built_pool_ranks_by_engagement(self):
+        trending.rebuild_pool()
+        self.assertEqual(self.explore(), [self.popular.pk, self.quiet.pk])
+        fans = [make_user(f"fan{index}") for index in range(5)]
+        with self.captureOnCommitCallbacks(execute=True):
+            for fan in fans:
+                PostLike.objects.create(post=self.quiet, user=fan)
+        self.assertEqual(self.explore(), [self.quiet.pk, self.popular.pk])
+
+    def test_pool_trims_authors_with_scores(self):
+        pool = trending.LocalTrendingPool(size=2)
+        for post_id in range(1, 4):
+            pool.add(post_id, post_id * 10, float(post_id))
+        self.assertEqual(sorted(pool.entries()), [(2, 20, 2.0), (3, 30, 3.0)])
+        self.assertEqual(pool._authors, {2: 20, 3: 30})
+
+
+class SuggestedUsersTests(LocalServicesMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = make_user("alice")
+        self.client.force_authenticate(self.user)
+        friends = [make_user("bob"), make_user("carol")]
+        self.close, self.distant = make_user("dave"), make_user("erin")
+        for friend in friends:
+            Follower.objects.create(user=self.user, followed=friend)
+            Follower.objects.create(user=friend, followed=self.close)
+        Follower.objects.create(user=friends[0], followed=self.distant)
+
+    def test_friends_of_friends_ranked_by_mutuals(self):
+        response = self.client.get("/api/suggested-users/")
+        self.assertEqual(response.status_code, 200)
+        ids = [user["id"] for user in response.data]
+        self.assertEqual(ids[:2], [self.close.pk, self.distant.pk])
+        self.assertNotIn(self.user.pk, ids)
+
+    def test_new_follows_update_cached_suggestions(self):
+        self.client.get("/api/suggested-users/")
+        with self.captureOnCommitCallbacks(execute=True):
+            Follower.objects.create(user=self.user, followed=self.close)
+        ids = [user["id"] for user in self.client.get("/api/suggested-users/").data]
+        self.assertEqual(ids[0], self.distant.pk)
+        self.assertNotIn(self.close.pk, ids)
+
+    def test_suggestions_are_a_queryset(self):
+        response = self.client.get(f"/api/suggested-users/{self.close.pk}/")
+        self.assertEqual(response.data["username"], "dave")
+
+
+class MutualConnectionsTests(LocalServicesMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = make_user("alice")
+        self.target = make_user("zoe")
+        self.client.force_authenticate(self.user)
+        self.mutuals = []
+        for index in range(5):
+            friend = make_user(f"friend{index}")
+            Follower.objects.create(user=self.user, followed=friend)
+            if index % 2 == 0:
+                Follower.objects.create(user=friend, followed=self.target)
+                self.mutuals.append(friend.pk)
+        Follower.objects.create(user=make_user("stranger"), followed=self.target)
+
+    def walk(self):
+        url, ids = "/api/users/zoe/mutual-connections/?page_size=2", []
+        while url:
+            data = self.client.get(url).data
+            self.assertEqual(data["count"], len(self.mutuals))
+            ids += [user["id"] for user in data["results"]]
+            url = data["next"]
+        return ids
+
+    def test_pages_through_the_intersection(self):
+        self.assertEqual(self.walk(), self.mutuals)
+        response = self.client.get(
+            "/api/users/zoe/mutual-connections/", {"count_only": "true"}
+        )
+        self.assertEqual(response.data, {"count": 3})
+
+    @override_settings(FOLLOW_IDS_MAX_CACHED=0)
+    def test_large_follower_lists_are_probed_in_the_database(self):
+        self.assertEqual(self.walk(), self.mutuals)
+
+    def test_intersect(self):
+        left = array("q", [1, 4, 9, 16])
+        right = array("q", range(0, 20, 2))
+        self.assertEqual(list(follows.intersect(left, right)), [4, 16])
+        self.assertEqual(list(follows.intersect(right, left)), [4, 16])
+
+
+class FollowGraphTests(LocalServicesMixin, APITestCase):
+    def test_lru_is_bounded_by_ids_held(self):
+        graph = follows.FollowGraph(max_ids=4, max_age=60)
+        graph.get("a", lambda: [1, 2])
+        graph.get("b", lambda: [3, 4])
+        graph.get("a", lambda: self.fail("a should be cached"))
+        graph.get("c", lambda: [5])
+        self.assertEqual(list(graph._entries), ["a", "c"])
+        self.assertEqual(graph._size, 3)
+
+    def test_expired_entries_are_reloaded(self):
+        graph = follows.FollowGraph(max_ids=10, max_age=0)
+        graph.get("a", lambda: [1])
+        self.assertEqual(graph.get("a", lambda: [2]), [2])
+
+    def test_load_racing_a_discard_is_not_stored(self):
+        graph = follows.FollowGraph(max_ids=10, max_age=60)
+
+        def load():
+            graph.discard(["a"])
+            return [1]
+
+        self.assertEqual(graph.get("a", load), [1])
+        self.assertNotIn("a", graph._entries)
+
+    def test_follows_invalidate_cached_ids(self):
+        alice, bob = make_user("alice"), make_user("bob")
+        self.assertEqual(list(follows.following_ids(alice.pk)), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            Follower.objects.create(user=alice, followed=bob)
+        self.assertTrue(follows.is_following(alice.pk, bob.pk))
+        self.assertEqual(list(follows.follower_ids(bob.pk)), [alice.pk])
+        with self.captureOnCommitCallbacks(execute=True):
+            Follower.objects.get().delete()
+        self.assertFalse(follows.is_following(alice.pk, bob.pk))
+
+    def test_lists_loaded_before_a_change_are_not_read_after_it(self):
+        alice, bob = make_user("alice"), make_user("bob")
+        Follower.objects.create(user=alice, followed=bob)
+        key = follows.following_key(alice.pk)
+
+        class StaleRows:
+            # Rows read by another process just before the follow committed
+            def order_by(self, column):
+                return self
+
+            def values_list(self, *args, **kwargs):
+                follows.invalidate_follow(alice.pk, bob.pk)
+                return []
+
+        self.assertEqual(list(follows._load(key, StaleRows(), "followed_id")), [])
+        follows.get_graph().discard([key])
+        self.assertEqual(list(follows.following_ids(alice.pk)), [bob.pk])
+
+
+class SearchTests(LocalServicesMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = make_user("alice")
+        self.client.force_authenticate(self.user)
+        make_user("gardener")
+        for index in range(3):
+            Post.objects.create(author=self.user, content=f"garden notes {index}")
+        Post.objects.create(author=self.user, content="unrelated")
+
+    def test_search_without_rebuilding_the_index(self):
+        response = self.client.get("/api/search/search/", {"q": "garden"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data["posts"]), 3)
+        self.assertEqual(
+            [user["username"] for user in response.data["profiles"]], ["gardener"]
+        )
+
+    def test_type_pages_one_kind(self):
+        response = self.client.get(
+            "/api/search/search/", {"q": "garden", "type": "posts", "page_size": 2}
+        )
+        self.assertNotIn("profiles", response.data)
+        self.assertEqual(len(response.data["posts"]), 2)
+        second = self.client.get(response.data["posts_next"])
+        self.assertEqual(len(second.data["posts"]), 1)
+        seen = {post["id"] for post in response.data["posts"] + second.data["posts"]}
+        self.assertEqual(len(seen), 3)
+
+    def test_unknown_type_is_rejected(self):
+        response = self.client.get("/api/search/search/", {"q": "garden", "type": "x"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_posts_match_their_author(self):
+        gardener = User.objects.get(username="gardener")
+        post = Post.objects.create(author=gardener, content="tomatoes")
+        response = self.client.get("/api/search/search/", {"q": "gardener"})
+        self.assertIn(post.pk, [post["id"] for post in response.data["posts"]])
+        gardener.username = "grower"
+        gardener.save()
+        response = self.client.get("/api/search/search/", {"q": "grower"})
+        self.assertEqual([post["id"] for post in response.data["posts"]], [post.pk])
+
+    def test_other_databases_fall_back_to_substring_matching(self):
+        backend = search._backend_for("oracle")
+        hits = backend.search_posts("notes", limit=2)
+        self.assertEqual(len(hits), 2)
+        self.assertEqual(len(backend.search_posts("notes", after=hits[-1])), 1)
+        self.assertEqual(len(backend.search_users("garden")), 1)
+
+    def test_deleted_rows_leave_the_index(self):
+        Post.objects.filter(content="garden notes 0").delete()
+        User.objects.filter(username="gardener").delete()
+        response = self.client.get("/api/search/search/", {"q": "garden"})
+        self.assertEqual(len(response.data["posts"]), 2)
+        self.assertEqual(response.data["profiles"], [])
+
+
+class MediaUploadTests(LocalServicesMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(make_user("alice"))
+
+    def create_post(self, files):
+        return self.client.post(
+            "/api/posts/", {"content": "album", "media": files}, format="multipart"
+        )
+
+    def images(self, count):
+        return [
+            image_file(f"{index}.png", (100 + index, 100)) for index in range(count)
+        ]
+
+    def test_query_count_does_not_grow_with_the_files(self):
+        with CaptureQueriesContext(connection) as two:
+            self.assertEqual(self.create_post(self.images(2)).status_code, 201)
+        with CaptureQueriesContext(connection) as ten:
+            self.assertEqual(self.create_post(self.images(10)).status_code, 201)
+        self.assertEqual(len(two), len(ten))
+        post = Post.objects.latest("pk")
+        self.assertEqual(post.media.count(), 10)
+        self.assertEqual(
+            set(Blob.objects.filter(refs__gt=0).values_list("name", flat=True)),
+            set(Media.objects.values_list("file", flat=True)),
+        )
+
+    def test_bad_batches_are_rejected_before_storing(self):
+        too_many = self.create_post(self.images(Media.MAX_PER_POST + 1))
+        unsupported = self.create_post(
+            [SimpleUploadedFile("notes.txt", b"text", content_type="text/plain")]
+        )
+        self.assertEqual((too_many.status_code, unsupported.status_code), (400, 400))
+        self.assertIn("media", unsupported.data)
+        self.assertFalse(Post.objects.exists())
+        self.assertFalse(os.path.exists(default_storage.path("blobs")))
+
+    def test_failed_posts_leave_their_files_unreferenced(self):
+        with mock.patch.object(
+            Media.objects, "bulk_create", side_effect=RuntimeError("insert failed")
+        ):
+            with self.assertRaises(RuntimeError):
+                self.create_post(self.images(2))
+        self.assertFalse(Post.objects.exists())
+        self.assertFalse(Blob.objects.filter(refs__gt=0).exists())
+
+
+class ResumableUploadTests(LocalServicesMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.upload_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.upload_dir, ignore_errors=True)
+        overrides = override_settings(
+            UPLOAD_SESSION_DIR=self.upload_dir, UPLOAD_CHUNK_SIZE=1024
+        )
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.user = make_user("alice")
+        self.client.force_authenticate(self.user)
+        self.post = Post.objects.create(author=self.user, content="upload")
+        output = io.BytesIO()
+        Image.effect_noise((64, 64), 64).save(output, "PNG")
+        self.data = output.getvalue()
+
+    def start(self):
+        response = self.client.post(
+            "/api/uploads/", {"filename": "photo.png", "size": len(self.data)}
+        )
+        self.assertEqual(response.status_code, 201)
+        return response.data["id"]
+
+    def put_chunk(self, pk, index, **headers):
+        chunk = self.data[index * 1024 : (index + 1) * 1024]
+        return self.client.put(
+            f"/api/uploads/{pk}/chunks/{index}/",
+            chunk,
+            content_type="application/octet-stream",
+            headers=headers,
+        )
+
+    def upload(self):
+        pk = self.start()
+        for index in range(-(-len(self.data) // 1024)):
+            self.assertEqual(self.put_chunk(pk, index).status_code, 200)
+        return pk
+
+    def complete(self, pk):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(
+                f"/api/uploads/{pk}/complete/", {"post": self.post.pk}
+            )
+
+    def test_chunks_resume_and_complete_into_media(self):
+        pk = self.start()
+        self.assertEqual(self.put_chunk(pk, 1).status_code, 409)
+        self.put_chunk(pk, 0)
+        # Resending the last chunk is allowed.
+        self.assertEqual(self.put_chunk(pk, 0).data["received"], 1024)
+        bad = self.put_chunk(pk, 1, upload_checksum="0" * 64)
+        self.assertEqual(bad.status_code, 400)
+        self.assertEqual(self.client.get(f"/api/uploads/{pk}/").data["received"], 1024)
+        for index in range(1, -(-len(self.data) // 1024)):
+            self.put_chunk(pk, index)
+
+        response = self.complete(pk)
+        self.assertEqual(response.status_code, 201)
+        media = Media.objects.get(post=self.post)
+        with media.file.open() as file:
+            self.assertEqual(file.read(), self.data)
+        self.assertFalse(UploadSession.objects.exists())
+        self.assertEqual(os.listdir(self.upload_dir), [])
+
+    def test_a_failed_completion_can_be_retried(self):
+        pk = self.upload()
+        with mock.patch.object(
+            Media.objects, "create", side_effect=RuntimeError("insert failed")
+        ):
+            with self.assertRaises(RuntimeError):
+                self.complete(pk)
+        self.assertEqual(os.listdir(self.upload_dir), [f"{pk}.part"])
+        # Its file is now also the stored blob, so must not be written to.
+        self.assertEqual(self.put_chunk(pk, 0).status_code, 409)
+        self.assertEqual(self.complete(pk).status_code, 201)
+
+    def test_full_posts_are_rejected_before_storing(self):
+        Media.objects.bulk_create(
+            Media(post=self.post, file=f"posts/{index}.png", type="image")
+            for index in range(Media.MAX_PER_POST)
+        )
+        pk = self.upload()
+        self.assertEqual(self.complete(pk).status_code, 400)
+        self.assertFalse(os.path.exists(default_storage.path("blobs")))
+        self.assertEqual(os.listdir(self.upload_dir), [f"{pk}.part"])
+
+    def test_expire_uploads_removes_abandoned_files(self):
+        expired, live = self.start(), self.start()
+        UploadSession.objects.filter(pk=expired).update(expires_at=timezone.now())
+        open(os.path.join(self.upload_dir, f"{expired}.part.staged"), "wb").close()
+        call_command("expire_uploads", stdout=io.StringIO())
+        self.assertEqual(os.listdir(self.upload_dir), [f"{live}.part"])
+        self.assertEqual(
+            [str(pk) for pk in UploadSession.objects.values_list("pk", flat=True)],
+            [live],
+        )
+
+
+class MediaServingTests(LocalServicesMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.name = default_storage.save("notes/readme.txt", io.BytesIO(b"0123456789"))
+
+    def test_ranges_and_conditional_requests(self):
+        url = f"/media/{self.name}"
+        response = self.client.get(url, headers={"range": "bytes=2-5"})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response["Content-Range"], "bytes 2-5/10")
+        self.assertEqual(b"".join(response.streaming_content), b"2345")
+
+        etag = self.client.get(url)["ETag"]
+        cached = self.client.get(url, headers={"if-none-match": etag})
+        self.assertEqual(cached.status_code, 304)
+        beyond = self.client.get(url, headers={"range": "bytes=20-"})
+        self.assertEqual(beyond.status_code, 416)
+        # A stale If-Range gets the whole file.
+        stale = self.client.get(url, headers={"range": "bytes=2-5", "if-range": '"x"'})
+        self.assertEqual(stale.status_code, 200)
+
+    def test_no_range_of_an_empty_file_is_satisfiable(self):
+        for header in ("bytes=0-", "bytes=-5", "bytes=0-0"):
+            self.assertIsNone(parse_range(header, 0))
+        name = default_storage.save("notes/empty.txt", io.BytesIO(b""))
+        response = self.client.get(f"/media/{name}", headers={"range": "bytes=-5"})
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response["Content-Range"], "bytes */0")
+
+    def test_hash_named_files_are_tagged_with_their_digest(self):
+        post = Post.objects.create(author=make_user("alice"), content="pics")
+        media = Media.objects.create(post=post, file=image_file())
+        response = self.client.get(f"/media/{media.file.name}")
+        digest = os.path.splitext(os.path.basename(media.file.name))[0]
+        self.assertEqual(response["ETag"], f'"{digest}"')
+        self.assertIn("immutable", response["Cache-Control"])
+        os.utime(media.file.path, (0, 0))
+        self.assertEqual(
+            self.client.get(f"/media/{media.file.name}")["ETag"], response["ETag"]
+        )
+
+    async def test_zero_copy_servers_get_the_file(self):
+        async def fallback(scope, receive, send):
+            self.fail("The media request was not served by ZeroCopyMedia.")
+
+        messages = []
+
+        async def send(message):
+            if message["type"] == ZeroCopyMedia.extension:
+                message = dict(message, body=message["file"].read(message["count"]))
+            messages.append(message)
+
+        scope = {
+            "type": "http",
+            "method": "GET",
+            "path": f"/media/{self.name}",
+            "query_string": b"",
+            "headers": [(b"range", b"bytes=4-")],
+            "extensions": {ZeroCopyMedia.extension: {}},
+        }
+        await ZeroCopyMedia(fallback)(scope, None, send)
+        start, body = messages
+        self.assertEqual(start["status"], 206)
+        self.assertEqual((body["offset"], body["body"]), (4, b"456789"))
+
+
+class BlobStorageTests(LocalServicesMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.post = Post.objects.create(author=make_user("alice"), content="pics")
+
+    def add_media(self):
+        return Media.objects.create(post=self.post, file=image_file())
+
+    def age(self, name, delta):
+        then = timezone.now() - delta
+        Blob.objects.filter(name=name).update(updated_at=then)
+        path = blob_storage().path(name)
+        os.utime(path, (then.timestamp(), then.timestamp()))
+
+    def collect(self):
+        return blobs.collect(100, timedelta(hours=1))
+
+    def test_identical_files_share_one_counted_blob(self):
+        first, second = self.add_media(), self.add_media()
+        self.assertEqual(first.file.name, second.file.name)
+        self.assertEqual(Blob.objects.get(name=first.file.name).refs, 2)
+        first.delete()
+        self.assertEqual(Blob.objects.get(name=second.file.name).refs, 1)
+
+    def test_storing_again_restarts_the_grace_without_touching_the_file(self):
+        name = self.add_media().file.name
+        Media.objects.all().delete()
+        self.age(name, timedelta(days=1))
+        modified = os.path.getmtime(blob_storage().path(name))
+        with stored_uploads([image_file()]) as names:
+            self.assertEqual(names, [name])
+        self.assertEqual(os.path.getmtime(blob_storage().path(name)), modified)
+        self.assertEqual(self.collect(), 0)
+        self.assertGreater(
+            Blob.objects.get(name=name).updated_at, timezone.now() - timedelta(hours=1)
+        )
+
+    def test_collect_waits_out_the_grace_after_release(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            name = self.add_media().file.name
+        Media.objects.all().delete()
+        # Released just now, though the file itself is old.
+        os.utime(blob_storage().path(name), (0, 0))
+        self.assertEqual(self.collect(), 0)
+        self.age(name, timedelta(hours=2))
+        self.assertEqual(self.collect(), 1)
+        self.assertFalse(os.path.exists(blob_storage().path(name)))
+        self.assertFalse(
+            os.path.exists(
+                default_storage.path(os.path.dirname(images.variant_name(name, 0)))
+            )
+        )
+        self.assertFalse(Blob.objects.exists())
+
+    def test_files_without_a_row_are_judged_by_age(self):
+        directory = blob_storage().path("blobs/tmp")
+        os.makedirs(directory)
+        for name in ("old", "new"):
+            open(os.path.join(directory, name), "wb").close()
+        os.utime(os.path.join(directory, "old"), (0, 0))
+        self.collect()
+        self.assertEqual(os.listdir(directory), ["new"])
+
+    def test_recount_repairs_reference_counts(self):
+        name = self.add_media().file.name
+        Blob.objects.update(refs=0, updated_at=timezone.now() - timedelta(days=1))
+        call_command(
+            "collect_blobs", "--recount", "--grace-minutes=60", stdout=io.StringIO()
+        )
+        self.assertEqual(Blob.objects.get(name=name).refs, 1)
+        self.assertTrue(os.path.exists(blob_storage().path(name)))
@@ -0,0 +1,361 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from array import array
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from django.utils.module_loading import import_string
+
+from account.models import User
+from . import follows
+from .models import Post, Follower
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def post_score(created_at):
+    # Integer microseconds stay exact in a Redis (double) score.
+    return (created_at - EPOCH) // timedelta(microseconds=1)
+
+
+def score_datetime(score):
+    return EPOCH + timedelta(microseconds=score)
+
+
+class LocalTimelineStore:
+    """Per-user timelines kept in process memory."""
+
+    def __init__(self, max_length):
+        self.max_length = max_length
+        self._timelines = {}
+        self._lock = threading.Lock()
+
+    def is_built(self, user_id):
+        return user_id in self._timelines
+
+    def build(self, user_id, entries):
+        with self._lock:
+            self._timelines[user_id] = self._trim(dict(entries))
+
+    def push(self, user_ids, entries):
+        with self._lock:
+            for user_id in user_ids:
+                timeline = self._timelines.get(user_id)
+                if timeline is not None:
+                    timeline.update(entries)
+                    self._timelines[user_id] = self._trim(timeline)
+
+    def remove(self, user_ids, post_ids):
+        with self._lock:
+            for user_id in user_ids:
+                timeline = self._timelines.get(user_id)
+                if timeline is not None:
+                    for post_id in post_ids:
+                        timeline.pop(post_id, None)
+
+    def read(self, user_id, after, limit):
+        with self._lock:
+            timeline = self._timelines.get(user_id, {})
+            entries = [
+                (score, post_id)
+                for post_id, score in timeline.items()
+                if after is None or (score, post_id) < after
+            ]
+        entries.sort(reverse=True)
+        return [(post_id, score) for score, post_id in entries[:limit]]
+
+    def _trim(self, timeline):
+        if len(timeline) <= self.max_length:
+            return timeline
+        newest = sorted(timeline.items(), key=lambda entry: entry[1], reverse=True)
+        return dict(newest[: self.max_length])
+
+
+class RedisTimelineStore:
+    """Per-user timelines kept as Redis sorted sets of post id -> score.
+
+    Every built timeline holds a sentinel member at the lowest rank so that a
+    user who follows nobody still has a key, and pushes can skip users whose
+    timeline is cold (it is rebuilt from the database on their next read).
+    """
+
+    SENTINEL = "-"
+
+    PUSH_SCRIPT = """
+    if redis.call('EXISTS', KEYS[1]) == 1 then
+        for i = 2, #ARGV, 2 do
+            redis.call('ZADD', KEYS[1], ARGV[i], ARGV[i + 1])
+        end
+        redis.call('ZREMRANGEBYRANK', KEYS[1], 1, -tonumber(ARGV[1]) - 1)
+    end
+    """
+
+    def __init__(self, max_length, url=None):
+        import redis
+
+        self.max_length = max_length
+        self.client = redis.Redis.from_url(url or settings.REDIS_URL)
+        self._push = self.client.register_script(self.PUSH_SCRIPT)
+
+    def key(self, user_id):
+        return f"timeline:{user_id}"
+
+    def is_built(self, user_id):
+        return bool(self.client.exists(self.key(user_id)))
+
+    def build(self, user_id, entries):
+        key = self.key(user_id)
+        mapping = {self.SENTINEL: "-inf"}
+        mapping.update({str(post_id): score for post_id, score in entries})
+        pipe = self.client.pipeline()
+        pipe.delete(key)
+        pipe.zadd(key, mapping)
+        pipe.zremrangebyrank(key, 1, -self.max_length - 1)
+        pipe.execute()
+
+    def push(self, user_ids, entries):
+        args = [self.max_length]
+        for post_id, score in entries.items():
+            args += [score, post_id]
+        pipe = self.client.pipeline(transaction=False)
+        for user_id in user_ids:
+            self._push(keys=[self.key(user_id)], args=args, client=pipe)
+        pipe.execute()
+
+    def remove(self, user_ids, post_ids):
+        if not post_ids:
+            return
+        members = [str(post_id) for post_id in post_ids]
+        pipe = self.client.pipeline(transaction=False)
+        for user_id in user_ids:
+            pipe.zrem(self.key(user_id), *members)
+        pipe.execute()
+
+    def read(self, user_id, after, limit):
+        # Redis orders members that share a score as strings, not by id, so
+        # every member sharing the cursor's or the last row's score is read
+        # and ordered here.
+        key = self.key(user_id)
+        pipe = self.client.pipeline(transaction=False)
+        if after is not None:
+            pipe.zrangebyscore(key, after[0], after[0], withscores=True)
+        pipe.zrevrangebyscore(
+            key,
+            "+inf" if after is None else f"({after[0]}",
+            "(-inf",
+            start=0,
+            num=limit,
+            withscores=True,
+        )
+        *ties, rows = pipe.execute()
+        if len(rows) == limit:
+            last = int(rows[-1][1])
+            ties.append(self.client.zrangebyscore(key, last, last, withscores=True))
+        entries = {
+            (int(score), int(member))
+            for member, score in rows + [row for tie in ties for row in tie]
+        }
+        entries = sorted(
+            (entry for entry in entries if after is None or entry < after),
+            reverse=True,
+        )
+        return [(post_id, score) for score, post_id in entries[:limit]]
+
+
+@lru_cache(maxsize=None)
+def get_store():
+    store_class = import_string(settings.TIMELINE_STORE)
+    return store_class(**settings.TIMELINE_STORE_OPTIONS)
+
+
+_executors = None
+
+
+def enqueue(func, *args, key):
+    """Run ``func`` on a fan-out worker once the transaction commits.
+
+    Jobs with the same ``key`` go to the same single-threaded worker, so they
+    run in the order they were committed.
+    """
+    global _executors
+    if settings.TIMELINE_FANOUT_WORKERS == 0:
+        transaction.on_commit(lambda: func(*args))
+        return
+    if _executors is None:
+        _executors = [
+            ThreadPoolExecutor(max_workers=1, thread_name_prefix="timeline-fanout")
+            for _ in range(settings.TIMELINE_FANOUT_WORKERS)
+        ]
+    executor = _executors[key % len(_executors)]
+    transaction.on_commit(lambda: executor.submit(_run, func, *args))
+
+
+def _run(func, *args):
+    close_old_connections()
+    try:
+        func(*args)
+    finally:
+        close_old_connections()
+
+
+CELEBRITIES_KEY = "timeline:celebrities"
+
+
+def celebrity_ids():
+    """Sorted ids of the authors above ``TIMELINE_FANOUT_LIMIT``, cached for
+    ``TIMELINE_CELEBRITIES_TTL``.
+    """
+    ids = array("q")
+    cached = cache.get(CELEBRITIES_KEY)
+    if cached is not None:
+        ids.frombytes(cached)
+        return ids
+    ids.extend(
+        User.objects.filter(num_followers__gt=settings.TIMELINE_FANOUT_LIMIT)
+        .order_by("pk")
+        .values_list("pk", flat=True)
+    )
+    cache.set(
+        CELEBRITIES_KEY,
+        ids.tobytes(),
+        settings.TIMELINE_CELEBRITIES_TTL.total_seconds(),
+    )
+    return ids
+
+
+def fans_out(author_id):
+    return not follows.contains(celebrity_ids(), author_id)
+
+
+def follower_ids_in_batches(author_id, batch_size=1000):
+    ids = Follower.objects.filter(followed_id=author_id).values_list(
+        "user_id", flat=True
+    )
+    batch = []
+    for user_id in ids.iterator(chunk_size=batch_size):
+        batch.append(user_id)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def recent_post_entries(author_ids, limit):
+    posts = (
+        Post.objects.filter(author_id__in=author_ids)
+        .order_by("-created_at", "-id")
+        .values_list("id", "created_at")[:limit]
+    )
+    return {post_id: post_score(created_at) for post_id, created_at in posts}
+
+
+def fan_out_post(post_id):
+    post = Post.objects.filter(pk=post_id).first()
+    if post is None:
+        return
+    store = get_store()
+    entries = {post.id: post_score(post.created_at)}
+    store.push([post.author_id], entries)
+    if not fans_out(post.author_id):
+        return
+    for user_ids in follower_ids_in_batches(post.author_id):
+        store.push(user_ids, entries)
+
+
+def retract_post(post_id, author_id, author_fans_out):
+    store = get_store()
+    store.remove([author_id], [post_id])
+    if not author_fans_out:
+        # Never pushed to followers; stale ids are also dropped on hydrate.
+        return
+    for user_ids in follower_ids_in_batches(author_id):
+        store.remove(user_ids, [post_id])
+
+
+def backfill_follow(user_id, followed_id):
+    store = get_store()
+    if not fans_out(followed_id):
+        return
+    entries = recent_post_entries([followed_id], store.max_length)
+    if entries:
+        store.push([user_id], entries)
+
+
+def purge_unfollow(user_id, followed_id):
+    store = get_store()
+    entries = recent_post_entries([followed_id], store.max_length)
+    store.remove([user_id], list(entries))
+
+
+def rebuild_timeline(user_id):
+    store = get_store()
+    followed_ids = (
+        Follower.objects.filter(user_id=user_id)
+        .exclude(followed_id__in=list(celebrity_ids()))
+        .values_list("followed_id", flat=True)
+    )
+    posts = (
+        Post.objects.filter(Q(author_id__in=followed_ids) | Q(author_id=user_id))
+        .order_by("-created_at", "-id")
+        .values_list("id", "created_at")[: store.max_length]
+    )
+    store.build(
+        user_id, [(post_id, post_score(created_at)) for post_id, created_at in posts]
+    )
+
+
+def posts_before(posts, after, limit):
+    """``(score, post_id)`` pairs of the newest ``limit`` of ``posts`` below
+    the ``after`` pair.
+    """
+    if after is not None:
+        created_at = score_datetime(after[0])
+        posts = posts.filter(
+            Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=after[1])
+        )
+    rows = posts.order_by("-created_at", "-id").values_list("id", "created_at")
+    return [(post_score(created_at), post_id) for post_id, created_at in rows[:limit]]
+
+
+def read_timeline(user, cursor=None, limit=10):
+    """Return up to ``limit`` posts older than ``cursor`` plus the next cursor.
+
+    ``cursor`` is a ``(score, post_id)`` pair taken from the last post of the
+    previous page. Authors above ``TIMELINE_FANOUT_LIMIT`` are not fanned out
+    to followers, so their posts are merged in here from the database, as are
+    posts past the end of the stored timeline.
+    """
+    store = get_store()
+    if not store.is_built(user.id):
+        rebuild_timeline(user.id)
+
+    stored = [
+        (score, post_id) for post_id, score in store.read(user.id, cursor, limit + 1)
+    ]
+    entries = set(stored)
+    celebrities = follows.intersect(follows.following_ids(user.id), celebrity_ids())
+    if celebrities:
+        merged = Post.objects.filter(author_id__in=list(celebrities))
+        entries.update(posts_before(merged, cursor, limit + 1))
+    if len(stored) <= limit:
+        # Stored timelines keep only their newest posts; read on from the
+        # database once they run out.
+        followed_ids = Follower.objects.filter(user=user).values("followed_id")
+        followed = Post.objects.filter(
+            Q(author_id__in=followed_ids) | Q(author_id=user.id)
+        )
+        bound = stored[-1] if stored else cursor
+        entries.update(posts_before(followed, bound, limit + 1 - len(stored)))
+
+    ordered = sorted(entries, reverse=True)
+    next_cursor = ordered[limit - 1] if len(ordered) > limit else None
+
+    # Posts deleted since they were pushed simply drop out here.
+    ids = [post_id for _, post_id in ordered[:limit]]
+    posts = Post.objects.with_engagement(user).in_bulk(ids)
+    return [posts[post_id] for post_id in ids if post_id in posts], next_cursor
@@ -0,0 +1,273 @@
+import heapq
+import logging
+import threading
+from collections import defaultdict
+from datetime import datetime, timedelta
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Count, ExpressionWrapper, F, FloatField, Q
+from django.db.models.functions import TruncHour
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Post, PostLike, Comment
+
+logger = logging.getLogger(__name__)
+
+
+class LocalTrendingPool:
+    """Candidate pool kept in process memory."""
+
+    def __init__(self, size):
+        self.size = size
+        self._epoch = None
+        self._scores = {}
+        self._authors = {}
+        self._lock = threading.Lock()
+
+    def epoch(self):
+        return self._epoch
+
+    def replace(self, epoch, scores, authors):
+        with self._lock:
+            self._epoch = epoch
+            self._scores = dict(scores)
+            self._authors = dict(authors)
+
+    def add(self, post_id, author_id, score):
+        with self._lock:
+            self._scores[post_id] = score
+            self._authors[post_id] = author_id
+            if len(self._scores) > self.size:
+                lowest = min(self._scores, key=self._scores.get)
+                del self._scores[lowest]
+                del self._authors[lowest]
+
+    def bump(self, post_id, amount):
+        with self._lock:
+            if post_id in self._scores:
+                self._scores[post_id] += amount
+
+    def remove(self, post_id):
+        with self._lock:
+            self._scores.pop(post_id, None)
+            self._authors.pop(post_id, None)
+
+    def entries(self):
+        with self._lock:
+            return [
+                (post_id, self._authors[post_id], score)
+                for post_id, score in self._scores.items()
+            ]
+
+
+class RedisTrendingPool:
+    """Candidate pool kept in a Redis sorted set of post id -> score, with
+    the post authors in a hash so the pool can be filtered without a query.
+    """
+
+    pool_key = "trending:pool"
+    authors_key = "trending:authors"
+    epoch_key = "trending:epoch"
+
+    # Trims the authors of the members that fall out of the pool with them.
+    ADD_SCRIPT = """
+    redis.call('ZADD', KEYS[1], ARGV[2], ARGV[1])
+    redis.call('HSET', KEYS[2], ARGV[1], ARGV[3])
+    local trimmed = redis.call('ZRANGE', KEYS[1], 0, -tonumber(ARGV[4]) - 1)
+    if #trimmed > 0 then
+        redis.call('ZREMRANGEBYRANK', KEYS[1], 0, #trimmed - 1)
+        redis.call('HDEL', KEYS[2], unpack(trimmed))
+    end
+    """
+
+    def __init__(self, size, url=None):
+        import redis
+
+        self.size = size
+        self.client = redis.Redis.from_url(url or settings.REDIS_URL)
+        self._add = self.client.register_script(self.ADD_SCRIPT)
+
+    def epoch(self):
+        value = self.client.get(self.epoch_key)
+        return datetime.fromisoformat(value.decode()) if value else None
+
+    def replace(self, epoch, scores, authors):
+        pipe = self.client.pipeline()
+        pipe.delete(self.pool_key, self.authors_key)
+        if scores:
+            pipe.zadd(self.pool_key, scores)
+            pipe.hset(self.authors_key, mapping=authors)
+        pipe.set(self.epoch_key, epoch.isoformat())
+        pipe.execute()
+
+    def add(self, post_id, author_id, score):
+        self._add(
+            keys=[self.pool_key, self.authors_key],
+            args=[post_id, score, author_id, self.size],
+        )
+
+    def bump(self, post_id, amount):
+        self.client.zadd(self.pool_key, {post_id: amount}, xx=True, incr=True)
+
+    def remove(self, post_id):
+        pipe = self.client.pipeline()
+        pipe.zrem(self.pool_key, post_id)
+        pipe.hdel(self.authors_key, post_id)
+        pipe.execute()
+
+    def entries(self):
+        pipe = self.client.pipeline()
+        pipe.zrange(self.pool_key, 0, -1, withscores=True)
+        pipe.hgetall(self.authors_key)
+        entries, authors = pipe.execute()
+        return [
+            (int(member), int(authors[member]), score)
+            for member, score in entries
+            if member in authors
+        ]
+
+
+@lru_cache(maxsize=None)
+def get_pool():
+    pool_class = import_string(settings.TRENDING_POOL)
+    return pool_class(**settings.TRENDING_POOL_OPTIONS)
+
+
+def decayed(weight, at, epoch):
+    """Forward-decayed weight of an event at ``at``.
+
+    Scores grow by 2x every half-life after ``epoch`` instead of every older
+    score shrinking, so an event is a single increment and the ranking at
+    any moment matches an exponentially decayed engagement rate.
+    """
+    half_life = settings.TRENDING_HALF_LIFE.total_seconds()
+    return weight * 2 ** ((at - epoch).total_seconds() / half_life)
+
+
+def record_post(post):
+    def add():
+        epoch = get_pool().epoch()
+        if epoch is not None:
+            score = decayed(settings.TRENDING_WEIGHTS["post"], post.created_at, epoch)
+            get_pool().add(post.id, post.author_id, score)
+
+    transaction.on_commit(add)
+
+
+def record_engagement(post_id, kind):
+    def bump():
+        epoch = get_pool().epoch()
+        if epoch is not None:
+            weight = settings.TRENDING_WEIGHTS[kind]
+            get_pool().bump(post_id, decayed(weight, timezone.now(), epoch))
+
+    transaction.on_commit(bump)
+
+
+def discard_post(post_id):
+    transaction.on_commit(lambda: get_pool().remove(post_id))
+
+
+def rebuild_pool():
+    """Rescore recent posts from hourly engagement buckets and swap in the
+    top ``size`` as the new pool, rebasing the decay epoch to the window start.
+    """
+    pool = get_pool()
+    since = timezone.now() - settings.TRENDING_WINDOW
+    epoch = since
+    scores = defaultdict(float)
+    authors = {}
+
+    posts = Post.objects.filter(created_at__gte=since).values_list(
+        "id", "author_id", "created_at"
+    )
+    for post_id, author_id, created_at in posts.iterator(chunk_size=2000):
+        scores[post_id] = decayed(settings.TRENDING_WEIGHTS["post"], created_at, epoch)
+        authors[post_id] = author_id
+
+    for model, kind in ((PostLike, "like"), (Comment, "comment")):
+        buckets = (
+            model.objects.filter(post__created_at__gte=since)
+            .annotate(hour=TruncHour("created_at"))
+            .values("post_id", "hour")
+            .annotate(total=Count("id"))
+            .values_list("post_id", "hour", "total")
+        )
+        weight = settings.TRENDING_WEIGHTS[kind]
+        for post_id, hour, total in buckets.iterator(chunk_size=2000):
+            if post_id in scores:
+                middle = hour + timedelta(minutes=30)
+                scores[post_id] += total * decayed(weight, middle, epoch)
+
+    top = heapq.nlargest(pool.size, scores.items(), key=lambda item: item[1])
+    pool.replace(epoch, dict(top), {post_id: authors[post_id] for post_id, _ in top})
+    return len(top)
+
+
+_rebuilding = threading.Lock()
+
+
+def schedule_rebuild():
+    """Rebuild the pool on a background thread unless one is already running."""
+    if not _rebuilding.acquire(blocking=False):
+        return
+
+    def rebuild():
+        close_old_connections()
+        try:
+            rebuild_pool()
+        except Exception:
+            logger.exception("Rebuilding the trending pool failed")
+        finally:
+            close_old_connections()
+            _rebuilding.release()
+
+    threading.Thread(target=rebuild, name="trending-rebuild", daemon=True).start()
+
+
+def fallback_hits(excluded_author_ids, after, limit):
+    """Rank recent posts by their stored counters, for when the pool is empty."""
+    weights = settings.TRENDING_WEIGHTS
+    posts = (
+        Post.objects.filter(created_at__gte=timezone.now() - settings.TRENDING_WINDOW)
+        .exclude(author_id__in=excluded_author_ids)
+        .annotate(
+            score=ExpressionWrapper(
+                weights["post"]
+                + F("num_likes") * weights["like"]
+                + F("num_comments") * weights["comment"],
+                output_field=FloatField(),
+            )
+        )
+    )
+    if after is not None:
+        score, pk = after
+        posts = posts.filter(Q(score__lt=score) | Q(score=score, pk__lt=pk))
+    hits = posts.order_by("-score", "-pk").values_list("score", "pk")[:limit]
+    return [(float(score), pk) for score, pk in hits]
+
+
+def explore_hits(excluded_author_ids, after=None, limit=10):
+    """Return ``(score, post_id)`` pairs from the pool, best first, skipping
+    the given authors and anything at or above the ``after`` cursor.
+
+    Until the pool has been built, hits are ranked from the database while
+    it is rebuilt in the background.
+    """
+    pool = get_pool()
+    if pool.epoch() is None:
+        schedule_rebuild()
+        return fallback_hits(excluded_author_ids, after, limit)
+    hits = sorted(
+        (
+            (score, post_id)
+            for post_id, author_id, score in pool.entries()
+            if author_id not in excluded_author_ids
+            and (after is None or (score, post_id) < after)
+        ),
+        reverse=True,
+    )
+    return hits[:limit]
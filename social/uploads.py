@@ -0,0 +1,204 @@
+import fcntl
+import hashlib
+import os
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import APIException, ValidationError
+
+from .media import check_uploads, media_type, stored_uploads
+from .models import Media, Post, UploadSession
+
+BLOCK_SIZE = 64 * 1024
+
+
+class UploadConflict(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = "The upload is not at that offset."
+    default_code = "conflict"
+
+
+class SessionFile(File):
+    """Hands the assembled file to storage by path, so file system storage
+    moves it into place instead of copying it. It is given a hard link to the
+    session's file, which stays put until the media row is committed.
+    """
+
+    def __init__(self, path, name):
+        super().__init__(open(path, "rb"), name)
+        self.path = path
+
+    def temporary_file_path(self):
+        return self.path
+
+
+def session_path(session):
+    return os.path.join(settings.UPLOAD_SESSION_DIR, f"{session.pk}.part")
+
+
+def start_session(owner, filename, size, checksum=""):
+    filename = os.path.basename(filename)
+    if media_type(filename) is None:
+        raise ValidationError({"filename": "Unsupported file type."})
+    if not 0 < size <= settings.UPLOAD_MAX_SIZE:
+        raise ValidationError(
+            {"size": f"Uploads must be between 1 and {settings.UPLOAD_MAX_SIZE} bytes."}
+        )
+    session = UploadSession.objects.create(
+        owner=owner,
+        filename=filename,
+        size=size,
+        chunk_size=settings.UPLOAD_CHUNK_SIZE,
+        checksum=checksum.lower(),
+        expires_at=timezone.now() + settings.UPLOAD_SESSION_TTL,
+    )
+    os.makedirs(settings.UPLOAD_SESSION_DIR, exist_ok=True)
+    open(session_path(session), "xb").close()
+    return session
+
+
+def received(session):
+    try:
+        return os.path.getsize(session_path(session))
+    except FileNotFoundError:
+        return 0
+
+
+@contextmanager
+def locked(session):
+    """Open the session's file, held exclusively for one request at a time."""
+    try:
+        file = open(session_path(session), "r+b")
+    except FileNotFoundError:
+        raise ValidationError("The upload has expired.")
+    with file:
+        try:
+            fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise UploadConflict("Another request is writing to this upload.")
+        yield file
+
+
+def write_chunk(session, index, stream, length, checksum=""):
+    """Write chunk ``index`` from ``stream`` straight to disk, block by block,
+    and return the number of bytes received so far.
+
+    Chunks must arrive in order. Resending one that was already received
+    rewrites the upload from there, so a client can resume from the last
+    chunk it is unsure of.
+    """
+    offset = index * session.chunk_size
+    if length <= 0 or length != min(session.chunk_size, session.size - offset):
+        raise ValidationError("Chunks must be chunk_size bytes, except the last.")
+    with locked(session) as file:
+        if os.fstat(file.fileno()).st_nlink > 1:
+            # Stored by a completion that did not commit, and now also a blob.
+            raise UploadConflict("The upload is complete; complete it again.")
+        end = file.seek(0, os.SEEK_END)
+        if offset > end:
+            raise UploadConflict(f"Expected the chunk at offset {end}.")
+        file.seek(offset)
+        file.truncate()
+        digest = hashlib.sha256()
+        remaining = length
+        while remaining:
+            block = stream.read(min(BLOCK_SIZE, remaining))
+            if not block:
+                break
+            file.write(block)
+            digest.update(block)
+            remaining -= len(block)
+        if remaining or (checksum and digest.hexdigest() != checksum.lower()):
+            # A cut-off or corrupted chunk is dropped; the client resends it.
+            file.truncate(offset)
+            raise ValidationError("The chunk is incomplete or its checksum differs.")
+        file.flush()
+        end = file.tell()
+    UploadSession.objects.filter(pk=session.pk).update(
+        expires_at=timezone.now() + settings.UPLOAD_SESSION_TTL
+    )
+    return end
+
+
+@contextmanager
+def staged(session):
+    """Yield a hard link to the session's file, for storage to move."""
+    path = session_path(session)
+    staged_path = f"{path}.staged"
+    # Left over if a previous attempt was interrupted.
+    remove_file(staged_path)
+    os.link(path, staged_path)
+    try:
+        yield staged_path
+    finally:
+        remove_file(staged_path)
+
+
+def complete_session(session, post):
+    """Verify the assembled file and attach it to ``post`` as ``Media``.
+
+    The session and its file are only removed once the media row is
+    committed, so a completion that fails can be retried.
+    """
+    with locked(session) as file:
+        if file.seek(0, os.SEEK_END) != session.size:
+            raise ValidationError("The upload is not complete.")
+        if session.checksum:
+            file.seek(0)
+            digest = hashlib.sha256()
+            while block := file.read(BLOCK_SIZE):
+                digest.update(block)
+            if digest.hexdigest() != session.checksum:
+                raise ValidationError("The file does not match its checksum.")
+        with staged(session) as path, SessionFile(path, session.filename) as upload:
+            # Checked before storing the file, and again with the post locked
+            # against other uploads completing into it.
+            check_uploads([upload], existing=post.media_count())
+            with stored_uploads([upload]) as (name,), transaction.atomic():
+                post = Post.objects.select_for_update().get(pk=post.pk)
+                (kind,) = check_uploads([upload], existing=post.media_count())
+                media = Media.objects.create(post=post, file=name, type=kind)
+                part = session_path(session)
+                session.delete()
+                transaction.on_commit(lambda: remove_file(part))
+    return media
+
+
+def remove_file(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def discard_session(session):
+    path = session_path(session)
+    session.delete()
+    remove_file(path)
+
+
+def expire_sessions():
+    """Delete expired sessions, and every file without a live session.
+    Returns the number of files removed.
+    """
+    if not os.path.isdir(settings.UPLOAD_SESSION_DIR):
+        return 0
+    # Listed before the sessions are read, so files of sessions started in
+    # between are not mistaken for orphans.
+    names = os.listdir(settings.UPLOAD_SESSION_DIR)
+    UploadSession.objects.filter(expires_at__lte=timezone.now()).delete()
+    live = {str(pk) for pk in UploadSession.objects.values_list("pk", flat=True)}
+    removed = 0
+    for name in names:
+        # Session files and their staged links are named after the session.
+        if name.endswith((".part", ".staged")) and name.split(".")[0] not in live:
+            try:
+                os.remove(os.path.join(settings.UPLOAD_SESSION_DIR, name))
+            except FileNotFoundError:
+                continue
+            removed += 1
+    return removed
@@ -11,6 +11,7 @@ from .views import (
     SuggestedUsersViewSet,
     ExplorePostsViewSet,
     SearchViewSet,
+    UploadViewSet,
 )
 
 router = DefaultRouter()
@@ -18,6 +19,7 @@ router.register(r"posts", PostViewSet)
 router.register(r"comments", CommentViewSet)
 router.register(r"replies", ReplyViewSet)
 router.register(r"media", MediaViewSet)
+router.register(r"uploads", UploadViewSet, basename="uploads")
 router.register(r"followers", FollowerViewSet)
 router.register(r"users", UserViewSet)
 router.register(r"home/posts", HomePagePostsViewSet, basename="home-posts")
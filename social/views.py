@@ -1,9 +1,10 @@
+from functools import partial
+
 from rest_framework import viewsets, status, permissions
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, IsAuthenticatedOrReadOnly
-from rest_framework.pagination import PageNumberPagination
-from django.db.models import Count, Q
+from django.db import transaction
 from django.shortcuts import get_object_or_404
 from rest_framework.parsers import MultiPartParser, FormParser
 from notifications.utils import send_notification
@@ -17,13 +18,28 @@ from .models import (
     CommentLike,
     ReplyLike,
     Follower,
+    UploadSession,
+)
+from .follows import following_ids, mutual_ids
+from .media import check_uploads, stored_uploads
+from .uploads import complete_session, discard_session, start_session, write_chunk
+from . import blobs, images
+from .pagination import (
+    IdListPagination,
+    KeysetPagination,
+    RankedPagination,
+    TimelinePagination,
 )
+from .search import get_backend
+from .suggestions import suggested_user_ids
+from .trending import explore_hits
 from .serializers import (
     PostSerializer,
     CommentSerializer,
     ReplySerializer,
     MediaSerializer,
     FollowerSerializer,
+    UploadSessionSerializer,
 )
 from account.serializers import UserSerializer
 from account.models import User
@@ -36,41 +52,35 @@ class IsAuthorOrReadOnly(permissions.BasePermission):
         return obj.author == request.user
 
 
-class CustomPagination(PageNumberPagination):
-    page_size = 10
-    page_size_query_param = "page_size"
-    max_page_size = 100
-
-    def get_paginated_response(self, data):
-        return Response(
-            {
-                "count": self.page.paginator.count,
-                "next": self.get_next_link(),
-                "previous": self.get_previous_link(),
-                "current_page": self.page.number,
-                "total_pages": self.page.paginator.num_pages,
-                "results": data,
-            }
-        )
-
-
 class PostViewSet(viewsets.ModelViewSet):
     queryset = Post.objects.all().order_by("-created_at")
     serializer_class = PostSerializer
     permission_classes = [IsAuthenticatedOrReadOnly]
-    pagination_class = CustomPagination
+    pagination_class = KeysetPagination
     parser_classes = [MultiPartParser, FormParser]
 
+    def get_queryset(self):
+        return Post.objects.with_engagement(self.request.user).order_by("-created_at")
+
     def get_serializer_context(self):
         context = super().get_serializer_context()
         context["request"] = self.request
         return context
 
     def perform_create(self, serializer):
-        post = serializer.save(author=self.request.user)
         files = self.request.FILES.getlist("media")
-        for file in files:
-            Media.objects.create(post=post, file=file)
+        types = check_uploads(files)
+        # Files are written before the transaction so it stays short; any
+        # left unreferenced when it fails are removed by collect_blobs.
+        with stored_uploads(files) as names, transaction.atomic():
+            post = serializer.save(author=self.request.user)
+            media = Media.objects.bulk_create(
+                Media(post=post, file=name, type=kind)
+                for name, kind in zip(names, types)
+            )
+            # bulk_create skips the signals counting blob references.
+            blobs.retain(names)
+            images.enqueue("media", [item.pk for item in media if item.type == "image"])
 
     @action(detail=True, methods=["post"])
     def like(self, request, pk=None):
@@ -86,9 +96,10 @@ class PostViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=["get"])
     def comments(self, request, pk=None):
         post = self.get_object()
-        comments = Comment.objects.filter(post=post)
-        serializer = CommentSerializer(comments, many=True)
-        return Response(serializer.data)
+        comments = Comment.objects.filter(post=post).with_engagement(request.user)
+        page = self.paginate_queryset(comments)
+        serializer = CommentSerializer(page, many=True, context={"request": request})
+        return self.get_paginated_response(serializer.data)
 
     @action(detail=True, methods=["get"])
     def likers(self, request, pk=None):
@@ -102,7 +113,12 @@ class CommentViewSet(viewsets.ModelViewSet):
     queryset = Comment.objects.all().order_by("-created_at")
     serializer_class = CommentSerializer
     permission_classes = [IsAuthenticated]
-    pagination_class = CustomPagination
+    pagination_class = KeysetPagination
+
+    def get_queryset(self):
+        return Comment.objects.with_engagement(self.request.user).order_by(
+            "-created_at"
+        )
 
     def perform_create(self, serializer):
         comment = serializer.save(author=self.request.user)
@@ -127,9 +143,10 @@ class CommentViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=["get"])
     def replies(self, request, pk=None):
         comment = self.get_object()
-        replies = Reply.objects.filter(comment=comment)
-        serializer = ReplySerializer(replies, many=True)
-        return Response(serializer.data)
+        replies = Reply.objects.filter(comment=comment).with_engagement(request.user)
+        page = self.paginate_queryset(replies)
+        serializer = ReplySerializer(page, many=True, context={"request": request})
+        return self.get_paginated_response(serializer.data)
 
     @action(detail=True, methods=["get"])
     def likers(self, request, pk=None):
@@ -143,7 +160,10 @@ class ReplyViewSet(viewsets.ModelViewSet):
     queryset = Reply.objects.all().order_by("-created_at")
     serializer_class = ReplySerializer
     permission_classes = [IsAuthenticatedOrReadOnly, IsAuthorOrReadOnly]
-    pagination_class = CustomPagination
+    pagination_class = KeysetPagination
+
+    def get_queryset(self):
+        return Reply.objects.with_engagement(self.request.user).order_by("-created_at")
 
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
@@ -175,41 +195,84 @@ class MediaViewSet(viewsets.ModelViewSet):
         serializer.save(author=self.request.user)
 
 
-from rest_framework.pagination import PageNumberPagination
-from rest_framework.response import Response
+class UploadViewSet(viewsets.GenericViewSet):
+    """Resumable uploads: create a session, PUT its chunks in order to
+    ``chunks/<index>/``, then complete it into one of your posts' media.
+    """
 
+    serializer_class = UploadSessionSerializer
+    permission_classes = [IsAuthenticated]
 
-class DynamicPageSizePagination(PageNumberPagination):
-    page_size = 10
-    page_size_query_param = "page_size"
-    max_page_size = 100
+    def get_queryset(self):
+        return UploadSession.objects.filter(owner=self.request.user)
 
-    def get_paginated_response(self, data):
+    def create(self, request):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        session = start_session(request.user, **serializer.validated_data)
         return Response(
-            {
-                "count": self.page.paginator.count,
-                "next": self.get_next_link(),
-                "previous": self.get_previous_link(),
-                "current_page": self.page.number,
-                "total_pages": self.page.paginator.num_pages,
-                "results": data,
-            }
+            self.get_serializer(session).data, status=status.HTTP_201_CREATED
         )
 
+    def retrieve(self, request, pk=None):
+        return Response(self.get_serializer(self.get_object()).data)
+
+    def destroy(self, request, pk=None):
+        discard_session(self.get_object())
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    @action(detail=True, methods=["put"], url_path=r"chunks/(?P<index>\d+)")
+    def chunk(self, request, pk=None, index=None):
+        session = self.get_object()
+        try:
+            length = int(request.META.get("CONTENT_LENGTH") or 0)
+        except ValueError:
+            length = 0
+        # The body is streamed to disk; request.data is never parsed.
+        received = write_chunk(
+            session,
+            int(index),
+            request.stream,
+            length,
+            request.headers.get("Upload-Checksum", ""),
+        )
+        return Response({"received": received})
+
+    @action(detail=True, methods=["post"])
+    def complete(self, request, pk=None):
+        session = self.get_object()
+        try:
+            post_id = int(request.data.get("post"))
+        except (TypeError, ValueError):
+            return Response(
+                {"post": "post must be an integer."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        post = get_object_or_404(Post, pk=post_id, author=request.user)
+        media = complete_session(session, post)
+        serializer = MediaSerializer(media, context={"request": request})
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
 
 class HomePagePostsViewSet(viewsets.ModelViewSet):
     serializer_class = PostSerializer
     permission_classes = [IsAuthenticated]
-    pagination_class = DynamicPageSizePagination
+    pagination_class = TimelinePagination
+
+    def list(self, request, *args, **kwargs):
+        # Served from the precomputed timeline store; get_queryset below is
+        # only used for single-post lookups.
+        posts = self.paginator.paginate_timeline(request, request.user)
+        serializer = self.get_serializer(posts, many=True)
+        return self.paginator.get_paginated_response(serializer.data)
 
     def get_queryset(self):
         user = self.request.user
-        following_users = Follower.objects.filter(user=user).values_list(
-            "followed", flat=True
+        return (
+            Post.objects.filter(author_id__in=[*following_ids(user.id), user.id])
+            .with_engagement(user)
+            .order_by("-created_at")
         )
-        return Post.objects.filter(
-            Q(author__in=following_users) | Q(author=user)
-        ).order_by("-created_at")
 
 
 class FollowerViewSet(viewsets.ModelViewSet):
@@ -244,25 +307,28 @@ class UserViewSet(viewsets.ReadOnlyModelViewSet):
     serializer_class = UserSerializer
     permission_classes = [IsAuthenticatedOrReadOnly]
     lookup_field = "username"
-    pagination_class = CustomPagination
+    pagination_class = KeysetPagination
 
     @action(detail=True, methods=["get"])
     def posts(self, request, username=None):
         user = self.get_object()
-        posts = Post.objects.filter(author=user).order_by("-created_at")
+        posts = (
+            Post.objects.filter(author=user)
+            .with_engagement(request.user)
+            .order_by("-created_at")
+        )
         page = self.paginate_queryset(posts)
-        if page is not None:
-            serializer = PostSerializer(page, many=True)
-            return self.get_paginated_response(serializer.data)
-        serializer = PostSerializer(posts, many=True)
-        return Response(serializer.data)
+        serializer = PostSerializer(
+            page, many=True, context=self.get_serializer_context()
+        )
+        return self.get_paginated_response(serializer.data)
 
     @action(detail=True, methods=["get"])
     def post(self, request, username=None, pk=None):
         user = self.get_object()
         try:
-            post = Post.objects.get(author=user, pk=pk)
-            serializer = PostSerializer(post)
+            post = Post.objects.with_engagement(request.user).get(author=user, pk=pk)
+            serializer = PostSerializer(post, context=self.get_serializer_context())
             return Response(serializer.data)
         except Post.DoesNotExist:
             return Response({"detail": "Not found."}, status=status.HTTP_404_NOT_FOUND)
@@ -270,43 +336,35 @@ class UserViewSet(viewsets.ReadOnlyModelViewSet):
     @action(detail=True, methods=["get"])
     def followers(self, request, username=None):
         user = self.get_object()
-        followers = User.objects.filter(following__followed=user).order_by(
-            "-following__created_at"
-        )
-        page = self.paginate_queryset(followers)
-        if page is not None:
-            serializer = UserSerializer(page, many=True)
-            return self.get_paginated_response(serializer.data)
-        serializer = UserSerializer(followers, many=True)
-        return Response(serializer.data)
+        # Page over the follow rows so the cursor is the follow's own
+        # (created_at, id) rather than the user's.
+        follows = Follower.objects.filter(followed=user).select_related("user")
+        page = self.paginate_queryset(follows)
+        serializer = UserSerializer([follow.user for follow in page], many=True)
+        return self.get_paginated_response(serializer.data)
 
     @action(detail=True, methods=["get"])
     def following(self, request, username=None):
         user = self.get_object()
-        following = User.objects.filter(followers__user=user).order_by(
-            "-followers__created_at"
-        )
-        page = self.paginate_queryset(following)
-        if page is not None:
-            serializer = UserSerializer(page, many=True)
-            return self.get_paginated_response(serializer.data)
-        serializer = UserSerializer(following, many=True)
-        return Response(serializer.data)
+        follows = Follower.objects.filter(user=user).select_related("followed")
+        page = self.paginate_queryset(follows)
+        serializer = UserSerializer([follow.followed for follow in page], many=True)
+        return self.get_paginated_response(serializer.data)
 
     @action(detail=True, methods=["get"], permission_classes=[IsAuthenticated])
     def mutual_connections(self, request, username=None):
         user = self.get_object()
-        current_user = request.user
-
-        # Get users that the current user follows
-        current_user_following = Follower.objects.filter(user=current_user).values_list(
-            "followed", flat=True
+        ids = mutual_ids(request.user.id, user)
+        # ?count_only=true is the cheap form used for profile badges.
+        if request.query_params.get("count_only") == "true":
+            return Response({"count": len(ids)})
+        paginator = IdListPagination()
+        page = paginator.paginate_ids(request, ids)
+        users = User.objects.in_bulk(page)
+        serializer = UserSerializer(
+            [users[pk] for pk in page if pk in users], many=True
         )
-
-        mutual_connections = User.objects.filter(id__in=current_user_following)
-
-        serializer = UserSerializer(mutual_connections, many=True)
-        return Response(serializer.data)
+        return paginator.get_paginated_response(serializer.data)
 
 
 class SuggestedUsersViewSet(viewsets.ReadOnlyModelViewSet):
@@ -314,56 +372,42 @@ class SuggestedUsersViewSet(viewsets.ReadOnlyModelViewSet):
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
-        user = self.request.user
-        following = Follower.objects.filter(user=user).values_list(
-            "followed", flat=True
-        )
-
-        if not following:
-            suggested_users = (
-                User.objects.exclude(id=user.id)
-                .annotate(mutuals=Count("followers"))
-                .order_by("-mutuals")[:10]
-            )
-        else:
-            suggested_users = (
-                User.objects.exclude(id__in=following)
-                .exclude(id=user.id)
-                .annotate(mutuals=Count("followers", filter=Q(followers__user=user)))
-                .order_by("-mutuals")[:10]
-            )
-
-        return suggested_users
+        self.suggested_ids = suggested_user_ids(self.request.user)
+        return User.objects.filter(pk__in=self.suggested_ids)
 
     def list(self, request, *args, **kwargs):
-        queryset = self.get_queryset()
-        page = self.paginate_queryset(queryset)
-        if page is not None:
-            serializer = self.get_serializer(page, many=True)
-            return self.get_paginated_response(serializer.data)
-        serializer = self.get_serializer(queryset, many=True)
+        # Listed in suggestion rank, which the queryset does not carry.
+        users = self.get_queryset().in_bulk()
+        serializer = self.get_serializer(
+            [users[pk] for pk in self.suggested_ids if pk in users], many=True
+        )
         return Response(serializer.data)
 
 
 class ExplorePostsViewSet(viewsets.ReadOnlyModelViewSet):
     serializer_class = PostSerializer
     permission_classes = [IsAuthenticated]
-    pagination_class = DynamicPageSizePagination
+    pagination_class = RankedPagination
 
     def get_queryset(self):
-        user = self.request.user
-        following_users = Follower.objects.filter(user=user).values_list(
-            "followed", flat=True
-        )
+        return Post.objects.with_engagement(self.request.user)
 
-        # Get posts from users that the current user is not following
-        explore_posts = (
-            Post.objects.exclude(author__in=following_users)
-            .exclude(author=user)
-            .order_by("-created_at")
+    def list(self, request, *args, **kwargs):
+        # Ranked from the precomputed trending pool rather than the Post table;
+        # posts by the user and by accounts they follow are skipped in memory.
+        user = request.user
+        excluded = set(following_ids(user.id))
+        excluded.add(user.id)
+        ids = self.paginator.paginate_hits(
+            request, partial(explore_hits, excluded), self.paginator.page_size
+        )
+        posts = self.get_queryset().in_bulk(ids)
+        serializer = self.get_serializer(
+            [posts[pk] for pk in ids if pk in posts], many=True
+        )
+        return Response(
+            {"next": self.paginator.get_next_link(), "results": serializer.data}
         )
-
-        return explore_posts
 
 
 class SearchViewSet(viewsets.ViewSet):
@@ -373,20 +417,38 @@ class SearchViewSet(viewsets.ViewSet):
         if not query:
             return Response({"results": []})
 
-        users = User.objects.filter(
-            Q(username__icontains=query) | Q(first_name__icontains=query)
-        )[:10]
-
-        posts = Post.objects.filter(
-            Q(content__icontains=query) | Q(author__username__icontains=query)
-        )[:20]
-
-        user_serializer = UserSerializer(users, many=True)
-        post_serializer = PostSerializer(posts, many=True)
-
-        results = {
-            "profiles": user_serializer.data,
-            "posts": post_serializer.data,
-        }
+        # Without ?type= the first page of both kinds is returned; the next
+        # links carry ?type= so each kind pages on its own cursor.
+        kind = request.query_params.get("type")
+        if kind not in (None, "profiles", "posts"):
+            return Response(
+                {"type": "type must be profiles or posts."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        backend = get_backend()
+        context = {"request": request}
+        results = {}
+
+        if kind in (None, "profiles"):
+            paginator = RankedPagination()
+            ids = paginator.paginate_hits(
+                request, partial(backend.search_users, query), 10, "profiles"
+            )
+            users = User.objects.in_bulk(ids)
+            results["profiles"] = UserSerializer(
+                [users[pk] for pk in ids if pk in users], many=True, context=context
+            ).data
+            results["profiles_next"] = paginator.get_next_link()
+
+        if kind in (None, "posts"):
+            paginator = RankedPagination()
+            ids = paginator.paginate_hits(
+                request, partial(backend.search_posts, query), 20, "posts"
+            )
+            posts = Post.objects.with_engagement(request.user).in_bulk(ids)
+            results["posts"] = PostSerializer(
+                [posts[pk] for pk in ids if pk in posts], many=True, context=context
+            ).data
+            results["posts_next"] = paginator.get_next_link()
 
         return Response(results)